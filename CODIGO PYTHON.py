@@ -15,8 +15,12 @@ ESTRUCTURA DEL DASHBOARD - REORGANIZADO Y OPTIMIZADO
 
 2. CARGA Y VALIDACIÓN DE DATOS
    └─ Funciones de detección automática de hojas Excel
+   └─ Ingesta en hilo de fondo (progreso por hoja y por paso de limpieza)
+   └─ Caché de datasets compartida entre sesiones (hash, LRU, presupuesto de memoria)
    └─ Auto-detección de columnas (lat, lon, CH4, emission rate, viento, etc.)
    └─ Validación y limpieza profunda de datos
+   └─ Normalización de nombres de instalación (diccionario canónico + alias)
+   └─ Sketches de cuantiles por instalación/campo (umbrales y percentiles)
    └─ Filtros por campo operativo (Chichimene, Castilla, etc.)
 
 3. SECCIÓN DE KPIs PRINCIPALES
@@ -35,6 +39,8 @@ ESTRUCTURA DEL DASHBOARD - REORGANIZADO Y OPTIMIZADO
    │ • Popups informativos con datos completos                           │
    │ • Navegación automática a puntos máximo/mínimo                      │
    │ • Colormap con gradiente verde → amarillo → rojo                    │
+   │ • Puntos cercanos al punto seleccionado (índice de grilla)          │
+   │ • Capa de puntos calientes/fríos Getis-Ord Gi* (emission rate)      │
    └─────────────────────────────────────────────────────────────────────┘
 
    ┌─────────────────────────────────────────────────────────────────────┐
@@ -44,52 +50,72 @@ ESTRUCTURA DEL DASHBOARD - REORGANIZADO Y OPTIMIZADO
    │ 📌 SECCIÓN 1: ANÁLISIS DE TASA DE EMISIÓN (EMISSION RATE)          │
    │    ├─ Ranking de instalaciones (barras horizontales + tabla)        │
    │    ├─ Filtros: Top N, métricas (Total/Promedio/Máximo)             │
-   │    ├─ Estadísticas por instalación                                  │
-   │    └─ KPIs: Total instalaciones, Emisión total, Promedio, Mayor     │
+   │    ├─ Estadísticas por instalación (IC bootstrap media y total)     │
+   │    ├─ KPIs: Total instalaciones, Emisión total, Promedio, Mayor     │
+   │    ├─ Fuentes persistentes (DBSCAN por grilla, persistencia %)      │
+   │    └─ Puntos calientes Gi* por instalación (vecindad dispersa)      │
    │                                                                      │
    │ 📌 SECCIÓN 2: CORRELACIÓN EMISSION RATE VS CONCENTRACIÓN            │
    │    ├─ Scatter plot multicolor por instalación                       │
+   │    ├─ Modo WebGL + decimación para datasets masivos                 │
    │    ├─ Análisis por cuadrantes (Crítico, Anomalía, Revisar, Óptimo) │
    │    ├─ Métricas de cada cuadrante                                    │
-   │    └─ Tablas de instalaciones críticas y anómalas                   │
+   │    ├─ Tablas de instalaciones críticas y anómalas                   │
+   │    ├─ Barrido de umbrales (sensibilidad por cuadrante)              │
+   │    └─ Inversión de pluma gaussiana (tasa corregida por viento)      │
    │                                                                      │
    │ 📌 SECCIÓN 3: SERIE TEMPORAL DE EMISSION RATE                       │
    │    ├─ Gráfico de líneas con evolución temporal                      │
+   │    ├─ Reducción de puntos por instalación (LTTB / mín-máx)          │
    │    ├─ Filtro de instalaciones y agregación temporal                 │
+   │    ├─ Cubo temporal hora/día/semana ISO/mes (claves enteras)        │
    │    ├─ Análisis de patrones (Intermitentes, Tendencias, Picos)       │
-   │    └─ Detección automática de anomalías temporales                  │
+   │    ├─ Tendencias OLS / Theil-Sen / Mann-Kendall (exportables)       │
+   │    ├─ Detección de anomalías temporales (EWMA + z robusto)          │
+   │    ├─ Cambios de régimen por instalación (PELT, sombreados)         │
+   │    └─ Perfil diurno/semanal por instalación (hora local)            │
    │                                                                      │
    │ 📌 SECCIÓN 4: INVENTARIO DE EMISIONES ACUMULADAS                    │
    │    ├─ Vista Total del Dataset vs Acumulado Mensual                  │
+   │    ├─ Masa integrada kg / tCO₂e (mensual y anual, persistencia)     │
    │    ├─ Gráfico de barras con % del total                             │
    │    ├─ Tabla pivot mensual (si hay datos temporales)                 │
    │    └─ KPIs: Emisión total, Top 3%, Promedio, Mayor emisor          │
    │                                                                      │
    │ 📌 SECCIÓN 5: ANÁLISIS DE CONCENTRACIÓN DE METANO                   │
    │    ├─ Filtros: Mínimo mediciones, Top N, Ordenamiento               │
-   │    ├─ 3 visualizaciones: Boxplot, Scatter, Barras con error         │
+   │    ├─ 3 visualizaciones: Boxplot, Scatter, Barras con error (DE/IC) │
+   │    ├─ Cajas precalculadas por instalación (una pasada agrupada)     │
    │    ├─ Tabla de estadísticas por instalación                         │
    │    └─ Fallback para datasets sin Facility Name                      │
    │                                                                      │
+   │ 📌 SECCIÓN 6: COMPARACIÓN ECOPETROL VS CARLETON                     │
+   │    ├─ Emparejamiento por nombre normalizado + trigramas             │
+   │    └─ Deltas, regresión con R² y factores de reconciliación         │
+   │                                                                      │
    └─────────────────────────────────────────────────────────────────────┘
 
    ┌─────────────────────────────────────────────────────────────────────┐
    │ TAB 3: 💨 ANÁLISIS DE VELOCIDAD DE VIENTO                          │
    ├─────────────────────────────────────────────────────────────────────┤
-   │ • Histograma de distribución de velocidad                           │
-   │ • Box plot de estadísticas                                          │
+   │ • Histograma de velocidad (bins precalculados, np.histogram)        │
+   │ • Box plot con cuartiles/bigotes precalculados                      │
    │ • Serie temporal (si hay datos de fecha/hora)                       │
    │ • Métricas: Promedio, Máximo, Mínimo, Desv. Estándar               │
+   │ • Rosa de vientos (16 sectores × clases) y por instalación         │
    │ • Soporte para datos de Extended y Summary                          │
+   │ • Viento de Extended unido a cada detección (as-of, tolerancia)     │
    └─────────────────────────────────────────────────────────────────────┘
 
    ┌─────────────────────────────────────────────────────────────────────┐
    │ TAB 4: 📈 ESTADÍSTICAS DETALLADAS Y EXPORTACIÓN                    │
    ├─────────────────────────────────────────────────────────────────────┤
-   │ • Histograma de distribución de CH₄                                 │
-   │ • Box plot de concentración                                         │
-   │ • Tabla de datos completos (scrollable)                             │
-   │ • Botón de descarga CSV                                             │
+   │ • Histograma de CH₄ (bins precalculados en el servidor)             │
+   │ • Box plot de concentración (cuartiles + outliers acotados)         │
+   │ • Normalización de instalaciones (variantes fusionadas)             │
+   │ • Percentiles por campo (sketches fusionables entre reportes)       │
+   │ • Tabla paginada en servidor (orden, filtro, columnas)              │
+   │ • Exportación bajo demanda (CSV/CSV.gz, Parquet, GeoJSON)           │
    └─────────────────────────────────────────────────────────────────────┘
 
 ═══════════════════════════════════════════════════════════════════════════════
@@ -107,6 +133,14 @@ CARACTERÍSTICAS CLAVE
 """
 
 import os
+import io
+import gzip
+import math
+import time
+import hashlib
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import streamlit as st
@@ -117,6 +151,11 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 
+# Copy-on-Write: las sesiones trabajan sobre copias superficiales de los datasets compartidos
+# (siempre activo desde pandas 3; en pandas 2.2 se activa aquí)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
 # ══════════════════════════════════════════════════════════════════════
 # 1. CONFIGURACIÓN GLOBAL Y PALETA DE COLORES
 # ══════════════════════════════════════════════════════════════════════
@@ -134,6 +173,10 @@ ENERGY_COLORS = {
     'info': '#3498DB'          # Azul información
 }
 
+# Valores por defecto de los controles del sidebar (usados antes de definir los motores de análisis)
+SOURCE_RADIUS_M = 30.0      # Radio para considerar dos detecciones como la misma fuente
+GI_BAND_M = 100.0           # Banda de distancia de la vecindad Gi* (pesos binarios)
+
 # ══════════════════════════════════════════════════════════════════════
 # 2. CONFIGURACIÓN DE PÁGINA Y ESTILOS CSS
 # ══════════════════════════════════════════════════════════════════════
@@ -316,12 +359,13 @@ def find_data_sheet(xls):
     
     return xls.sheet_names[0], 0
 
-def load_all_relevant_sheets(xls):
+def find_relevant_sheet_headers(xls):
     """
-    Carga todas las hojas relevantes del archivo Excel
+    Escanea las hojas relevantes del archivo Excel (solo las primeras 20 filas)
     Prioriza hojas con datos de emisiones y viento
+    Retorna {hoja: fila de cabecera}
     """
-    sheets_data = {}
+    headers = {}
     
     # Hojas prioritarias
     priority_sheets = ['Emission Location Summary', 'Emission Location Extended']
@@ -332,14 +376,148 @@ def load_all_relevant_sheets(xls):
                 df_temp = pd.read_excel(xls, sheet_name=sheet, header=None, nrows=20)
                 for idx in range(len(df_temp)):
                     if any('latitude' in str(val).lower() or 'longitude' in str(val).lower() or 'wind' in str(val).lower() for val in df_temp.iloc[idx]):
-                        df = pd.read_excel(xls, sheet_name=sheet, header=idx)
-                        df.columns = df.columns.str.strip()
-                        sheets_data[sheet] = df
+                        headers[sheet] = idx
                         break
             except Exception:
                 continue
     
-    return sheets_data
+    return headers
+
+# ══════════════════════════════════════════════════════════════════════
+# 4.1.1 INGESTA EN SEGUNDO PLANO (HILO DE FONDO CON PROGRESO)
+# ══════════════════════════════════════════════════════════════════════
+
+INGEST_POLL_S = 0.5  # Intervalo de refresco de la barra de progreso mientras se lee el libro
+
+def analysis_parameter_sliders():
+    """
+    Parámetros del análisis que no dependen de los datos (radio de fuente, banda Gi*)
+    Se dibujan con clave fija: primero en el sidebar de la ingesta, tras el escaneo de
+    cabeceras, y luego en el sidebar completo, conservando el valor elegido
+    """
+    source_radius = st.slider(
+        "🎯 Radio de fuente persistente (m):",
+        min_value=5, max_value=200, value=int(SOURCE_RADIUS_M), step=5, key='source_radius_m',
+        help="Detecciones a menos de esta distancia (encadenadas) se consolidan como una misma fuente"
+    )
+    band = st.slider(
+        "🔥 Banda de vecindad Gi* (m):",
+        min_value=25, max_value=1000, value=int(GI_BAND_M), step=25, key='hotspot_band_m',
+        help="Distancia dentro de la cual dos detecciones se consideran vecinas para el estadístico Getis-Ord Gi*"
+    )
+    return source_radius, band
+
+def _ingest_step(job, progress, message):
+    """Publica el avance del hilo de ingesta (el script lo lee en cada refresco)"""
+    job['progreso'], job['paso'] = progress, message
+    job['bitacora'].append(message)
+
+def ingest_workbook(job, file_bytes):
+    """
+    Lectura del libro Excel en un hilo de fondo (sin llamadas a Streamlit)
+    1. Escaneo de cabeceras: hoja principal y hojas de viento; publica job['cabecera']
+    2. Lectura hoja por hoja con progreso; cada par (hoja, cabecera) se lee una sola vez
+    Deja en job['resultado'] la tupla (datos principales, {hoja: DataFrame}) o el error en job['error']
+    """
+    try:
+        _ingest_step(job, 0.02, "Escaneando cabeceras de las hojas...")
+        xls = pd.ExcelFile(io.BytesIO(file_bytes))
+        sheet, header_row = find_data_sheet(xls)
+        relevant = find_relevant_sheet_headers(xls)
+        job['cabecera'] = {'hoja': sheet, 'fila': header_row, 'hojas': xls.sheet_names, 'relevantes': relevant}
+        
+        reads = list(dict.fromkeys([(sheet, header_row)] + list(relevant.items())))
+        frames = {}
+        for i, (name, idx) in enumerate(reads):
+            _ingest_step(job, 0.1 + 0.9 * i / len(reads), f"Leyendo hoja '{name}' ({i + 1}/{len(reads)})...")
+            frame = pd.read_excel(xls, sheet_name=name, header=idx)
+            frame.columns = frame.columns.str.strip()
+            frames[(name, idx)] = frame
+        
+        sheets_data = {name: frames[(name, idx)] for name, idx in relevant.items()}
+        job['resultado'] = (frames[(sheet, header_row)], sheets_data)
+        _ingest_step(job, 1.0, f"Libro leído: {len(reads)} hoja(s), {len(job['resultado'][0]):,} filas en '{sheet}'")
+    except Exception as e:
+        job['error'] = str(e)
+
+@st.cache_resource(show_spinner=False)
+def ingestion_executor():
+    """Pool de hilos compartido por todas las sesiones para la lectura de libros"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='ingesta')
+
+# ══════════════════════════════════════════════════════════════════════
+# 4.1.2 CACHÉ DE DATASETS COMPARTIDA ENTRE SESIONES (LRU CON PRESUPUESTO)
+# ══════════════════════════════════════════════════════════════════════
+
+DATASET_CACHE_BUDGET_MB = float(os.environ.get('DATASET_CACHE_BUDGET_MB', 2048))  # Configurable por entorno
+
+@st.cache_resource(show_spinner=False)
+def dataset_cache():
+    """
+    Caché de datasets del proceso, compartida por todas las sesiones
+    Entradas por hash de contenido en orden LRU (la última es la más reciente);
+    los DataFrames guardados son de solo lectura: cada sesión trabaja sobre copias
+    """
+    return {'entradas': {}, 'lock': threading.Lock(), 'aciertos': 0, 'fallos': 0, 'expulsiones': 0}
+
+def dataset_cache_job(file_key, file_bytes, file_name, count=True, held=None):
+    """
+    Trabajo de ingesta para el archivo (clave = hash SHA-1 de los bytes)
+    Si el archivo ya está en la caché (otra sesión o rerun) se reutiliza y pasa a ser el más
+    reciente; si no, se lanza la lectura en el hilo de fondo. count=False en los reruns
+    de una misma sesión para que los aciertos reflejen aperturas de reporte, no refrescos.
+    held: trabajo que la sesión ya tenía para este archivo; si fue expulsado mientras la
+    sesión seguía abierta vuelve a la caché en lugar de releer el libro
+    """
+    cache = dataset_cache()
+    with cache['lock']:
+        job = cache['entradas'].pop(file_key, None)
+        if job is None and held is not None and held['future'].done() and not held['error']:
+            job = held
+        if job is None:
+            job = {'archivo': file_name, 'progreso': 0.0, 'paso': "En cola...", 'bitacora': [], 'cabecera': None,
+                   'resultado': None, 'error': None, 'limpio': {}, 'bytes': 0}
+            job['future'] = ingestion_executor().submit(ingest_workbook, job, file_bytes)
+            cache['fallos'] += 1
+        else:
+            cache['aciertos'] += int(count)
+        cache['entradas'][file_key] = job
+    return job
+
+def dataset_cache_discard(file_key, job):
+    """
+    Retira de la caché una lectura terminada con error: el error se muestra una vez a las
+    sesiones que la esperaban y la siguiente apertura del archivo vuelve a leerlo
+    """
+    cache = dataset_cache()
+    with cache['lock']:
+        if cache['entradas'].get(file_key) is job:
+            del cache['entradas'][file_key]
+
+def dataset_cache_account(file_key):
+    """
+    Recalcula la memoria de una entrada (hojas leídas + datasets limpios) y expulsa las
+    entradas menos recientes hasta volver al presupuesto; nunca expulsa la entrada actual
+    ni lecturas en curso. Las sesiones abiertas guardan su trabajo en session_state: sus
+    DataFrames siguen vivos hasta que se cierran y, si vuelven a pedir el archivo, la
+    entrada se reincorpora sin releer el libro (ver dataset_cache_job)
+    """
+    cache = dataset_cache()
+    with cache['lock']:
+        job = cache['entradas'].get(file_key)
+        if job is None or job['resultado'] is None:
+            return
+        data, sheets = job['resultado']
+        frames = {id(frame): frame for frame in [data, *sheets.values(), *job['limpio'].values()]}
+        job['bytes'] = int(sum(frame.memory_usage(deep=True).sum() for frame in frames.values()))
+        
+        budget = DATASET_CACHE_BUDGET_MB * 1e6
+        for key in list(cache['entradas']):
+            if sum(entry['bytes'] for entry in cache['entradas'].values()) <= budget:
+                break
+            if key != file_key and cache['entradas'][key]['future'].done():
+                del cache['entradas'][key]
+                cache['expulsiones'] += 1
 
 # ══════════════════════════════════════════════════════════════════════
 # 4.2 PROCESAMIENTO DE DATOS CARGADOS
@@ -347,10 +525,35 @@ def load_all_relevant_sheets(xls):
 
 if uploaded:
     if uploaded.name.lower().endswith(".xlsx"):
-        xls = pd.ExcelFile(uploaded)
-        all_sheets = load_all_relevant_sheets(xls)
-        sheet, header_row = find_data_sheet(xls)
-        data = pd.read_excel(xls, sheet_name=sheet, header=header_row)
+        file_bytes = uploaded.getvalue()
+        file_key = hashlib.sha1(file_bytes).hexdigest()
+        same_file = st.session_state.get('dataset_cache_key') == file_key
+        ingest = dataset_cache_job(file_key, file_bytes, uploaded.name, count=not same_file,
+                                   held=st.session_state.get('dataset_cache_job') if same_file else None)
+        st.session_state['dataset_cache_key'] = file_key
+        st.session_state['dataset_cache_job'] = ingest
+        
+        # Mientras el hilo lee el libro: progreso por hoja y cabeceras ya escaneadas en el sidebar
+        if not ingest['future'].done():
+            if ingest['cabecera']:
+                with st.sidebar:
+                    st.markdown("### 📥 Ingesta en curso")
+                    st.caption(f"Hoja principal: **{ingest['cabecera']['hoja']}** (cabecera en fila {ingest['cabecera']['fila'] + 1}) · "
+                               f"{len(ingest['cabecera']['hojas'])} hojas en el libro")
+                    st.markdown("---")
+                    analysis_parameter_sliders()
+                    st.caption("🏭 El filtro por campo se habilita cuando termina la lectura (depende de las filas del libro).")
+            st.progress(ingest['progreso'], text=ingest['paso'])
+            for message in ingest['bitacora'][:-1]:
+                st.caption(f"✅ {message}")
+            time.sleep(INGEST_POLL_S)
+            st.rerun()
+        
+        if ingest['error']:
+            dataset_cache_discard(file_key, ingest)
+            st.error(f"❌ Error al leer el archivo: {ingest['error']}")
+            st.stop()
+        data, all_sheets = ingest['resultado']
         
         # Cargar datos de viento de Extended si existe
         if 'Emission Location Extended' in all_sheets:
@@ -366,8 +569,7 @@ if data is None or len(data) == 0:
 # 4.3 AUTO-DETECCIÓN DE COLUMNAS Y UNIDADES
 # ══════════════════════════════════════════════════════════════════════
 
-# Clean column names
-data.columns = data.columns.str.strip()
+# Nombres de columna ya recortados en la ingesta (data es compartido entre sesiones: solo lectura)
 
 # Auto-detect columns
 def auto_detect_columns(df):
@@ -425,6 +627,13 @@ if ch4_col:
     elif 'ppm' in col_name_lower or 'concentration' in col_name_lower or 'flux' in col_name_lower:
         ch4_units = "ppm"
 
+# Concentración puntual declarada en ppm en el nombre de la columna (requisito de la inversión de pluma):
+# se descartan columnas sin unidad (ppm por defecto) y las integradas en trayecto (ppm·m)
+ch4_name_compact = str(ch4_col).lower().replace(' ', '') if ch4_col else ''
+ch4_point_ppm = 'ppm' in ch4_name_compact and not any(
+    tag in ch4_name_compact for tag in ('ppm·m', 'ppm-m', 'ppm*m', 'ppm.m', 'ppmxm', 'ppmm')
+)
+
 # Detectar unidades de Emission Rate
 emission_rate_units = "kg/h"
 if emission_rate_col:
@@ -469,70 +678,100 @@ if not ch4_col:
 # 4.5 LIMPIEZA Y VALIDACIÓN DE DATOS
 # ══════════════════════════════════════════════════════════════════════
 
-# Clean data - Limpieza profunda de datos nulos y vacíos
-df = data.copy()
-
-# Remover filas completamente vacías
-df = df.dropna(how='all')
-
-# Remover filas donde las columnas críticas estén vacías
-df = df.dropna(subset=[lat_col, lon_col])
-
-# Convertir a numérico y limpiar valores inválidos
-df[lat_col] = pd.to_numeric(df[lat_col], errors='coerce')
-df[lon_col] = pd.to_numeric(df[lon_col], errors='coerce')
-df[ch4_col] = pd.to_numeric(df[ch4_col], errors='coerce')
-
-# Eliminar filas con coordenadas inválidas (0, NaN, o fuera de rango)
-df = df[df[lat_col].notna() & df[lon_col].notna()]
-df = df[(df[lat_col] != 0) | (df[lon_col] != 0)]  # Eliminar (0,0)
-df = df[(df[lat_col] >= -90) & (df[lat_col] <= 90)]  # Validar latitud
-df = df[(df[lon_col] >= -180) & (df[lon_col] <= 180)]  # Validar longitud
-
-# Limpiar columna de concentración
-df = df[df[ch4_col].notna()]
-df = df[df[ch4_col] > 0]  # Solo valores positivos
-
-# Limpiar columna de Emission Rate si existe
-if emission_rate_col and emission_rate_col in df.columns:
-    df[emission_rate_col] = pd.to_numeric(df[emission_rate_col], errors='coerce')
-    # No eliminar filas por emission rate nulo, solo convertir
-
-# Limpiar columnas de viento si existen
-if wspd_col and wspd_col in df.columns:
-    df[wspd_col] = pd.to_numeric(df[wspd_col], errors='coerce')
-    # No eliminar filas por viento nulo, solo convertir
+def clean_emission_data(data, lat_col, lon_col, ch4_col, emission_rate_col, wspd_col, wdir_col,
+                        date_col, scan_datetime_col, report=None):
+    """
+    Limpieza profunda de datos nulos, vacíos e inválidos
+    report(fracción, mensaje) se invoca al iniciar cada paso (barra de progreso del script)
+    """
+    report = report or (lambda progress, message: None)
     
-if wdir_col and wdir_col in df.columns:
-    df[wdir_col] = pd.to_numeric(df[wdir_col], errors='coerce')
-    # Validar dirección entre 0 y 360
-    df.loc[df[wdir_col].notna(), wdir_col] = df.loc[df[wdir_col].notna(), wdir_col] % 360
-
-# Intentar crear índice datetime
-if date_col and date_col in df.columns:
-    try:
-        df['datetime'] = pd.to_datetime(df[date_col], errors='coerce')
-        # Ordenar por fecha si existe
-        if df['datetime'].notna().any():
-            df = df.sort_values('datetime')
-    except Exception:
-        pass
-
-# Procesar Scan Date Time (UTC) si existe
-if scan_datetime_col and scan_datetime_col in df.columns:
-    try:
-        df['scan_datetime_parsed'] = pd.to_datetime(df[scan_datetime_col], errors='coerce', utc=True)
-        # Si no hay datetime general, usar scan_datetime
-        if 'datetime' not in df.columns or df['datetime'].isna().all():
-            df['datetime'] = df['scan_datetime_parsed']
-        # Ordenar por scan_datetime si existe
-        if df['scan_datetime_parsed'].notna().any():
-            df = df.sort_values('scan_datetime_parsed')
-    except Exception:
-        pass
+    report(0.0, "Limpieza: filas vacías...")
+    df = data.copy()
+    
+    # Remover filas completamente vacías
+    df = df.dropna(how='all')
+    
+    # Remover filas donde las columnas críticas estén vacías
+    df = df.dropna(subset=[lat_col, lon_col])
+    
+    report(0.2, "Limpieza: coordenadas...")
+    # Convertir a numérico y limpiar valores inválidos
+    df[lat_col] = pd.to_numeric(df[lat_col], errors='coerce')
+    df[lon_col] = pd.to_numeric(df[lon_col], errors='coerce')
+    df[ch4_col] = pd.to_numeric(df[ch4_col], errors='coerce')
+    
+    # Eliminar filas con coordenadas inválidas (0, NaN, o fuera de rango)
+    df = df[df[lat_col].notna() & df[lon_col].notna()]
+    df = df[(df[lat_col] != 0) | (df[lon_col] != 0)]  # Eliminar (0,0)
+    df = df[(df[lat_col] >= -90) & (df[lat_col] <= 90)]  # Validar latitud
+    df = df[(df[lon_col] >= -180) & (df[lon_col] <= 180)]  # Validar longitud
+    
+    report(0.4, "Limpieza: concentración CH₄...")
+    # Limpiar columna de concentración
+    df = df[df[ch4_col].notna()]
+    df = df[df[ch4_col] > 0]  # Solo valores positivos
+    
+    report(0.55, "Limpieza: emission rate y viento...")
+    # Limpiar columna de Emission Rate si existe
+    if emission_rate_col and emission_rate_col in df.columns:
+        df[emission_rate_col] = pd.to_numeric(df[emission_rate_col], errors='coerce')
+        # No eliminar filas por emission rate nulo, solo convertir
+    
+    # Limpiar columnas de viento si existen
+    if wspd_col and wspd_col in df.columns:
+        df[wspd_col] = pd.to_numeric(df[wspd_col], errors='coerce')
+        # No eliminar filas por viento nulo, solo convertir
+    
+    if wdir_col and wdir_col in df.columns:
+        df[wdir_col] = pd.to_numeric(df[wdir_col], errors='coerce')
+        # Validar dirección entre 0 y 360
+        df.loc[df[wdir_col].notna(), wdir_col] = df.loc[df[wdir_col].notna(), wdir_col] % 360
+    
+    report(0.7, "Limpieza: fechas y orden temporal...")
+    # Intentar crear índice datetime
+    if date_col and date_col in df.columns:
+        try:
+            df['datetime'] = pd.to_datetime(df[date_col], errors='coerce')
+            # Ordenar por fecha si existe
+            if df['datetime'].notna().any():
+                df = df.sort_values('datetime')
+        except Exception:
+            pass
+    
+    # Procesar Scan Date Time (UTC) si existe
+    if scan_datetime_col and scan_datetime_col in df.columns:
+        try:
+            df['scan_datetime_parsed'] = pd.to_datetime(df[scan_datetime_col], errors='coerce', utc=True)
+            # Si no hay datetime general, usar scan_datetime
+            if 'datetime' not in df.columns or df['datetime'].isna().all():
+                df['datetime'] = df['scan_datetime_parsed']
+            # Ordenar por scan_datetime si existe
+            if df['scan_datetime_parsed'].notna().any():
+                df = df.sort_values('scan_datetime_parsed')
+        except Exception:
+            pass
+    
+    report(0.95, "Limpieza: índice final...")
+    # Resetear índice después de la limpieza
+    return df.reset_index(drop=True)
 
-# Resetear índice después de la limpieza
-df = df.reset_index(drop=True)
+# La limpieza se hace una vez por archivo y selección de columnas; los reruns parten de una
+# copia superficial (Copy-on-Write: las columnas nuevas o modificadas no tocan la compartida)
+clean_key = (lat_col, lon_col, ch4_col, emission_rate_col, wspd_col, wdir_col, date_col, scan_datetime_col)
+# ingest['limpio'] es compartido entre sesiones: lectura e inserción bajo el lock de la caché
+with dataset_cache()['lock']:
+    df_clean = ingest['limpio'].get(clean_key)
+if df_clean is None:
+    cleaning_progress = st.progress(0.0, text="Limpiando datos...")
+    df_clean = clean_emission_data(
+        data, *clean_key, report=lambda progress, message: cleaning_progress.progress(progress, text=message)
+    )
+    with dataset_cache()['lock']:
+        df_clean = ingest['limpio'].setdefault(clean_key, df_clean)
+    cleaning_progress.empty()
+    dataset_cache_account(file_key)
+df = df_clean.copy(deep=False)
 
 if len(df) == 0:
     st.error("❌ No hay datos válidos después de la limpieza")
@@ -552,6 +791,309 @@ except Exception as e:
     st.error(f"❌ Error al calcular métricas: {e}")
     st.stop()
 
+# ══════════════════════════════════════════════════════════════════════
+# 4.5.1 UNIÓN AS-OF DE VIENTO (EXTENDED → SUMMARY)
+# ══════════════════════════════════════════════════════════════════════
+
+WIND_JOIN_TOLERANCE_MIN = 30    # Ventana máxima entre detección y observación de viento
+WIND_JOIN_CELL_DEG = 0.05       # Celda espacial (~5 km) donde se prefiere el viento más cercano
+
+def _spatial_cell(lat, lon, cell_deg):
+    """
+    Clave entera de celda espacial para agrupar por cercanía
+    """
+    return np.floor(lat / cell_deg).astype(np.int64) * 1_000_000 + np.floor(lon / cell_deg).astype(np.int64)
+
+@st.cache_data(show_spinner=False)
+def join_wind_asof(detections, wind, tolerance_min=WIND_JOIN_TOLERANCE_MIN, cell_deg=WIND_JOIN_CELL_DEG):
+    """
+    Asigna a cada detección la observación de viento más cercana en el tiempo (merge_asof)
+    - Ordenamiento + búsqueda binaria: O(n log n), sin bucles anidados
+    - Con coordenadas en ambas tablas se busca primero dentro de la misma celda espacial
+      (by='cell'); las detecciones sin pareja usan el viento más cercano de cualquier celda
+    Entradas con columnas 'time' (UTC), 'lat', 'lon' y en viento además 'wspd', 'wdir'
+    Retorna DataFrame alineado con las detecciones: wspd, wdir, dt_min
+    """
+    tolerance = pd.Timedelta(minutes=tolerance_min)
+    result = pd.DataFrame(np.nan, index=np.arange(len(detections)), columns=['wspd', 'wdir', 'dt_min'])
+    
+    left = detections.reset_index(drop=True).assign(row=np.arange(len(detections)))
+    left = left[left['time'].notna()]
+    left['time'] = left['time'].dt.as_unit('ns')
+    right = wind[wind['time'].notna() & (wind['wspd'].notna() | wind['wdir'].notna())].copy()
+    right['time'] = right['time'].dt.as_unit('ns')
+    right['wind_time'] = right['time']
+    
+    def _merge(left_part, right_part, by=None):
+        merged = pd.merge_asof(
+            left_part.sort_values('time'), right_part.sort_values('time'),
+            on='time', by=by, direction='nearest', tolerance=tolerance
+        )
+        matched = merged[merged['wind_time'].notna()]
+        result.loc[matched['row'].to_numpy(), 'wspd'] = matched['wspd'].to_numpy()
+        result.loc[matched['row'].to_numpy(), 'wdir'] = matched['wdir'].to_numpy()
+        result.loc[matched['row'].to_numpy(), 'dt_min'] = ((matched['wind_time'] - matched['time']).abs() / pd.Timedelta(minutes=1)).to_numpy()
+    
+    wind_cols = ['time', 'wind_time', 'wspd', 'wdir']
+    has_space = left[['lat', 'lon']].notna().all(axis=1)
+    wind_space = right[['lat', 'lon']].notna().all(axis=1)
+    if has_space.any() and wind_space.any():
+        left_space = left[has_space].assign(cell=lambda d: _spatial_cell(d['lat'], d['lon'], cell_deg))
+        right_space = right[wind_space].assign(cell=lambda d: _spatial_cell(d['lat'], d['lon'], cell_deg))
+        _merge(left_space[['time', 'row', 'cell']], right_space[wind_cols + ['cell']], by='cell')
+    
+    pending = left[result['dt_min'].iloc[left['row']].isna().to_numpy()]
+    if len(pending) > 0 and len(right) > 0:
+        _merge(pending[['time', 'row']], right[wind_cols])
+    
+    return result
+
+# Completar viento de cada detección con la observación de Extended más cercana
+if wind_data is not None:
+    wind_cols_join = wind_cols_extended or auto_detect_columns(wind_data)
+    wind_time_source = wind_cols_join['scan_datetime'] or wind_cols_join['date']
+    detection_time = 'scan_datetime_parsed' if 'scan_datetime_parsed' in df.columns else ('datetime' if 'datetime' in df.columns else None)
+    
+    if wind_time_source and detection_time and (wind_cols_join['wspd'] or wind_cols_join['wdir']):
+        def _wind_column(source_df, col):
+            if col and col in source_df.columns:
+                return pd.to_numeric(source_df[col], errors='coerce').to_numpy()
+            return np.full(len(source_df), np.nan)
+        
+        wind_observations = pd.DataFrame({
+            'time': pd.to_datetime(wind_data[wind_time_source], errors='coerce', utc=True),
+            'lat': _wind_column(wind_data, wind_cols_join['lat']),
+            'lon': _wind_column(wind_data, wind_cols_join['lon']),
+            'wspd': _wind_column(wind_data, wind_cols_join['wspd']),
+            'wdir': _wind_column(wind_data, wind_cols_join['wdir']) % 360
+        })
+        detections = pd.DataFrame({
+            'time': pd.to_datetime(df[detection_time], errors='coerce', utc=True),
+            'lat': df[lat_col].to_numpy(),
+            'lon': df[lon_col].to_numpy()
+        })
+        wind_joined = join_wind_asof(detections, wind_observations)
+        
+        # Los valores propios de Summary tienen prioridad; la unión solo completa vacíos
+        for target_col, joined_col in [(wspd_col, 'wspd'), (wdir_col, 'wdir')]:
+            if target_col and wind_cols_join[joined_col]:
+                if target_col in df.columns:
+                    df[target_col] = df[target_col].fillna(pd.Series(wind_joined[joined_col].to_numpy(), index=df.index))
+                else:
+                    df[target_col] = wind_joined[joined_col].to_numpy()
+        df['Viento Δt (min)'] = wind_joined['dt_min'].to_numpy()
+        
+        # Refrescar filas de máximo/mínimo con el contexto de viento
+        max_row = df.loc[max_idx]
+        min_row = df.loc[min_idx]
+
+# ══════════════════════════════════════════════════════════════════════
+# 4.5.2 ÍNDICE DE NORMALIZACIÓN DE INSTALACIONES
+# ══════════════════════════════════════════════════════════════════════
+
+FACILITY_NAME_STOPWORDS = {'de', 'del', 'la', 'el', 'y'}
+FACILITY_NAME_SUFFIXES = {'facility', 'instalacion', 'site', 'sitio'}  # Sufijos genéricos finales
+
+def normalize_facility_name(names):
+    """
+    Forma canónica de nombres de instalación (solo sobre valores únicos):
+    minúsculas, sin tildes, '_' / '-' / puntuación → espacio, sin conectores ni sufijos
+    genéricos finales, espacios colapsados
+    """
+    names = pd.Series(names, dtype=object)
+    unique_names = pd.Series(names.dropna().astype(str).unique())
+    
+    def _strip_suffix(tokens):
+        tokens = [t for t in tokens if t not in FACILITY_NAME_STOPWORDS]
+        while len(tokens) > 1 and tokens[-1] in FACILITY_NAME_SUFFIXES:
+            tokens = tokens[:-1]
+        return ' '.join(tokens)
+    
+    canonical = (
+        unique_names.map(lambda s: unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('ascii'))
+        .str.lower()
+        .str.replace(r'[^a-z0-9]+', ' ', regex=True)
+        .str.split()
+        .map(_strip_suffix)
+    )
+    lookup = dict(zip(unique_names, canonical))
+    return names.map(lambda s: lookup.get(str(s)) if pd.notna(s) else None)
+
+@st.cache_data(show_spinner=False)
+def build_facility_index(names):
+    """
+    Diccionario canónico de instalaciones, construido una vez por dataset (cacheado)
+    - Variantes (mayúsculas, tildes, separadores, sufijos) se fusionan por clave normalizada
+    - Nombre visible = variante más frecuente (en empate, la no escrita toda en mayúsculas), con '_' → espacio
+    - Códigos enteros por fila (-1 = sin nombre) para categorías y agrupaciones
+    Retorna dict con codes, names (orden alfabético) y aliases (tabla de variantes)
+    """
+    raw = pd.Series(names, dtype=object)
+    variant_codes, variants = pd.factorize(raw.astype(str).where(raw.notna()), sort=True)
+    variant_counts = np.bincount(variant_codes[variant_codes >= 0], minlength=len(variants))
+    keys = normalize_facility_name(variants).to_numpy()
+    
+    aliases = pd.DataFrame({
+        'Variante': variants,
+        'Clave Normalizada': keys,
+        'Registros': variant_counts
+    })
+    display = (
+        aliases.assign(_mayusculas=aliases['Variante'].str.isupper())
+        .sort_values(['Clave Normalizada', 'Registros', '_mayusculas', 'Variante'], ascending=[True, False, True, True])
+        .drop_duplicates('Clave Normalizada')
+        .set_index('Clave Normalizada')['Variante']
+        .str.replace('_', ' ')
+        .str.split().str.join(' ')
+    )
+    canonical_names, name_codes = np.unique(display.to_numpy().astype(str), return_inverse=True)
+    key_codes = pd.Series(name_codes, index=display.index)
+    
+    aliases['Instalación'] = canonical_names[key_codes.reindex(aliases['Clave Normalizada']).to_numpy()]
+    variant_to_code = key_codes.reindex(keys).to_numpy()
+    codes = np.where(variant_codes >= 0, variant_to_code[np.maximum(variant_codes, 0)], -1)
+    return {
+        'codes': codes.astype(np.int32),
+        'names': canonical_names,
+        'aliases': aliases[['Variante', 'Instalación', 'Clave Normalizada', 'Registros']]
+    }
+
+# Una sola normalización por dataset: la columna de instalación pasa a categórica
+# (códigos enteros + nombres canónicos) y todas las agrupaciones operan sobre códigos
+facility_index = None
+if facility_col and facility_col in df.columns:
+    facility_index = build_facility_index(df[facility_col].to_numpy())
+    df[facility_col] = pd.Categorical.from_codes(facility_index['codes'], categories=facility_index['names'])
+    max_row = df.loc[max_idx]
+    min_row = df.loc[min_idx]
+
+# ══════════════════════════════════════════════════════════════════════
+# 4.5.3 SKETCHES DE CUANTILES FUSIONABLES (POR INSTALACIÓN Y CAMPO)
+# ══════════════════════════════════════════════════════════════════════
+
+SKETCH_RELATIVE_ACCURACY = 0.01  # Error relativo garantizado de cada cuantil
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+SKETCH_KEY_OFFSET = 1 << 20      # Lleva los índices logarítmicos de valores < 1 a claves positivas
+SKETCH_UNKNOWN_GROUP = '(Sin instalación)'  # Grupo de las filas sin nombre de instalación (Campo "Desconocido")
+
+def sketch_keys(values):
+    """
+    Clave de cubeta logarítmica con signo (estilo DDSketch); el orden de claves respeta el de valores
+    0 → 0 | x > 0 → ⌈log_γ x⌉ + OFFSET | x < 0 → −(⌈log_γ |x|⌉ + OFFSET)
+    """
+    values = np.asarray(values, dtype=float)
+    keys = np.zeros(len(values), dtype=np.int64)
+    nonzero = values != 0
+    bucket = np.ceil(np.log(np.abs(values[nonzero])) / np.log(SKETCH_GAMMA)).astype(np.int64) + SKETCH_KEY_OFFSET
+    keys[nonzero] = np.sign(values[nonzero]).astype(np.int64) * bucket
+    return keys
+
+def sketch_key_values(keys):
+    """
+    Valor representativo de cada clave: 2γ^b / (γ + 1), a menos de α (relativo) de todo valor de la cubeta
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    bucket = (np.abs(keys) - SKETCH_KEY_OFFSET).astype(float)
+    with np.errstate(over='ignore', under='ignore'):
+        values = 2 * SKETCH_GAMMA ** bucket / (SKETCH_GAMMA + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+@st.cache_data(show_spinner=False)
+def build_quantile_sketches(df_in, group_col, value_cols):
+    """
+    Sketches de cuantiles por grupo construidos en una sola pasada en la ingesta (cacheado)
+    Cada sketch = conteos por (grupo, clave) + resumen exacto por grupo (n, suma, mín, máx);
+    su tamaño depende del rango de valores, no del número de filas. Las filas sin grupo
+    forman el grupo SKETCH_UNKNOWN_GROUP
+    Retorna {columna: {'buckets': DataFrame(grupo, clave, conteo), 'summary': DataFrame por grupo}}
+    """
+    groups = df_in[group_col].astype(object).fillna(SKETCH_UNKNOWN_GROUP) if group_col else pd.Series('Todos', index=df_in.index)
+    sketches = {}
+    for col in value_cols:
+        values = pd.to_numeric(df_in[col], errors='coerce')
+        valid = values.notna().to_numpy()
+        codes, names = pd.factorize(groups[valid], sort=True)
+        names = np.asarray(names).astype(str)
+        x = values.to_numpy(dtype=float)[valid]
+        
+        # Clave combinada grupo/cubeta: un único np.unique cuenta todas las cubetas de todos los grupos
+        combined, counts = np.unique(codes.astype(np.int64) * (4 * SKETCH_KEY_OFFSET) + sketch_keys(x) + 2 * SKETCH_KEY_OFFSET,
+                                     return_counts=True)
+        buckets = pd.DataFrame({
+            'grupo': names[combined // (4 * SKETCH_KEY_OFFSET)],
+            'clave': combined % (4 * SKETCH_KEY_OFFSET) - 2 * SKETCH_KEY_OFFSET,
+            'conteo': counts
+        })
+        summary = pd.Series(x).groupby(codes).agg(['count', 'sum', 'min', 'max'])
+        summary.index = pd.Index(names[summary.index], name='grupo')
+        sketches[col] = {'buckets': buckets, 'summary': summary.rename(columns={'count': 'n', 'sum': 'suma'})}
+    return sketches
+
+def merge_quantile_sketches(sketches, groups=None, label='Todos'):
+    """
+    Fusión de sketches (de varios grupos o de varios reportes) sin recorrer filas:
+    los conteos por clave y n/suma se suman; mín/máx se combinan
+    groups: subconjunto de grupos a fusionar (None = todos); el resultado es un solo grupo `label`
+    """
+    buckets = pd.concat([sketch['buckets'] for sketch in sketches], ignore_index=True)
+    summary = pd.concat([sketch['summary'] for sketch in sketches])
+    if groups is not None:
+        buckets = buckets[buckets['grupo'].isin(groups)]
+        summary = summary[summary.index.isin(groups)]
+    merged_buckets = buckets.groupby('clave', sort=True)['conteo'].sum().reset_index()
+    merged_buckets.insert(0, 'grupo', label)
+    merged_summary = pd.DataFrame({
+        'n': [summary['n'].sum()], 'suma': [summary['suma'].sum()],
+        'min': [summary['min'].min()], 'max': [summary['max'].max()]
+    }, index=pd.Index([label], name='grupo'))
+    return {'buckets': merged_buckets, 'summary': merged_summary}
+
+def sketch_quantiles(sketch, quantiles):
+    """
+    Cuantiles aproximados por grupo (error relativo ≤ SKETCH_RELATIVE_ACCURACY) en un solo paso
+    vectorizado sobre las cubetas: el costo depende del número de cubetas, no de filas
+    Retorna DataFrame grupo × cuantil (recortado al mín/máx exacto de cada grupo);
+    los grupos sin valores (n = 0) quedan en NaN
+    """
+    buckets = sketch['buckets'].sort_values(['grupo', 'clave'], kind='stable')
+    group_codes, group_names = pd.factorize(buckets['grupo'])
+    counts = buckets['conteo'].to_numpy()
+    group_n = np.bincount(group_codes, weights=counts)
+    group_offset = np.cumsum(group_n) - group_n
+    cumulative = np.cumsum(counts)
+    key_values = sketch_key_values(buckets['clave'].to_numpy())
+    
+    summary = sketch['summary'].reindex(group_names)
+    result = {}
+    for q in quantiles:
+        rank = group_offset + np.floor(q * (group_n - 1))
+        position = np.searchsorted(cumulative, rank, side='right')
+        result[q] = np.clip(key_values[position], summary['min'].to_numpy(), summary['max'].to_numpy())
+    return pd.DataFrame(result, index=pd.Index(group_names, name='grupo'), columns=list(quantiles)).reindex(sketch['summary'].index)
+
+def sketches_to_frame(sketches):
+    """
+    Serialización plana (CSV) de los sketches para fusionarlos con los de otros reportes
+    """
+    frames = []
+    for col, sketch in sketches.items():
+        frame = sketch['buckets'].merge(sketch['summary'], left_on='grupo', right_index=True)
+        frame.insert(0, 'variable', col)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def sketches_from_frame(frame):
+    """
+    Reconstruye {variable: sketch} desde la serialización plana
+    """
+    sketches = {}
+    for col, part in frame.groupby('variable', sort=False):
+        sketches[col] = {
+            'buckets': part[['grupo', 'clave', 'conteo']].reset_index(drop=True),
+            'summary': part.drop_duplicates('grupo').set_index('grupo')[['n', 'suma', 'min', 'max']]
+        }
+    return sketches
+
 # ══════════════════════════════════════════════════════════════════════
 # 4.6 DETECCIÓN DE CAMPO Y FILTROS
 # ══════════════════════════════════════════════════════════════════════
@@ -582,12 +1124,18 @@ def detect_campo(facility_name):
     
     return "Otros Campos"
 
-# Agregar columna de campo si existe facility_col
+# Agregar columna de campo si existe facility_col (una evaluación por instalación canónica)
 if facility_col and facility_col in df.columns:
-    df['Campo'] = df[facility_col].apply(detect_campo)
+    campo_by_code = np.array([detect_campo(name) for name in facility_index['names']] + ["Desconocido"], dtype=object)
+    df['Campo'] = campo_by_code[facility_index['codes']]
 else:
     df['Campo'] = "Desconocido"
 
+# Sketches de cuantiles por instalación construidos en la ingesta; los de campo y del dataset
+# se obtienen fusionándolos (sin volver a recorrer filas en cada rerun)
+sketch_cols = [c for c in [ch4_col, emission_rate_col] if c and c in df.columns]
+quantile_sketches = build_quantile_sketches(df, facility_col if facility_index is not None else None, sketch_cols)
+
 # ══════════════════════════════════════════════════════════════════════
 # 4.7 SIDEBAR - INFORMACIÓN Y FILTROS
 # ══════════════════════════════════════════════════════════════════════
@@ -611,10 +1159,12 @@ with st.sidebar:
     
     # Aplicar filtro de campo
     if selected_campo != "Todos los Campos":
-        df_filtered = df[df['Campo'] == selected_campo].copy()
+        df_filtered = df[df['Campo'] == selected_campo]
+        if facility_index is not None:
+            df_filtered[facility_col] = df_filtered[facility_col].cat.remove_unused_categories()
         st.success(f"✅ Mostrando solo: **{selected_campo}**")
     else:
-        df_filtered = df.copy()
+        df_filtered = df.copy(deep=False)
         st.info("📊 Mostrando todos los campos")
     
     st.markdown("---")
@@ -638,14 +1188,2056 @@ with st.sidebar:
                 wind_available = True
                 st.metric("💨 Datos de Viento", f"{wind_points:,}")
     
+    st.markdown("---")
+    source_radius_m, hotspot_band_m = analysis_parameter_sliders()
+    
+    # Diagnóstico de la caché de datasets compartida entre sesiones
+    with st.expander("🧰 Diagnóstico de Caché", expanded=False):
+        cache = dataset_cache()
+        with cache['lock']:
+            cache_entries = [(key, entry['archivo'], entry['bytes'], entry['future'].done())
+                             for key, entry in reversed(cache['entradas'].items())]
+            cache_hits, cache_misses, cache_evictions = cache['aciertos'], cache['fallos'], cache['expulsiones']
+        cache_used_mb = sum(entry[2] for entry in cache_entries) / 1e6
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Aciertos", f"{cache_hits:,}")
+            st.metric("Expulsiones", f"{cache_evictions:,}")
+        with col2:
+            st.metric("Fallos", f"{cache_misses:,}")
+            st.metric("Tasa de acierto", f"{cache_hits / max(cache_hits + cache_misses, 1):.0%}")
+        st.progress(min(cache_used_mb / DATASET_CACHE_BUDGET_MB, 1.0),
+                    text=f"Memoria: {cache_used_mb:,.0f} / {DATASET_CACHE_BUDGET_MB:,.0f} MB")
+        st.dataframe(pd.DataFrame({
+            'Reporte': [entry[1] for entry in cache_entries],
+            'Hash': [entry[0][:10] for entry in cache_entries],
+            'MB': [round(entry[2] / 1e6, 1) for entry in cache_entries],
+            'Estado': ["✅ Listo" if entry[3] else "⏳ Leyendo" for entry in cache_entries]
+        }), use_container_width=True, hide_index=True)
+        st.caption("Orden: más reciente primero. Presupuesto configurable con la variable de entorno DATASET_CACHE_BUDGET_MB.")
+    
     st.markdown("---")
     st.caption("🌍 Monitor Ambiental v2.0")
 
-# Usar df_filtered en lugar de df para el resto del análisis
-df = df_filtered
+# Usar df_filtered en lugar de df para el resto del análisis (df_all: dataset sin filtrar)
+df_all = df
+df = df_filtered
+
+# Sketch del filtro activo: fusión de los sketches de las instalaciones del campo seleccionado
+active_sketch_groups = None
+if selected_campo != "Todos los Campos" and facility_index is not None:
+    active_sketch_groups = np.append(facility_index['names'], SKETCH_UNKNOWN_GROUP)[campo_by_code == selected_campo].tolist()
+active_sketches = {col: merge_quantile_sketches([quantile_sketches[col]], active_sketch_groups) for col in sketch_cols}
+
+if selected_campo != "Todos los Campos":
+    st.info(f"🏭 Visualizando datos de: **{selected_campo}** ({len(df):,} puntos)")
+
+# ══════════════════════════════════════════════════════════════════════
+# 4.8 MOTORES DE ANÁLISIS VECTORIZADOS (CACHEADOS)
+# ══════════════════════════════════════════════════════════════════════
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.1 CLASIFICACIÓN POR CUADRANTES Y BARRIDO DE UMBRALES
+# ═══════════════════════════════════════════════════════════════
+
+# Etiquetas de cuadrantes (el orden define el código entero 0..3)
+QUADRANT_LABELS = [
+    '🔴 Alto-Alto (Crítico)',
+    '🟠 Bajo CH₄ - Alto Rate (Anomalía)',
+    '🟡 Alto CH₄ - Bajo Rate (Revisar)',
+    '🟢 Bajo-Bajo (Óptimo)'
+]
+
+def classify_quadrants(x, y, threshold_x, threshold_y):
+    """
+    Clasificación vectorizada en cuadrantes con un solo np.select
+    O(n) por llamada: se ejecuta en cada rerun porque el color del scatter y las tablas por
+    instalación necesitan la etiqueta de cada fila (el índice acumulado no la evita)
+    Retorna códigos enteros 0..3 alineados con QUADRANT_LABELS
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    high_x = x >= threshold_x
+    high_y = y >= threshold_y
+    return np.select(
+        [high_x & high_y, ~high_x & high_y, high_x & ~high_y],
+        [0, 1, 2],
+        default=3
+    ).astype(np.int8)
+
+@st.cache_data(show_spinner=False)
+def build_quadrant_index(x, y, grid_size=256):
+    """
+    Estructura de conteo acumulado 2D para consultas de cuadrantes
+    - Arreglos pre-ordenados por X y por Y (con la otra coordenada alineada)
+    - Bordes de grilla por cuantiles y matriz de conteos acumulados desde arriba/derecha
+    Construcción O(n log n). Los umbrales que caen en bordes de la grilla (barrido) se leen en
+    O(1); un umbral arbitrario cuesta O(log n + n/grid_size) (ver query_quadrant_counts)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    
+    order_x = np.argsort(x, kind='stable')
+    order_y = np.argsort(y, kind='stable')
+    
+    q = np.linspace(0, 1, grid_size + 1)
+    edges_x = np.unique(np.quantile(x, q)) if len(x) else np.array([0.0])
+    edges_y = np.unique(np.quantile(y, q)) if len(y) else np.array([0.0])
+    
+    # Celda de cada punto: bin i contiene edges[i] <= v < edges[i+1]
+    bin_x = np.searchsorted(edges_x, x, side='right') - 1
+    bin_y = np.searchsorted(edges_y, y, side='right') - 1
+    hist = np.zeros((len(edges_x), len(edges_y)), dtype=np.int64)
+    np.add.at(hist, (bin_x, bin_y), 1)
+    
+    # cum[i, j] = #{x >= edges_x[i] y y >= edges_y[j]} (suma de sufijos en ambos ejes)
+    cum = hist[::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+    cum = np.pad(cum, ((0, 1), (0, 1)))
+    
+    return {
+        'x_sorted': x[order_x],
+        'y_by_x': y[order_x],
+        'y_sorted': y[order_y],
+        'x_by_y': x[order_y],
+        'edges_x': edges_x,
+        'edges_y': edges_y,
+        'cum': cum,
+        'n': len(x)
+    }
+
+def query_quadrant_counts(index, threshold_x, threshold_y):
+    """
+    Conteo de los 4 cuadrantes para un par de umbrales
+    Usa búsqueda binaria + matriz acumulada y revisa la franja de la celda límite en cada eje:
+    O(log n + n/grid_size) por consulta (la franja es una celda de cuantiles, ~n/256 puntos),
+    no O(log n) estricto
+    Retorna array [crítico, anomalía, revisar, óptimo]
+    """
+    xs, ys = index['x_sorted'], index['y_sorted']
+    edges_x, edges_y = index['edges_x'], index['edges_y']
+    n = index['n']
+    
+    # Conteos 1D por búsqueda binaria
+    n_high_x = n - np.searchsorted(xs, threshold_x, side='left')
+    n_high_y = n - np.searchsorted(ys, threshold_y, side='left')
+    
+    # Primer borde de grilla >= umbral en cada eje
+    i = np.searchsorted(edges_x, threshold_x, side='left')
+    j = np.searchsorted(edges_y, threshold_y, side='left')
+    edge_x = edges_x[i] if i < len(edges_x) else np.inf
+    edge_y = edges_y[j] if j < len(edges_y) else np.inf
+    
+    # Bloque completo de celdas + franjas parciales (disjuntas) en el borde
+    both_high = index['cum'][i, j]
+    lo, hi = np.searchsorted(xs, [threshold_x, edge_x], side='left')
+    both_high += np.count_nonzero(index['y_by_x'][lo:hi] >= threshold_y)
+    lo, hi = np.searchsorted(ys, [threshold_y, edge_y], side='left')
+    both_high += np.count_nonzero(index['x_by_y'][lo:hi] >= edge_x)
+    
+    critico = int(both_high)
+    anomalia = int(n_high_y - both_high)
+    revisar = int(n_high_x - both_high)
+    optimo = int(n - critico - anomalia - revisar)
+    return np.array([critico, anomalia, revisar, optimo])
+
+def quadrant_sweep(index, n_steps=25):
+    """
+    Barrido de umbrales sobre una grilla de cuantiles
+    Los umbrales coinciden con bordes de la grilla, por lo que cada celda del
+    barrido es una lectura directa de la matriz acumulada (sin re-escanear datos)
+    Retorna (umbrales_x, umbrales_y, conteos[4, nx, ny])
+    """
+    edges_x, edges_y, cum, n = index['edges_x'], index['edges_y'], index['cum'], index['n']
+    xs, ys = index['x_sorted'], index['y_sorted']
+    
+    ix = np.unique(np.linspace(0, len(edges_x) - 1, n_steps).round().astype(int))
+    iy = np.unique(np.linspace(0, len(edges_y) - 1, n_steps).round().astype(int))
+    
+    both_high = cum[np.ix_(ix, iy)]
+    n_high_x = (n - np.searchsorted(xs, edges_x[ix], side='left'))[:, None]
+    n_high_y = (n - np.searchsorted(ys, edges_y[iy], side='left'))[None, :]
+    
+    critico = both_high
+    anomalia = n_high_y - both_high
+    revisar = n_high_x - both_high
+    optimo = n - critico - anomalia - revisar
+    return edges_x[ix], edges_y[iy], np.stack([critico, anomalia, revisar, optimo])
+
+def quadrant_facility_summary(codes, facility_codes, facility_names, x, y, quadrant):
+    """
+    Agrupación por instalación de un cuadrante usando np.bincount sobre códigos enteros
+    O(n) por llamada (una pasada sin groupby de pandas; no usa el índice acumulado)
+    Retorna DataFrame con promedio de X, promedio de Y y número de puntos
+    """
+    mask = codes == quadrant
+    n_fac = len(facility_names)
+    counts = np.bincount(facility_codes[mask], minlength=n_fac)
+    sum_x = np.bincount(facility_codes[mask], weights=x[mask], minlength=n_fac)
+    sum_y = np.bincount(facility_codes[mask], weights=y[mask], minlength=n_fac)
+    present = counts > 0
+    return pd.DataFrame({
+        'facility': np.asarray(facility_names)[present],
+        'mean_x': sum_x[present] / counts[present],
+        'mean_y': sum_y[present] / counts[present],
+        'count': counts[present]
+    })
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.2 DECIMACIÓN DE SCATTER PLOTS MASIVOS (MODO WEBGL)
+# ═══════════════════════════════════════════════════════════════
+
+# Filas a partir de las cuales los scatter se renderizan con WebGL
+LARGE_SCATTER_THRESHOLD = 5000
+# Máximo de puntos enviados al navegador en modo de datos masivos
+SCATTER_POINT_BUDGET = 20000
+
+@st.cache_data(show_spinner=False)
+def decimate_scatter_indices(x, y, keep_mask, max_points=SCATTER_POINT_BUDGET, grid_size=200, seed=42):
+    """
+    Decimación que preserva densidad para scatter plots masivos
+    - Conserva todos los puntos marcados en keep_mask (ej. cuadrante crítico); si por sí solos
+      superan el presupuesto, se toma una muestra estratificada por y (cuantiles equiespaciados,
+      incluye mínimo y máximo) de max_points puntos
+    - El resto se agrupa en una grilla 2D y cada celda aporta como máximo k puntos,
+      con k elegido por búsqueda binaria para respetar el presupuesto total
+    Las celdas poco pobladas (valores extremos) se conservan completas; solo se adelgazan las densas
+    Retorna índices ordenados de las filas a graficar
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep_mask = np.asarray(keep_mask, dtype=bool)
+    
+    if len(x) <= max_points:
+        return np.arange(len(x))
+    
+    kept = np.flatnonzero(keep_mask)
+    rest = np.flatnonzero(~keep_mask)
+    if len(kept) > max_points:
+        by_value = kept[np.argsort(y[kept], kind='stable')]
+        strata = np.unique(np.round(np.linspace(0, len(by_value) - 1, max_points)).astype(np.int64))
+        return np.sort(by_value[strata])
+    budget = max_points - len(kept)
+    if budget == 0 or len(rest) == 0:
+        return kept
+    if len(rest) <= budget:
+        return np.arange(len(x))
+    
+    def _bin(values):
+        lo, hi = values.min(), values.max()
+        span = hi - lo if hi > lo else 1.0
+        return np.minimum(((values - lo) / span * grid_size).astype(np.int64), grid_size - 1)
+    
+    cell = _bin(x[rest]) * grid_size + _bin(y[rest])
+    
+    # Orden aleatorio reproducible dentro de cada celda
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(len(rest))
+    order = perm[np.argsort(cell[perm], kind='stable')]
+    _, starts, counts = np.unique(cell[order], return_index=True, return_counts=True)
+    rank = np.arange(len(order)) - np.repeat(starts, counts)
+    
+    # Mayor k tal que sum(min(conteo_celda, k)) <= presupuesto
+    lo_k, hi_k = 0, int(counts.max())
+    while lo_k < hi_k:
+        mid = (lo_k + hi_k + 1) // 2
+        if np.minimum(counts, mid).sum() <= budget:
+            lo_k = mid
+        else:
+            hi_k = mid - 1
+    
+    if lo_k > 0:
+        selected = order[rank < lo_k]
+    else:
+        # Más celdas ocupadas que presupuesto: un punto por celda en una muestra de celdas
+        selected = rng.choice(order[rank == 0], size=budget, replace=False)
+    
+    return np.sort(np.concatenate([kept, rest[selected]]))
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.3 REDUCCIÓN DE PUNTOS EN SERIES TEMPORALES (LTTB / ENVOLVENTE)
+# ═══════════════════════════════════════════════════════════════
+
+# Puntos máximos por instalación en la serie temporal antes de aplicar reducción
+TIMESERIES_POINTS_PER_FACILITY = 1000
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: índices de n_out puntos representativos
+    Conserva primer y último punto; en cada bucket elige el punto que forma el triángulo
+    de mayor área con el punto elegido previo y el promedio del bucket siguiente
+    Los promedios se calculan en bloque (np.add.reduceat) y cada bucket se evalúa vectorizado
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    # Límites de los n_out - 2 buckets interiores (excluyen primer y último punto)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    
+    # Punto "siguiente" de cada bucket: promedio del bucket posterior (o el último punto)
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+    
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        area = np.abs(
+            (x[a] - next_x[b]) * (y[lo:hi] - y[a]) -
+            (x[a] - x[lo:hi]) * (next_y[b] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[b + 1] = a
+    
+    return selected
+
+def minmax_envelope_indices(y, n_out):
+    """
+    Envolvente mín/máx: divide la serie en n_out/2 buckets y conserva el mínimo
+    y el máximo de cada uno (totalmente vectorizado con lexsort)
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    
+    n_buckets = max(n_out // 2, 1)
+    edges = np.unique(np.linspace(0, n, n_buckets + 1).astype(np.int64))
+    bucket = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+    
+    # Dentro de cada bucket el orden es ascendente por valor: primero = mínimo, último = máximo
+    order = np.lexsort((y, bucket))
+    idx_min = order[edges[:-1]]
+    idx_max = order[edges[1:] - 1]
+    
+    return np.unique(np.concatenate([[0, n - 1], idx_min, idx_max]))
+
+@st.cache_data(show_spinner=False)
+def downsample_facility_series(facility, aggregation, t, y, n_out, method):
+    """
+    Reducción de una serie (una instalación) cacheada por instalación y nivel de agregación
+    Siempre incluye el pico máximo para que los eventos no queden ocultos
+    Retorna índices (posiciones) de los puntos a graficar
+    """
+    if len(y) <= n_out:
+        return np.arange(len(y))
+    
+    t = np.asarray(t, dtype=np.int64)
+    y = np.asarray(y, dtype=float)
+    
+    if method == 'LTTB':
+        idx = lttb_indices((t - t[0]).astype(float), y, n_out)
+    else:
+        idx = minmax_envelope_indices(y, n_out)
+    
+    return np.union1d(idx, [int(np.argmax(y))])
+
+def downsample_timeseries(df_in, facility_col, time_col, value_col, aggregation, n_out, method):
+    """
+    Aplica la reducción por instalación sobre datos ordenados por (instalación, tiempo)
+    Los límites de cada instalación se obtienen en una sola pasada con np.unique
+    """
+    df_sorted = df_in.sort_values([facility_col, time_col], kind='stable').reset_index(drop=True)
+    codes, names = pd.factorize(df_sorted[facility_col])
+    t_all = df_sorted[time_col].values.astype('datetime64[ns]').astype(np.int64)
+    y_all = df_sorted[value_col].to_numpy(dtype=float)
+    
+    facility_codes, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+    keep = []
+    for code, start, count in zip(facility_codes, starts, counts):
+        idx = downsample_facility_series(
+            str(names[code]), aggregation,
+            t_all[start:start + count], y_all[start:start + count],
+            n_out, method
+        )
+        keep.append(start + idx)
+    
+    return df_sorted.iloc[np.concatenate(keep)] if keep else df_sorted
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.4 MOTOR DE TENDENCIAS POR INSTALACIÓN (OLS, THEIL-SEN, MANN-KENDALL)
+# ═══════════════════════════════════════════════════════════════
+
+# Mínimo de mediciones para evaluar tendencia y tope de puntos por instalación en pruebas por pares
+TREND_MIN_POINTS = 4
+TREND_MAX_PAIR_POINTS = 300
+# Nivel de significancia para Mann-Kendall
+TREND_ALPHA = 0.05
+
+def _within_group_pairs(group_start, pos):
+    """
+    Genera todos los pares (i < j) dentro de cada grupo de forma vectorizada
+    pos = posición de cada elemento dentro de su grupo (datos ordenados por grupo)
+    """
+    j = np.repeat(np.arange(len(pos)), pos)
+    offsets = np.arange(len(j)) - np.repeat(np.cumsum(pos) - pos, pos)
+    i = group_start[j] + offsets
+    return i, j
+
+@st.cache_data(show_spinner=False)
+def compute_facility_trends(df_in, facility_col, time_col, value_col, pair_budget=2_000_000):
+    """
+    Tendencias de todas las instalaciones en una sola pasada sobre datos ordenados
+    - Pendiente OLS por sumas agrupadas (np.bincount)
+    - Pendiente de Theil-Sen (mediana de pendientes por pares) y prueba de Mann-Kendall
+      con corrección por empates; los pares se generan vectorizados por bloques de
+      instalaciones para acotar memoria (máx. TREND_MAX_PAIR_POINTS puntos por instalación)
+    Pendientes expresadas en unidades de value_col por día
+    """
+    data = df_in[[facility_col, time_col, value_col]].dropna()
+    data = data.sort_values([facility_col, time_col], kind='stable')
+    codes, names = pd.factorize(data[facility_col])
+    n_fac = len(names)
+    
+    columns = ['N', 'Días', 'Promedio', 'Pendiente OLS', 'Pendiente Theil-Sen', 'MK S', 'MK Z', 'MK p-valor', 'Cambio %', 'Tendencia']
+    if n_fac == 0:
+        return pd.DataFrame(columns=columns)
+    
+    t_ns = data[time_col].values.astype('datetime64[ns]').astype(np.int64)
+    y = data[value_col].to_numpy(dtype=float)
+    
+    counts = np.bincount(codes, minlength=n_fac)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    pos = np.arange(len(codes)) - starts[codes]
+    
+    # Tiempo relativo al inicio de cada instalación, en días
+    t = (t_ns - t_ns[starts][codes]) / 86_400e9
+    span_days = np.maximum.reduceat(t, starts)
+    
+    # ── OLS agrupado ──
+    sum_t = np.bincount(codes, weights=t, minlength=n_fac)
+    sum_y = np.bincount(codes, weights=y, minlength=n_fac)
+    sum_tt = np.bincount(codes, weights=t * t, minlength=n_fac)
+    sum_ty = np.bincount(codes, weights=t * y, minlength=n_fac)
+    denom = counts * sum_tt - sum_t ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ols_slope = np.where(denom > 0, (counts * sum_ty - sum_t * sum_y) / denom, np.nan)
+    mean_y = sum_y / counts
+    
+    # ── Submuestreo uniforme para pruebas por pares en instalaciones muy largas ──
+    stride = np.maximum(np.ceil(counts / TREND_MAX_PAIR_POINTS), 1).astype(np.int64)
+    sel = (pos % stride[codes]) == 0
+    s_codes, s_t, s_y = codes[sel], t[sel], y[sel]
+    s_counts = np.bincount(s_codes, minlength=n_fac)
+    s_starts = np.concatenate([[0], np.cumsum(s_counts)[:-1]])
+    s_pos = np.arange(len(s_codes)) - s_starts[s_codes]
+    
+    mk_s = np.zeros(n_fac)
+    theil_sen = np.full(n_fac, np.nan)
+    
+    # Bloques de instalaciones cuyo total de pares no supere pair_budget
+    pairs_per_fac = s_counts * (s_counts - 1) // 2
+    block_id = np.cumsum(pairs_per_fac) // max(pair_budget, 1)
+    for block in np.unique(block_id):
+        facs = np.flatnonzero(block_id == block)
+        lo, hi = s_starts[facs[0]], s_starts[facs[-1]] + s_counts[facs[-1]]
+        i, j = _within_group_pairs(s_starts[s_codes[lo:hi]] - lo, s_pos[lo:hi])
+        i += lo
+        j += lo
+        pair_fac = s_codes[j]
+        
+        # Mann-Kendall: S = Σ sign(y_j - y_i)
+        mk_s += np.bincount(pair_fac, weights=np.sign(s_y[j] - s_y[i]), minlength=n_fac)
+        
+        # Theil-Sen: mediana de pendientes por instalación (orden por instalación y pendiente)
+        dt = s_t[j] - s_t[i]
+        valid = dt > 0
+        slopes = (s_y[j][valid] - s_y[i][valid]) / dt[valid]
+        slope_fac = pair_fac[valid]
+        if len(slopes):
+            order = np.lexsort((slopes, slope_fac))
+            slopes, slope_fac = slopes[order], slope_fac[order]
+            n_slopes = np.bincount(slope_fac, minlength=n_fac)
+            first = np.concatenate([[0], np.cumsum(n_slopes)[:-1]])
+            has = n_slopes > 0
+            lo_mid = first[has] + (n_slopes[has] - 1) // 2
+            hi_mid = first[has] + n_slopes[has] // 2
+            theil_sen[has] = (slopes[lo_mid] + slopes[hi_mid]) / 2
+    
+    # Varianza de S con corrección por empates (conteo de valores repetidos por instalación)
+    _, tie_inverse, tie_counts = np.unique(
+        np.column_stack([s_codes, s_y]), axis=0, return_inverse=True, return_counts=True
+    )
+    tie_fac = np.zeros(len(tie_counts), dtype=np.int64)
+    tie_fac[tie_inverse.ravel()] = s_codes
+    tie_term = np.bincount(tie_fac, weights=tie_counts * (tie_counts - 1) * (2 * tie_counts + 5), minlength=n_fac)
+    m = s_counts.astype(float)
+    var_s = (m * (m - 1) * (2 * m + 5) - tie_term) / 18
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mk_z = np.where(var_s > 0, (mk_s - np.sign(mk_s)) / np.sqrt(var_s), 0.0)
+        change_pct = np.where(mean_y != 0, theil_sen * span_days / np.abs(mean_y) * 100, np.nan)
+    mk_p = np.array([math.erfc(abs(z) / math.sqrt(2)) for z in mk_z])
+    
+    trend = np.where(mk_p < TREND_ALPHA, np.where(mk_s > 0, 'Creciente', 'Decreciente'), 'Sin tendencia')
+    
+    result = pd.DataFrame({
+        'N': counts,
+        'Días': span_days,
+        'Promedio': mean_y,
+        'Pendiente OLS': ols_slope,
+        'Pendiente Theil-Sen': theil_sen,
+        'MK S': mk_s.astype(np.int64),
+        'MK Z': mk_z,
+        'MK p-valor': mk_p,
+        'Cambio %': change_pct,
+        'Tendencia': trend
+    }, index=pd.Index(names, name=facility_col))
+    
+    return result[result['N'] >= TREND_MIN_POINTS]
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.5 DETECTOR DE ANOMALÍAS EWMA + Z ROBUSTO (INCREMENTAL)
+# ═══════════════════════════════════════════════════════════════
+
+# Parámetros del detector
+EWMA_ALPHA = 0.3            # Peso de la observación más reciente
+EWMA_MIN_PERIODS = 5        # Observaciones previas necesarias antes de evaluar
+EWMA_Z_THRESHOLD = 3.0      # Umbral z sobre media/desviación exponencial
+ROBUST_Z_THRESHOLD = 3.5    # Umbral z robusto (mediana/MAD)
+
+def _ewma_pass(df_sorted, facility_col, value_col, alpha, state=None):
+    """
+    Pasada vectorizada de EWMA agrupado sobre datos ordenados por (instalación, tiempo)
+    - Media: m_t = (1-α)·m_{t-1} + α·y_t
+    - Varianza: v_t = (1-α)·v_{t-1} + α·(1-α)·d_t², con d_t = y_t - m_{t-1}
+    Ambas recursiones son EWMA (adjust=False) y se resuelven con groupby().ewm() de pandas.
+    Con estado previo se antepone una fila sintética (m, v) por instalación, de modo que
+    las nuevas mediciones continúan la recursión sin reprocesar el historial.
+    Retorna (puntajes alineados con df_sorted, estado nuevo por instalación)
+    """
+    if state is None:
+        state = pd.DataFrame(columns=['mean', 'var', 'n', 'median', 'mad', 'last_time'])
+    
+    facilities = df_sorted[facility_col].reset_index(drop=True)
+    y = df_sorted[value_col].reset_index(drop=True).astype(float)
+    seeded = state[state.index.isin(facilities.unique())]
+    
+    combined = pd.concat([
+        pd.DataFrame({
+            'facility': seeded.index, 'value': seeded['mean'].astype(float), 'seed_var': seeded['var'].astype(float),
+            'seed_n': seeded['n'].astype(float), 'is_seed': True, 'row': -1
+        }),
+        pd.DataFrame({
+            'facility': facilities, 'value': y, 'seed_var': np.nan,
+            'seed_n': 0.0, 'is_seed': False, 'row': np.arange(len(y))
+        })
+    ], ignore_index=True)
+    
+    # Semilla primero dentro de cada instalación; las mediciones conservan su orden temporal
+    combined['code'] = pd.factorize(combined['facility'])[0]
+    combined = combined.sort_values(['code', 'is_seed'], ascending=[True, False], kind='stable').reset_index(drop=True)
+    groups = combined['code'].to_numpy()
+    
+    mean = combined['value'].groupby(groups, sort=False).ewm(alpha=alpha, adjust=False).mean()
+    combined['mean'] = mean.droplevel(0).sort_index()
+    prev_mean = combined['mean'].groupby(groups, sort=False).shift(1)
+    combined['diff'] = combined['value'] - prev_mean
+    
+    var_input = ((1 - alpha) * combined['diff'] ** 2).fillna(0.0)
+    var_input = var_input.where(~combined['is_seed'], combined['seed_var'])
+    var = var_input.groupby(groups, sort=False).ewm(alpha=alpha, adjust=False).mean()
+    combined['var'] = var.droplevel(0).sort_index()
+    prev_var = combined['var'].groupby(groups, sort=False).shift(1)
+    
+    # Observaciones previas a cada medición (incluye el historial guardado)
+    seed_n = combined['seed_n'].groupby(groups, sort=False).transform('max')
+    n_prev = (~combined['is_seed']).groupby(groups, sort=False).cumsum() - 1 + seed_n
+    combined['n_prev'] = n_prev
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        combined['z_ewma'] = np.where(
+            (n_prev >= EWMA_MIN_PERIODS) & (prev_var > 0),
+            combined['diff'] / np.sqrt(prev_var),
+            np.nan
+        )
+    combined['ewma_std'] = np.sqrt(prev_var)
+    
+    real = combined[~combined['is_seed']].sort_values('row').reset_index(drop=True)
+    scores = real[['mean', 'ewma_std', 'z_ewma']].rename(columns={'mean': 'ewma_mean'})
+    
+    # Línea base robusta (mediana/MAD): la guardada en el estado o calculada para instalaciones nuevas
+    median_new = y.groupby(facilities, sort=False, observed=True).median()
+    mad_new = (y - facilities.map(median_new).astype(float)).abs().groupby(facilities, sort=False, observed=True).median()
+    has_state = facilities.isin(seeded.index)
+    median = facilities.map(seeded['median']).astype(float).where(has_state, facilities.map(median_new).astype(float))
+    mad = facilities.map(seeded['mad']).astype(float).where(has_state, facilities.map(mad_new).astype(float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores['z_robust'] = np.where(mad > 0, 0.6745 * (y - median) / mad, np.nan)
+    
+    scores['anomalia'] = (scores['z_ewma'] >= EWMA_Z_THRESHOLD) | (scores['z_robust'] >= ROBUST_Z_THRESHOLD)
+    
+    # Estado final por instalación: última medición de cada una
+    last = real.groupby('facility', sort=False, observed=True).last()
+    new_state = pd.DataFrame({
+        'mean': last['mean'],
+        'var': last['var'],
+        'n': last['n_prev'] + 1,
+        'median': median.groupby(facilities, sort=False, observed=True).first(),
+        'mad': mad.groupby(facilities, sort=False, observed=True).first()
+    })
+    new_state.index.name = None
+    
+    return scores, new_state
+
+def _history_digest(df_in, facility_col, time_col, value_col):
+    """
+    Huella de contenido del historial por instalación: suma (módulo 2⁶⁴) de los hashes de
+    cada fila (instalación, tiempo, valor). No depende del orden de las filas y cambia si se
+    modifica el valor de cualquier periodo, p. ej. el último periodo de una vista agregada
+    que recibe mediciones nuevas sin cambiar su fecha ni el número de filas.
+    """
+    row_hash = pd.util.hash_pandas_object(df_in[[facility_col, time_col, value_col]], index=False)
+    return row_hash.groupby(df_in[facility_col].astype(object).to_numpy(), sort=False).sum()
+
+@st.cache_data(show_spinner=False)
+def ewma_anomaly_scores(df_in, facility_col, time_col, value_col, alpha=EWMA_ALPHA):
+    """
+    Puntajes de anomalía para todo el historial (cacheado)
+    Retorna (datos ordenados por instalación/tiempo con puntajes, estado por instalación)
+    """
+    df_sorted = df_in.sort_values([facility_col, time_col], kind='stable').reset_index(drop=True)
+    scores, state = _ewma_pass(df_sorted, facility_col, value_col, alpha)
+    state['last_time'] = df_sorted.groupby(facility_col, sort=False, observed=True)[time_col].max()
+    state['digest'] = _history_digest(df_sorted, facility_col, time_col, value_col)
+    return pd.concat([df_sorted, scores], axis=1), state
+
+def detect_anomalies_incremental(df_in, facility_col, time_col, value_col, session_key, alpha=EWMA_ALPHA):
+    """
+    Detector con estado incremental en st.session_state
+    Si el dataset actual es el anterior más mediciones nuevas (posteriores a la última fecha
+    de cada instalación), solo se puntúan las nuevas continuando la recursión EWMA.
+    En cualquier otro caso (filtros distintos, datos modificados) se recalcula todo.
+    El historial se valida por contenido (huella por instalación), no solo por número de
+    filas: en vistas agregadas el último periodo cambia de valor al llegar datos nuevos.
+    """
+    cached = st.session_state.get(session_key)
+    if cached is not None and cached['alpha'] == alpha:
+        state = cached['state']
+        facility_keys = df_in[facility_col].astype(object)
+        last_time = facility_keys.map(state['last_time'])
+        is_new = last_time.isna() | (df_in[time_col] > last_time)
+        df_old = df_in[~is_new]
+        n_old = (~is_new).groupby(facility_keys, observed=True).sum()
+        digest_old = _history_digest(df_old, facility_col, time_col, value_col)
+        
+        # El historial debe coincidir exactamente (filas y contenido) con el ya procesado
+        if (n_old.reindex(state.index, fill_value=0).astype(int).equals(state['n'].astype(int))
+                and digest_old.reindex(state.index).equals(state['digest'])):
+            if not is_new.any():
+                return cached['scored']
+            df_new = df_in[is_new].sort_values([facility_col, time_col], kind='stable').reset_index(drop=True)
+            new_scores, new_state = _ewma_pass(df_new, facility_col, value_col, alpha, state)
+            new_state['last_time'] = df_new.groupby(facility_col, sort=False, observed=True)[time_col].max()
+            new_state['digest'] = (
+                state['digest'].reindex(new_state.index, fill_value=0).astype('uint64')
+                + _history_digest(df_new, facility_col, time_col, value_col).reindex(new_state.index).astype('uint64')
+            )
+            state = pd.concat([state.drop(new_state.index, errors='ignore'), new_state])
+            scored = pd.concat([cached['scored'], pd.concat([df_new, new_scores], axis=1)], ignore_index=True)
+            st.session_state[session_key] = {'alpha': alpha, 'state': state, 'scored': scored}
+            return scored
+    
+    scored, state = ewma_anomaly_scores(df_in, facility_col, time_col, value_col, alpha)
+    st.session_state[session_key] = {'alpha': alpha, 'state': state, 'scored': scored}
+    return scored
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.6 DETECCIÓN DE CAMBIOS DE RÉGIMEN (PELT)
+# ═══════════════════════════════════════════════════════════════
+
+# Parámetros del detector de cambios de régimen
+CHANGEPOINT_MIN_SIZE = 3                # Mediciones mínimas por segmento
+CHANGEPOINT_PENALTY = 2.0               # Penalización por cambio (múltiplo de log n, tipo BIC)
+
+def pelt_changepoints(y, penalty, min_size=CHANGEPOINT_MIN_SIZE):
+    """
+    PELT (Pruned Exact Linear Time) para cambios en la media
+    - Costo de segmento: suma de cuadrados respecto a su media, O(1) con sumas acumuladas
+    - Poda: se descartan los candidatos s con F(s) + C(s, t) > F(t), que nunca pueden
+      volver a ser óptimos; en la práctica el conjunto activo es pequeño y el costo casi lineal
+    Retorna los índices donde inicia cada nuevo segmento (sin incluir 0)
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n < 2 * min_size:
+        return []
+    
+    cs = np.concatenate([[0.0], np.cumsum(y)])
+    cs2 = np.concatenate([[0.0], np.cumsum(y * y)])
+    
+    F = np.full(n + 1, np.inf)
+    F[0] = -penalty
+    last = np.zeros(n + 1, dtype=np.int64)
+    candidates = np.array([0], dtype=np.int64)
+    
+    for t in range(min_size, n + 1):
+        s_new = t - min_size
+        if s_new >= min_size:
+            candidates = np.append(candidates, s_new)
+        
+        length = t - candidates
+        seg_sum = cs[t] - cs[candidates]
+        cost = (cs2[t] - cs2[candidates]) - seg_sum * seg_sum / length
+        total = F[candidates] + cost
+        
+        k = np.argmin(total)
+        F[t] = total[k] + penalty
+        last[t] = candidates[k]
+        
+        # Poda PELT (K = 0 para costo de suma de cuadrados)
+        candidates = candidates[total <= F[t]]
+    
+    changepoints = []
+    t = n
+    while t > 0:
+        t = last[t]
+        if t > 0:
+            changepoints.append(int(t))
+    return changepoints[::-1]
+
+def _changepoint_worker(task):
+    """
+    Segmentación de una instalación
+    Retorna lista de tuplas (instalación, inicio, fin, media, n)
+    """
+    facility, t, y, penalty_factor = task
+    n = len(y)
+    
+    # Escala robusta del ruido a partir de diferencias consecutivas (insensible a los saltos)
+    diffs = np.diff(y)
+    sigma = np.median(np.abs(diffs - np.median(diffs))) / 0.6745 / np.sqrt(2) if n > 1 else 0.0
+    if not np.isfinite(sigma) or sigma <= 0:
+        sigma = np.std(y)
+    
+    if sigma > 0:
+        bounds = pelt_changepoints(y / sigma, penalty_factor * np.log(n))
+    else:
+        bounds = []
+    
+    edges = [0] + bounds + [n]
+    return [
+        (facility, t[start], t[end - 1], float(y[start:end].mean()), end - start)
+        for start, end in zip(edges[:-1], edges[1:])
+    ]
+
+@st.cache_data(show_spinner=False)
+def detect_changepoints(df_in, facility_col, time_col, value_col, penalty_factor=CHANGEPOINT_PENALTY):
+    """
+    Segmentos de régimen por instalación (cacheado)
+    Las instalaciones se procesan en secuencia: el bucle PELT es Python puro (retiene el GIL,
+    un pool de hilos no lo acelera) y un pool de procesos 'spawn' reejecutaría en cada hijo el
+    script completo del tablero (Streamlit lo instala como __main__) para reimportar la función.
+    Retorna DataFrame con instalación, inicio, fin, media, n y cambio respecto al segmento previo
+    """
+    data = df_in[[facility_col, time_col, value_col]].dropna()
+    data = data.sort_values([facility_col, time_col], kind='stable')
+    
+    facilities = data[facility_col].to_numpy()
+    times = data[time_col].to_numpy()
+    values = data[value_col].to_numpy(dtype=float)
+    
+    unique_facilities, starts = np.unique(facilities, return_index=True)
+    ends = np.append(starts[1:], len(facilities))
+    tasks = [
+        (facility, times[start:end], values[start:end], penalty_factor)
+        for facility, start, end in zip(unique_facilities, starts, ends)
+        if end - start >= 2 * CHANGEPOINT_MIN_SIZE
+    ]
+    
+    results = [_changepoint_worker(task) for task in tasks]
+    
+    segments = pd.DataFrame(
+        [segment for facility_segments in results for segment in facility_segments],
+        columns=['Instalación', 'Inicio', 'Fin', 'Media', 'N']
+    )
+    segments['Cambio'] = segments.groupby('Instalación')['Media'].diff()
+    return segments
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.7 CUBO TEMPORAL MULTI-GRANULARIDAD
+# ═══════════════════════════════════════════════════════════════
+
+# Granularidades del cubo y su opción equivalente en la interfaz
+CUBE_GRANULARITIES = ['hour', 'day', 'week', 'month']
+CUBE_AGGREGATION_MAP = {
+    'Por hora': 'hour',
+    'Por día': 'day',
+    'Por semana': 'week',
+    'Por mes': 'month'
+}
+
+def cube_period_keys(times, granularity):
+    """
+    Claves enteras de período para un DatetimeIndex (UTC si tiene zona horaria)
+    - hour/day: horas/días desde 1970-01-01
+    - week: semanas ISO (lunes a domingo) desde el lunes 1969-12-29
+    - month: año·12 + (mes - 1)
+    """
+    if times.tz is not None:
+        times = times.tz_convert(None)
+    if granularity == 'month':
+        return np.asarray(times.year * 12 + times.month - 1, dtype=np.int64)
+    
+    if granularity == 'hour':
+        return np.asarray((times - pd.Timestamp(0)) // pd.Timedelta(hours=1), dtype=np.int64)
+    days = np.asarray((times - pd.Timestamp(0)) // pd.Timedelta(days=1), dtype=np.int64)
+    if granularity == 'day':
+        return days
+    # 1970-01-01 fue jueves: desplazando 3 días las semanas inician en lunes
+    return (days + 3) // 7
+
+def cube_period_start(keys, granularity, tz=None):
+    """
+    Inverso de cube_period_keys: fecha de inicio de cada período
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    if granularity == 'month':
+        start = pd.to_datetime(pd.DataFrame({'year': keys // 12, 'month': keys % 12 + 1, 'day': 1}))
+        start = pd.DatetimeIndex(start)
+    elif granularity == 'hour':
+        start = pd.to_datetime(keys, unit='h')
+    elif granularity == 'day':
+        start = pd.to_datetime(keys, unit='D')
+    else:
+        start = pd.to_datetime(keys * 7 - 3, unit='D')
+    return start.tz_localize('UTC').tz_convert(tz) if tz is not None else start
+
+@st.cache_data(show_spinner=False)
+def build_temporal_cube(df_in, facility_col, time_col, value_col):
+    """
+    Cubo instalación × período construido una sola vez por dataset (cacheado)
+    Para cada granularidad (hora, día, semana ISO, mes) guarda suma, media, máximo y conteo
+    con claves enteras de período; cambiar de granularidad solo selecciona una tabla.
+    Retorna dict con una tabla por granularidad y la zona horaria original
+    """
+    data = df_in[[facility_col, time_col, value_col]].dropna()
+    times = pd.DatetimeIndex(data[time_col])
+    codes, facilities = pd.factorize(data[facility_col], sort=True)
+    values = data[value_col].to_numpy(dtype=float)
+    
+    cube = {'tz': times.tz}
+    for granularity in CUBE_GRANULARITIES:
+        grouped = pd.DataFrame({
+            'code': codes,
+            'period': cube_period_keys(times, granularity),
+            'value': values
+        }).groupby(['code', 'period'], sort=True)['value'].agg(['sum', 'mean', 'max', 'count']).reset_index()
+        grouped.insert(0, 'facility', facilities[grouped['code'].to_numpy()])
+        cube[granularity] = grouped.drop(columns='code')
+    return cube
+
+def slice_temporal_cube(cube, granularity, facilities=None, stat='mean'):
+    """
+    Vista de una granularidad del cubo: (instalación, inicio de período, estadístico)
+    Opcionalmente filtrada a un subconjunto de instalaciones
+    """
+    table = cube[granularity]
+    if facilities is not None:
+        table = table[table['facility'].isin(facilities)]
+    return pd.DataFrame({
+        'facility': table['facility'].to_numpy(),
+        'period_start': cube_period_start(table['period'].to_numpy(), granularity, cube['tz']),
+        'period': table['period'].to_numpy(),
+        'value': table[stat].to_numpy()
+    })
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.8 INVENTARIO INTEGRADO EN EL TIEMPO (kg / tCO₂e)
+# ═══════════════════════════════════════════════════════════════
+
+# Conversión de unidades de tasa a kg/h y potencial de calentamiento global
+RATE_TO_KG_PER_HOUR = {'kg/h': 1.0, 'g/s': 3.6, 't/h': 1000.0}
+GWP_CH4 = 29.8                      # IPCC AR6, CH₄ fósil, horizonte 100 años
+INVENTORY_MAX_PERSISTENCE_H = 720.0 # Persistencia máxima atribuible a una detección (30 días)
+INVENTORY_SCAN_GAP_H = 2.0          # Detecciones de una misma fuente más cercanas que esto = una sola pasada
+PERSISTENCE_MODES = {
+    'Punto medio': 'midpoint',
+    'Hasta la siguiente medición': 'forward'
+}
+
+def detection_intervals(codes, hours, persistence='midpoint', max_hours=INVENTORY_MAX_PERSISTENCE_H):
+    """
+    Intervalo [inicio, fin) en horas que representa cada detección
+    Requiere arreglos ordenados por (instalación, tiempo).
+    - midpoint: la tasa se sostiene hasta la mitad del intervalo con cada medición vecina
+    - forward: la tasa se sostiene hasta la siguiente medición de la misma fuente
+    Cada lado se limita por la persistencia máxima; los extremos sin vecino usan ese límite.
+    """
+    n = len(hours)
+    same_next = np.zeros(n, dtype=bool)
+    same_next[:-1] = codes[1:] == codes[:-1]
+    gap_next = np.full(n, np.inf)
+    gap_next[:-1] = hours[1:] - hours[:-1]
+    gap_next = np.where(same_next, gap_next, np.inf)
+    
+    if persistence == 'forward':
+        return hours.copy(), hours + np.minimum(gap_next, max_hours)
+    
+    gap_prev = np.full(n, np.inf)
+    gap_prev[1:] = gap_next[:-1]
+    return (
+        hours - np.minimum(gap_prev / 2, max_hours / 2),
+        hours + np.minimum(gap_next / 2, max_hours / 2)
+    )
+
+@st.cache_data(show_spinner=False)
+def integrate_emission_inventory(df_in, facility_col, time_col, value_col, rate_units='kg/h',
+                                 persistence='midpoint', max_hours=INVENTORY_MAX_PERSISTENCE_H, gwp=GWP_CH4,
+                                 source_col=None, scan_gap_h=INVENTORY_SCAN_GAP_H):
+    """
+    Inventario de masa integrando la tasa de emisión en el tiempo (cacheado)
+    Primero se colapsa a una tasa por fuente y pasada: las detecciones consecutivas de la misma
+    fuente (source_col, o la instalación si no hay fuentes) separadas menos de scan_gap_h horas
+    son una sola pasada, con tasa y hora promedio. Luego masa = tasa (kg/h) × horas representadas
+    por la pasada; los intervalos que cruzan un cambio de mes se reparten entre los meses.
+    Retorna dict con tablas 'facility', 'monthly' y 'annual' (kg y tCO₂e)
+    """
+    keys = [facility_col] + ([source_col] if source_col else [])
+    data = df_in[keys + [time_col, value_col]].dropna()
+    data = data.sort_values(keys + [time_col], kind='stable')
+    
+    times = pd.DatetimeIndex(data[time_col])
+    if times.tz is not None:
+        times = times.tz_convert(None)
+    codes, facilities = pd.factorize(data[facility_col], sort=True)
+    entity = data.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+    hours = np.asarray((times - pd.Timestamp(0)) / pd.Timedelta(hours=1), dtype=float)
+    rates = data[value_col].to_numpy(dtype=float) * RATE_TO_KG_PER_HOUR.get(rate_units, 1.0)
+    
+    # Una tasa por (fuente, pasada): el resultado no depende del orden de las filas dentro de la pasada
+    new_scan = np.ones(len(hours), dtype=bool)
+    new_scan[1:] = (entity[1:] != entity[:-1]) | (np.diff(hours) > scan_gap_h)
+    scan = np.cumsum(new_scan) - 1
+    scan_size = np.bincount(scan)
+    scan_hours = np.bincount(scan, weights=hours) / scan_size
+    rate_kg_h = np.bincount(scan, weights=rates) / scan_size
+    detections = np.bincount(codes, minlength=len(facilities))
+    codes = codes[new_scan]
+    
+    start, end = detection_intervals(entity[new_scan], scan_hours, persistence, max_hours)
+    
+    # Reparto por mes: una fila por (detección, mes cubierto)
+    month_start = cube_period_keys(pd.to_datetime(start, unit='h'), 'month')
+    month_end = cube_period_keys(pd.to_datetime(np.nextafter(end, -np.inf), unit='h'), 'month')
+    n_months = month_end - month_start + 1
+    row = np.repeat(np.arange(len(start)), n_months)
+    month = month_start[row] + (np.arange(len(row)) - np.repeat(np.cumsum(n_months) - n_months, n_months))
+    
+    first_month, last_month = (month.min(), month.max()) if len(month) else (0, 0)
+    month_bounds = np.asarray(
+        (cube_period_start(np.arange(first_month, last_month + 2), 'month') - pd.Timestamp(0)) / pd.Timedelta(hours=1),
+        dtype=float
+    )
+    offset = month - first_month
+    overlap = np.minimum(end[row], month_bounds[offset + 1]) - np.maximum(start[row], month_bounds[offset])
+    mass_kg = rate_kg_h[row] * np.clip(overlap, 0, None)
+    
+    monthly = pd.DataFrame({
+        'facility': facilities[codes[row]],
+        'period': month,
+        'kg': mass_kg
+    }).groupby(['facility', 'period'], sort=True, observed=True)['kg'].sum().reset_index()
+    monthly['Año'] = monthly['period'] // 12
+    monthly['tCO2e'] = monthly['kg'] * gwp / 1000
+    
+    annual = monthly.groupby(['facility', 'Año'], sort=True, observed=True)[['kg', 'tCO2e']].sum().reset_index()
+    
+    facility_totals = pd.DataFrame({
+        'kg': np.bincount(codes, weights=rate_kg_h * (end - start), minlength=len(facilities)),
+        'Horas': np.bincount(codes, weights=end - start, minlength=len(facilities)),
+        'Nº Mediciones': detections,
+        'Pasadas': np.bincount(codes, minlength=len(facilities))
+    }, index=pd.Index(facilities, name='facility'))
+    facility_totals['tCO2e'] = facility_totals['kg'] * gwp / 1000
+    
+    return {'facility': facility_totals, 'monthly': monthly, 'annual': annual}
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.9 PERFIL DIURNO Y SEMANAL (HORA LOCAL OPERACIONAL)
+# ═══════════════════════════════════════════════════════════════
+
+LOCAL_TIMEZONE = 'America/Bogota'   # Hora operacional de los campos
+DAY_NAMES = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
+
+def to_local_time(times, tz=LOCAL_TIMEZONE):
+    """
+    Conversión vectorizada a hora local; fechas sin zona horaria se asumen ya locales
+    """
+    times = pd.DatetimeIndex(times)
+    return times.tz_convert(tz) if times.tz is not None else times
+
+@st.cache_data(show_spinner=False)
+def build_diurnal_profile(df_in, facility_col, time_col, value_cols, tz=LOCAL_TIMEZONE):
+    """
+    Perfil día de semana × hora del día por instalación en una sola pasada (cacheado)
+    Cada medición cae en la celda instalación·168 + día·24 + hora; sumas y conteos
+    por variable se obtienen con np.bincount. Se guardan sumas (no medias) para que
+    los perfiles por hora, por día o agregados entre instalaciones se combinen sin sesgo.
+    """
+    data = df_in[[facility_col, time_col] + list(value_cols)].dropna(subset=[facility_col, time_col])
+    local = to_local_time(data[time_col], tz)
+    codes, facilities = pd.factorize(data[facility_col], sort=True)
+    cell = codes * 168 + local.dayofweek.to_numpy() * 24 + local.hour.to_numpy()
+    size = len(facilities) * 168
+    
+    profile = pd.DataFrame({
+        'facility': np.repeat(np.asarray(facilities), 168),
+        'Día': np.tile(np.repeat(np.arange(7), 24), len(facilities)),
+        'Hora': np.tile(np.arange(24), 7 * len(facilities)),
+        'N': np.bincount(cell, minlength=size)
+    })
+    for col in value_cols:
+        values = data[col].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        profile[f'{col}__sum'] = np.bincount(cell[valid], weights=values[valid], minlength=size)
+        profile[f'{col}__n'] = np.bincount(cell[valid], minlength=size)
+    return profile
+
+def diurnal_profile_means(profile, value_col, by, facilities=None):
+    """
+    Medias de una variable a partir del perfil acumulado
+    by: 'Hora', 'Día' o lista de ambos (p. ej. ['Día', 'Hora'] para todas las instalaciones)
+    """
+    table = profile if facilities is None else profile[profile['facility'].isin(facilities)]
+    sums = table.groupby(by)[[f'{value_col}__sum', f'{value_col}__n']].sum()
+    return sums[f'{value_col}__sum'] / sums[f'{value_col}__n'].replace(0, np.nan)
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.10 ROSA DE VIENTOS (BINNING 2D VECTORIZADO)
+# ═══════════════════════════════════════════════════════════════
+
+# 16 sectores de 22.5° centrados en cada rumbo y clases de velocidad (m/s)
+WIND_ROSE_SECTORS = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+                     'S', 'SSO', 'SO', 'OSO', 'O', 'ONO', 'NO', 'NNO']
+WIND_SPEED_EDGES = [0, 2, 4, 6, 8, 10, np.inf]
+WIND_SPEED_LABELS = ['0-2 m/s', '2-4 m/s', '4-6 m/s', '6-8 m/s', '8-10 m/s', '≥10 m/s']
+
+@st.cache_data(show_spinner=False)
+def build_wind_rose(speed, direction, groups=None):
+    """
+    Rosa de vientos por binning 2D (sector de dirección × clase de velocidad) (cacheado)
+    Cada observación cae en la celda grupo·16·clases + sector·clases + clase y los conteos
+    salen de un solo np.bincount; con 'groups' se obtiene una rosa por grupo en la misma pasada.
+    Retorna DataFrame largo: grupo, sector, clase, conteo y frecuencia (% dentro del grupo)
+    """
+    speed = np.asarray(speed, dtype=float)
+    direction = np.asarray(direction, dtype=float)
+    if groups is None:
+        codes, names = np.zeros(len(speed), dtype=np.int64), np.array(['Todas'])
+    else:
+        codes, names = pd.factorize(pd.Series(groups), sort=True)
+        names = np.asarray(names)
+    valid = np.isfinite(speed) & np.isfinite(direction) & (speed >= 0) & (codes >= 0)
+    
+    n_sectors, n_classes = len(WIND_ROSE_SECTORS), len(WIND_SPEED_LABELS)
+    width = 360 / n_sectors
+    sector = ((direction[valid] % 360 + width / 2) // width).astype(np.int64) % n_sectors
+    speed_class = np.searchsorted(WIND_SPEED_EDGES, speed[valid], side='right') - 1
+    cell = (codes[valid] * n_sectors + sector) * n_classes + np.clip(speed_class, 0, n_classes - 1)
+    
+    counts = np.bincount(cell, minlength=len(names) * n_sectors * n_classes).reshape(len(names), n_sectors, n_classes)
+    totals = counts.sum(axis=(1, 2), keepdims=True)
+    frequency = counts / np.maximum(totals, 1) * 100
+    
+    return pd.DataFrame({
+        'grupo': np.repeat(names, n_sectors * n_classes),
+        'sector': np.tile(np.repeat(WIND_ROSE_SECTORS, n_classes), len(names)),
+        'clase': np.tile(WIND_SPEED_LABELS, len(names) * n_sectors),
+        'conteo': counts.ravel(),
+        'frecuencia': frequency.ravel()
+    })
+
+def wind_rose_figure(rose, title):
+    """
+    Figura polar de barras apiladas (una traza por clase de velocidad)
+    """
+    fig = px.bar_polar(
+        rose,
+        r='frecuencia',
+        theta='sector',
+        color='clase',
+        category_orders={'sector': WIND_ROSE_SECTORS, 'clase': WIND_SPEED_LABELS},
+        color_discrete_sequence=px.colors.sequential.YlOrRd[1:],
+        labels={'frecuencia': 'Frecuencia (%)', 'sector': 'Dirección', 'clase': 'Velocidad'},
+        title=title
+    )
+    fig.update_layout(
+        height=500,
+        template='plotly_white',
+        polar=dict(angularaxis=dict(direction='clockwise', rotation=90)),
+        legend=dict(title=dict(text='Velocidad'))
+    )
+    return fig
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.11 INVERSIÓN DE PLUMA GAUSSIANA (TASA CORREGIDA POR VIENTO)
+# ═══════════════════════════════════════════════════════════════
+
+# Parámetros físicos y de comparación
+PPM_TO_G_M3_CH4 = 6.56e-4           # 1 ppm de CH₄ a 25 °C y 1 atm
+PLUME_BACKGROUND_PPM = 1.9          # Fondo atmosférico de CH₄
+PLUME_SOURCE_HEIGHT_M = 5.0         # Altura efectiva de la fuente (venteos, tanques)
+PLUME_MIN_DISTANCE_M = 20.0         # Distancia viento abajo mínima para invertir
+PLUME_MAX_CROSSWIND_SIGMA = 2.0     # Receptores fuera de ±2σy del eje no se invierten
+PLUME_DISAGREEMENT_FACTOR = 3.0     # Discrepancia si reportada/estimada sale de [1/f, f]
+
+# Coeficientes de Briggs (rural): σy = a·x·(1+0.0001x)^-0.5 ; σz = c·x·(1+d·x)^e
+BRIGGS_RURAL = {
+    'A': (0.22, 0.20, 0.0, -0.5),
+    'B': (0.16, 0.12, 0.0, -0.5),
+    'C': (0.11, 0.08, 0.0002, -0.5),
+    'D': (0.08, 0.06, 0.0015, -0.5),
+    'E': (0.06, 0.03, 0.0003, -1.0),
+    'F': (0.04, 0.016, 0.0003, -1.0)
+}
+STABILITY_CLASSES = list(BRIGGS_RURAL.keys())
+
+# Clase de Pasquill por velocidad de viento (día, insolación moderada; A-B → A, B-C → B, C-D → C)
+STABILITY_SPEED_EDGES = [2.0, 3.0, 5.0, 6.0]
+STABILITY_BY_SPEED = ['A', 'B', 'B', 'C', 'D']
+
+def project_to_meters(lat, lon, lat0=None, lon0=None):
+    """
+    Proyección equirectangular local (m) alrededor de (lat0, lon0)
+    Suficiente para distancias de campo (< 50 km); por defecto centrada en la media
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    lat0 = np.nanmean(lat) if lat0 is None else lat0
+    lon0 = np.nanmean(lon) if lon0 is None else lon0
+    x = (lon - lon0) * 111320.0 * np.cos(np.radians(lat0))
+    y = (lat - lat0) * 110540.0
+    return x, y
+
+def gaussian_plume_inversion(dx, dy, wind_speed, wind_dir, enhancement_g_m3, stability_codes, height=PLUME_SOURCE_HEIGHT_M):
+    """
+    Invierte la pluma gaussiana a nivel del suelo para todos los receptores a la vez
+    C = Q / (π·u·σy·σz) · exp(-y²/2σy²) · exp(-H²/2σz²)  →  Q = C·π·u·σy·σz / (exp·exp)
+    - dx, dy: receptor - fuente (m, este/norte); wind_dir: procedencia (° desde el norte)
+    - stability_codes: índice en STABILITY_CLASSES por receptor
+    Retorna (Q en g/s, distancia viento abajo en m sin recortar); Q es NaN si el receptor está
+    a menos de PLUME_MIN_DISTANCE_M viento abajo o fuera del eje (|y| > PLUME_MAX_CROSSWIND_SIGMA·σy)
+    """
+    theta = np.radians(wind_dir)
+    downwind = -(dx * np.sin(theta) + dy * np.cos(theta))
+    crosswind = dx * np.cos(theta) - dy * np.sin(theta)
+    
+    coefficients = np.array(list(BRIGGS_RURAL.values()))[stability_codes]
+    x = np.where(downwind >= PLUME_MIN_DISTANCE_M, downwind, np.nan)
+    sigma_y = coefficients[:, 0] * x * (1 + 0.0001 * x) ** -0.5
+    sigma_z = coefficients[:, 1] * x * (1 + coefficients[:, 2] * x) ** coefficients[:, 3]
+    
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        kernel = np.exp(-crosswind ** 2 / (2 * sigma_y ** 2)) * np.exp(-height ** 2 / (2 * sigma_z ** 2))
+        q = enhancement_g_m3 * np.pi * wind_speed * sigma_y * sigma_z / kernel
+    in_plume = np.abs(crosswind) <= PLUME_MAX_CROSSWIND_SIGMA * sigma_y
+    q = np.where(in_plume & (wind_speed > 0) & (enhancement_g_m3 > 0) & (kernel > 0) & np.isfinite(q), q, np.nan)
+    return q, downwind
+
+@st.cache_data(show_spinner=False)
+def estimate_plume_rates(df_in, facility_col, lat_col, lon_col, ch4_col, rate_col, wspd_col, wdir_col,
+                         rate_units='kg/h', stability='auto', background=PLUME_BACKGROUND_PPM,
+                         height=PLUME_SOURCE_HEIGHT_M, factor=PLUME_DISAGREEMENT_FACTOR):
+    """
+    Tasa de emisión estimada por pluma gaussiana para cada detección (cacheado)
+    Fuente de cada instalación: centroide de sus detecciones; receptores: las detecciones.
+    Con detecciones aéreas puntuales esta geometría suele ser degenerada (receptores sobre la
+    fuente o viento arriba): solo los receptores a ≥ PLUME_MIN_DISTANCE_M viento abajo son
+    válidos ('Receptor Válido') y solo ellos pueden marcarse como discrepancia.
+    El exceso sobre el fondo (ppm → g/m³) se invierte con el viento y la clase de estabilidad
+    (fija o automática por velocidad) y se compara con la tasa reportada.
+    Retorna DataFrame alineado con df_in
+    """
+    data = df_in[[facility_col, lat_col, lon_col, ch4_col, rate_col, wspd_col, wdir_col]]
+    x_m, y_m = project_to_meters(data[lat_col], data[lon_col])
+    facility_codes = pd.factorize(data[facility_col])[0]
+    source_x = pd.Series(x_m).groupby(facility_codes).transform('mean').to_numpy()
+    source_y = pd.Series(y_m).groupby(facility_codes).transform('mean').to_numpy()
+    
+    wind_speed = data[wspd_col].to_numpy(dtype=float)
+    wind_dir = data[wdir_col].to_numpy(dtype=float)
+    enhancement = (data[ch4_col].to_numpy(dtype=float) - background) * PPM_TO_G_M3_CH4
+    if stability == 'auto':
+        stability_codes = np.array([STABILITY_CLASSES.index(c) for c in STABILITY_BY_SPEED])[
+            np.searchsorted(STABILITY_SPEED_EDGES, np.nan_to_num(wind_speed), side='right')
+        ]
+    else:
+        stability_codes = np.full(len(data), STABILITY_CLASSES.index(stability))
+    
+    # Una sola evaluación vectorizada para todas las detecciones (la fuente ya está resuelta por fila)
+    q_g_s, downwind = gaussian_plume_inversion(x_m - source_x, y_m - source_y, wind_speed, wind_dir,
+                                               enhancement, stability_codes, height)
+    
+    valid_receptor = np.nan_to_num(downwind, nan=-np.inf) >= PLUME_MIN_DISTANCE_M
+    estimated = np.where(valid_receptor, q_g_s * 3.6, np.nan)
+    reported = data[rate_col].to_numpy(dtype=float) * RATE_TO_KG_PER_HOUR.get(rate_units, 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = reported / estimated
+    
+    return pd.DataFrame({
+        'Clase Estabilidad': np.array(STABILITY_CLASSES)[stability_codes],
+        'Distancia Viento Abajo (m)': downwind,
+        'Receptor Válido': valid_receptor,
+        'Tasa Reportada (kg/h)': reported,
+        'Tasa Estimada (kg/h)': estimated,
+        'Razón Reportada/Estimada': ratio,
+        'Discrepancia': valid_receptor & np.isfinite(ratio) & ((ratio > factor) | (ratio < 1 / factor))
+    }, index=df_in.index)
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.12 ÍNDICE ESPACIAL DE GRILLA (RADIO, K VECINOS, BBOX)
+# ═══════════════════════════════════════════════════════════════
+
+SPATIAL_CELL_M = 250.0  # Lado de celda del índice (m)
+
+@st.cache_data(show_spinner=False)
+def build_spatial_index(lat, lon, cell_m=SPATIAL_CELL_M):
+    """
+    Índice de grilla (hash espacial) sobre coordenadas proyectadas en metros (cacheado)
+    Los puntos se ordenan por clave de celda = fila·nx + columna; las celdas de una misma
+    fila quedan contiguas y un rango de columnas se resuelve con dos searchsorted.
+    Las consultas retornan posiciones en los arreglos originales (para df.iloc)
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    lat0, lon0 = float(np.mean(lat)), float(np.mean(lon))
+    x, y = project_to_meters(lat, lon, lat0, lon0)
+    x_min, y_min = float(x.min()), float(y.min())
+    
+    cx = ((x - x_min) // cell_m).astype(np.int64)
+    cy = ((y - y_min) // cell_m).astype(np.int64)
+    nx, ny = int(cx.max()) + 1, int(cy.max()) + 1
+    keys = cy * nx + cx
+    order = np.argsort(keys, kind='stable')
+    
+    return {
+        'x': x[order],
+        'y': y[order],
+        'keys': keys[order],
+        'rows': order,
+        'origin': (lat0, lon0),
+        'bounds': (x_min, y_min, float(x.max()), float(y.max())),
+        'cell_m': cell_m,
+        'shape': (nx, ny)
+    }
+
+def _index_candidates(index, x_lo, x_hi, y_lo, y_hi):
+    """
+    Posiciones (orden del índice) de los puntos en las celdas que cubren el rectángulo
+    """
+    x_min, y_min = index['bounds'][:2]
+    cell = index['cell_m']
+    nx, ny = index['shape']
+    cx0, cx1 = max(int((x_lo - x_min) // cell), 0), min(int((x_hi - x_min) // cell), nx - 1)
+    cy0, cy1 = max(int((y_lo - y_min) // cell), 0), min(int((y_hi - y_min) // cell), ny - 1)
+    if cx0 > cx1 or cy0 > cy1:
+        return np.empty(0, dtype=np.int64)
+    
+    cell_rows = np.arange(cy0, cy1 + 1)
+    starts = np.searchsorted(index['keys'], cell_rows * nx + cx0, side='left')
+    ends = np.searchsorted(index['keys'], cell_rows * nx + cx1, side='right')
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+def spatial_radius_query(index, lat, lon, radius_m):
+    """
+    Puntos a menos de radius_m del punto consultado
+    Retorna (posiciones, distancias en m) ordenadas por distancia
+    """
+    qx, qy = project_to_meters([lat], [lon], *index['origin'])
+    qx, qy = float(qx[0]), float(qy[0])
+    candidates = _index_candidates(index, qx - radius_m, qx + radius_m, qy - radius_m, qy + radius_m)
+    distance = np.hypot(index['x'][candidates] - qx, index['y'][candidates] - qy)
+    keep = distance <= radius_m
+    candidates, distance = candidates[keep], distance[keep]
+    order = np.argsort(distance, kind='stable')
+    return index['rows'][candidates[order]], distance[order]
+
+def spatial_knn_query(index, lat, lon, k):
+    """
+    k vecinos más cercanos: se duplica el radio hasta contener k puntos
+    (todo punto más cercano que el k-ésimo está dentro del radio, así que el resultado es exacto)
+    """
+    k = min(k, len(index['rows']))
+    qx, qy = project_to_meters([lat], [lon], *index['origin'])
+    x_min, y_min, x_max, y_max = index['bounds']
+    max_radius = np.hypot(max(abs(qx[0] - x_min), abs(qx[0] - x_max)), max(abs(qy[0] - y_min), abs(qy[0] - y_max)))
+    
+    radius = index['cell_m']
+    while True:
+        rows, distance = spatial_radius_query(index, lat, lon, radius)
+        if len(rows) >= k or radius >= max_radius:
+            return rows[:k], distance[:k]
+        radius *= 2
+
+def spatial_bbox_query(index, lat_min, lat_max, lon_min, lon_max):
+    """
+    Puntos dentro de un rectángulo lat/lon (la proyección es separable, el rectángulo se conserva)
+    """
+    x_lo, y_lo = project_to_meters([lat_min], [lon_min], *index['origin'])
+    x_hi, y_hi = project_to_meters([lat_max], [lon_max], *index['origin'])
+    candidates = _index_candidates(index, x_lo[0], x_hi[0], y_lo[0], y_hi[0])
+    x, y = index['x'][candidates], index['y'][candidates]
+    keep = (x >= x_lo[0]) & (x <= x_hi[0]) & (y >= y_lo[0]) & (y <= y_hi[0])
+    return index['rows'][candidates[keep]]
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.13 FUENTES PERSISTENTES (DBSCAN ACELERADO POR GRILLA)
+# ═══════════════════════════════════════════════════════════════
+
+SOURCE_MIN_SAMPLES = 1      # Detecciones vecinas para núcleo DBSCAN (1 = componentes conexas)
+SOURCE_QUANTUM_M = 0.5      # Resolución a la que se fusionan coordenadas casi idénticas
+SOURCE_PAIR_CHUNK = 5_000_000
+
+def _connected_labels(n, edges_a, edges_b):
+    """
+    Componentes conexas por propagación de etiqueta mínima con saltos de puntero
+    (vectorizado; converge en pocas iteraciones incluso con millones de aristas)
+    """
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, edges_a, labels[edges_b])
+        np.minimum.at(labels, edges_b, labels[edges_a])
+        labels = labels[labels]
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+@st.cache_data(show_spinner=False)
+def cluster_emission_sources(lat, lon, radius_m=SOURCE_RADIUS_M, min_samples=SOURCE_MIN_SAMPLES):
+    """
+    DBSCAN acelerado por grilla sobre coordenadas proyectadas (cacheado)
+    - Coordenadas cuantizadas a SOURCE_QUANTUM_M: las repeticiones exactas se procesan una vez (con peso)
+    - Celdas de lado radio/√2: todos los puntos de una celda son vecinos entre sí, y solo se
+      comparan pares con las 12 celdas vecinas "hacia adelante" de la vecindad 5×5
+    - Núcleos conectados forman la fuente; puntos borde se unen a un núcleo vecino y el ruido
+      queda como fuente individual
+    Retorna identificadores estables 'F0001'... (ordenados por posición del centroide)
+    """
+    x, y = project_to_meters(lat, lon)
+    qx = np.round(x / SOURCE_QUANTUM_M).astype(np.int64)
+    qy = np.round(y / SOURCE_QUANTUM_M).astype(np.int64)
+    qx -= qx.min()
+    qy -= qy.min()
+    unique_keys, inverse, weight = np.unique(qy * (qx.max() + 1) + qx, return_inverse=True, return_counts=True)
+    px = (unique_keys % (qx.max() + 1)) * SOURCE_QUANTUM_M
+    py = (unique_keys // (qx.max() + 1)) * SOURCE_QUANTUM_M
+    n = len(unique_keys)
+    
+    # Grilla de celdas de lado radio/√2 ordenada por clave
+    cell = radius_m / np.sqrt(2)
+    cx = (px // cell).astype(np.int64)
+    cy = (py // cell).astype(np.int64)
+    nx = int(cx.max()) + 5
+    cell_key = (cy + 2) * nx + (cx + 2)
+    order = np.argsort(cell_key, kind='stable')
+    occupied = np.unique(cell_key)
+    
+    cell_of_point = np.searchsorted(occupied, cell_key)
+    sorted_cell = cell_of_point[order]
+    offsets = [(dx, dy) for dy in range(0, 3) for dx in range(-2, 3) if dy > 0 or dx > 0]
+    
+    # Posición dentro de la celda: descarta puntos que no alcanzan la celda vecina
+    fx = (px - cx * cell)[order]
+    fy = (py - cy * cell)[order]
+    
+    def _reaches(dx, dy):
+        gap_x = np.maximum(0, np.maximum(dx * cell - fx, fx - (dx + 1) * cell))
+        gap_y = np.maximum(0, np.maximum(dy * cell - fy, fy - (dy + 1) * cell))
+        return np.hypot(gap_x, gap_y) <= radius_m
+    
+    def _close_pairs():
+        """
+        Pares (i, j) a menos del radio entre celdas vecinas, en bloques acotados
+        """
+        for dx, dy in offsets:
+            target = occupied + dy * nx + dx
+            position = np.minimum(np.searchsorted(occupied, target), len(occupied) - 1)
+            matched = occupied[position] == target
+            if not matched.any():
+                continue
+            
+            # Subconjuntos (ordenados por celda) de puntos que pueden tener vecinos en la otra celda
+            sides = []
+            for reach in (_reaches(dx, dy), _reaches(-dx, -dy)):
+                points = order[reach]
+                size = np.bincount(sorted_cell[reach], minlength=len(occupied))
+                sides.append((points, size, np.cumsum(size) - size))
+            (a_points, a_size, a_start), (b_points, b_size, b_start) = sides
+            
+            a_cells, b_cells = np.nonzero(matched)[0], position[matched]
+            pair_counts = a_size[a_cells] * b_size[b_cells]
+            keep = pair_counts > 0
+            a_cells, b_cells, pair_counts = a_cells[keep], b_cells[keep], pair_counts[keep]
+            if len(a_cells) == 0:
+                continue
+            bounds = np.unique(np.searchsorted(np.cumsum(pair_counts), np.arange(0, pair_counts.sum(), SOURCE_PAIR_CHUNK), side='right'))
+            for lo, hi in zip(bounds, np.append(bounds[1:], len(a_cells))):
+                a_blk, b_blk, counts = a_cells[lo:hi], b_cells[lo:hi], pair_counts[lo:hi]
+                pair_cell = np.repeat(np.arange(len(a_blk)), counts)
+                local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                b_len = b_size[b_blk][pair_cell]
+                i = a_points[a_start[a_blk][pair_cell] + local // b_len]
+                j = b_points[b_start[b_blk][pair_cell] + local % b_len]
+                close = np.hypot(px[i] - px[j], py[i] - py[j]) <= radius_m
+                yield i[close], j[close]
+    
+    # Núcleos: peso de vecinos = peso de la propia celda + pares cercanos (solo si min_samples > 1)
+    core = np.ones(n, dtype=bool)
+    if min_samples > 1:
+        neighbor_weight = np.bincount(cell_of_point, weights=weight, minlength=len(occupied))[cell_of_point]
+        for i, j in _close_pairs():
+            neighbor_weight += np.bincount(i, weights=weight[j], minlength=n) + np.bincount(j, weights=weight[i], minlength=n)
+        core = neighbor_weight >= min_samples
+    
+    # Los núcleos de una celda son vecinos entre sí: la conectividad se resuelve a nivel de celda
+    cell_has_core = np.bincount(cell_of_point[core], minlength=len(occupied)) > 0
+    cell_edges, border_links = [], []
+    for i, j in _close_pairs():
+        both_core = core[i] & core[j]
+        cell_edges.append(np.unique(cell_of_point[i[both_core]] * len(occupied) + cell_of_point[j[both_core]]))
+        if min_samples > 1:
+            border_links.append(np.concatenate([
+                np.column_stack([i, j])[~core[i] & core[j]],
+                np.column_stack([j, i])[~core[j] & core[i]]
+            ]))
+    cell_edges = np.unique(np.concatenate(cell_edges)) if cell_edges else np.empty(0, dtype=np.int64)
+    cell_labels = _connected_labels(len(occupied), cell_edges // len(occupied), cell_edges % len(occupied))
+    labels = np.where(core, cell_labels[cell_of_point], -1 - np.arange(n))
+    
+    # Bordes: se unen al núcleo de su celda o a un núcleo vecino; ruido: fuente propia
+    border = ~core
+    labels = np.where(border & cell_has_core[cell_of_point], cell_labels[cell_of_point], labels)
+    if border_links:
+        links = np.concatenate(border_links)
+        links = links[labels[links[:, 0]] < 0]
+        labels[links[:, 0]] = labels[links[:, 1]]
+    
+    # Identificadores estables: fuentes ordenadas por centroide (norte → sur, oeste → este)
+    point_labels = labels[inverse]
+    source_codes, source_index = np.unique(point_labels, return_inverse=True)
+    centroid_lat = np.bincount(source_index, weights=np.asarray(lat, dtype=float)) / np.bincount(source_index)
+    centroid_lon = np.bincount(source_index, weights=np.asarray(lon, dtype=float)) / np.bincount(source_index)
+    rank = np.empty(len(source_codes), dtype=np.int64)
+    rank[np.lexsort((centroid_lon, -centroid_lat))] = np.arange(len(source_codes))
+    width = max(4, len(str(len(source_codes))))
+    return np.char.add('F', np.char.zfill(rank[source_index].astype(str), width))
+
+@st.cache_data(show_spinner=False)
+def summarize_emission_sources(_df_in, cache_key, source_col, facility_col, lat_col, lon_col, ch4_col, rate_col=None, time_col=None):
+    """
+    Agregados por fuente persistente en una sola pasada agrupada
+    Persistencia = días con detección de la fuente / días de levantamiento del dataset
+    Instalación = la más frecuente de la fuente (un conteo por par fuente/instalación, sin
+    funciones Python por grupo). _df_in no se hashea: cache_key = (dataset, radio, filtro)
+    """
+    data = _df_in.copy(deep=False)
+    aggregations = {
+        'Detecciones': (lat_col, 'size'),
+        'Latitud': (lat_col, 'mean'),
+        'Longitud': (lon_col, 'mean'),
+        'CH₄ Máximo': (ch4_col, 'max')
+    }
+    if rate_col:
+        aggregations['Rate Promedio'] = (rate_col, 'mean')
+        aggregations['Rate Máximo'] = (rate_col, 'max')
+    if time_col:
+        data['_dia'] = data[time_col].dt.floor('D')
+        aggregations['Primera Detección'] = (time_col, 'min')
+        aggregations['Última Detección'] = (time_col, 'max')
+        aggregations['Días Detectada'] = ('_dia', 'nunique')
+    
+    sources = data.groupby(source_col, sort=True).agg(**aggregations)
+    pair_counts = data.groupby([source_col, facility_col], sort=True, observed=True).size()
+    modal = pair_counts.sort_values(ascending=False, kind='stable').reset_index().drop_duplicates(source_col)
+    sources.insert(0, 'Instalación', modal.set_index(source_col)[facility_col].reindex(sources.index))
+    if time_col:
+        survey_days = data['_dia'].nunique()
+        sources['Persistencia %'] = sources['Días Detectada'] / max(survey_days, 1) * 100
+    return sources
+
+@st.cache_data(show_spinner=False)
+def deduplicate_by_source(_df_in, cache_key, facility_col, value_col, source_col='Fuente'):
+    """
+    Consolida detecciones repetidas de una misma fuente persistente
+    Retorna una fila por (instalación, fuente) con el valor medio de sus detecciones y el
+    número de detecciones ('Detecciones'). Sin columna de fuentes, cada detección es una fuente.
+    _df_in no se hashea: cache_key = (dataset, radio, filtro) identifica su contenido
+    """
+    if source_col not in _df_in.columns:
+        data = _df_in[[facility_col, value_col]].dropna()
+        return data.assign(Detecciones=1).reset_index(drop=True)
+    data = _df_in[[facility_col, source_col, value_col]].dropna()
+    return data.groupby([facility_col, source_col], sort=False, observed=True)[value_col].agg(
+        **{value_col: 'mean', 'Detecciones': 'size'}
+    ).reset_index()
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.14 PUNTOS CALIENTES GETIS-ORD Gi* (MATRIZ DE VECINOS DISPERSA)
+# ═══════════════════════════════════════════════════════════════
+
+GI_PAIR_CHUNK = 5_000_000  # Pares por bloque al recorrer la matriz dispersa
+GI_CONFIDENCE_Z = [(2.576, 3), (1.960, 2), (1.645, 1)]  # |z| → nivel 99% / 95% / 90%
+GI_BIN_LABELS = {
+    3: '🔴 Caliente 99%', 2: '🔴 Caliente 95%', 1: '🔴 Caliente 90%',
+    0: 'No significativo',
+    -1: '🔵 Frío 90%', -2: '🔵 Frío 95%', -3: '🔵 Frío 99%'
+}
+
+def spatial_neighbor_pairs(index, band_m, chunk=GI_PAIR_CHUNK):
+    """
+    Matriz de vecinos por banda de distancia en formato disperso (COO), generada por bloques
+    Solo se comparan celdas del índice a menos de la banda; cada par i < j aparece una vez
+    (posiciones en el orden del índice). Memoria acotada por chunk, no por n²
+    """
+    keys, x, y = index['keys'], index['x'], index['y']
+    nx = index['shape'][0]
+    occupied, cell_start, cell_size = np.unique(keys, return_index=True, return_counts=True)
+    occupied_cx = occupied % nx
+    reach = int(np.ceil(band_m / index['cell_m']))
+    offsets = [(dx, dy) for dy in range(0, reach + 1) for dx in range(-reach, reach + 1) if dy > 0 or dx >= 0]
+    
+    for dx, dy in offsets:
+        target = occupied + dy * nx + dx
+        position = np.minimum(np.searchsorted(occupied, target), len(occupied) - 1)
+        # Las claves son fila·nx + columna: se descartan desplazamientos que cruzan de fila
+        matched = (occupied[position] == target) & (occupied_cx + dx >= 0) & (occupied_cx + dx < nx)
+        a_cells, b_cells = np.nonzero(matched)[0], position[matched]
+        if len(a_cells) == 0:
+            continue
+        pair_counts = cell_size[a_cells] * cell_size[b_cells]
+        bounds = np.unique(np.searchsorted(np.cumsum(pair_counts), np.arange(0, pair_counts.sum(), chunk), side='right'))
+        for lo, hi in zip(bounds, np.append(bounds[1:], len(a_cells))):
+            a_blk, b_blk, counts = a_cells[lo:hi], b_cells[lo:hi], pair_counts[lo:hi]
+            pair_cell = np.repeat(np.arange(len(a_blk)), counts)
+            local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            b_len = cell_size[b_blk][pair_cell]
+            i = cell_start[a_blk][pair_cell] + local // b_len
+            j = cell_start[b_blk][pair_cell] + local % b_len
+            keep = np.hypot(x[i] - x[j], y[i] - y[j]) <= band_m
+            if dx == 0 and dy == 0:
+                keep &= i < j
+            yield i[keep], j[keep]
+
+@st.cache_data(show_spinner=False)
+def getis_ord_gi_star(lat, lon, values, band_m=GI_BAND_M):
+    """
+    Estadístico Gi* de Getis-Ord con pesos binarios por banda de distancia (cacheado)
+    Gi* = (Σⱼ wᵢⱼ xⱼ − x̄ Σⱼ wᵢⱼ) / (S √[(n Σⱼ wᵢⱼ² − (Σⱼ wᵢⱼ)²) / (n − 1)]), con wᵢᵢ = 1
+    Los rezagos espaciales se acumulan recorriendo la matriz dispersa por bloques (casi lineal)
+    Retorna DataFrame alineado con la entrada: z, vecinos y nivel de confianza (-3..3)
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    values = np.asarray(values, dtype=float)
+    result = pd.DataFrame({
+        'z': np.full(len(values), np.nan),
+        'vecinos': np.zeros(len(values), dtype=np.int64),
+        'nivel': np.zeros(len(values), dtype=np.int64)
+    })
+    valid = np.flatnonzero(np.isfinite(values) & np.isfinite(lat) & np.isfinite(lon))
+    n = len(valid)
+    if n < 3:
+        return result
+    
+    # Celda del índice = banda: cada punto solo se compara con su vecindad 3×3
+    index = build_spatial_index(lat[valid], lon[valid], cell_m=float(band_m))
+    x = values[valid][index['rows']]
+    spatial_lag = x.copy()
+    weight_sum = np.ones(n)
+    for i, j in spatial_neighbor_pairs(index, band_m):
+        spatial_lag += np.bincount(i, weights=x[j], minlength=n) + np.bincount(j, weights=x[i], minlength=n)
+        weight_sum += np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+    
+    # Pesos binarios: Σ wᵢⱼ² = Σ wᵢⱼ
+    mean = x.mean()
+    s = np.sqrt(max(np.mean(x ** 2) - mean ** 2, 0.0))
+    denominator = s * np.sqrt(np.maximum(n * weight_sum - weight_sum ** 2, 0) / (n - 1))
+    z = np.divide(spatial_lag - mean * weight_sum, denominator, out=np.full(n, np.nan), where=denominator > 0)
+    
+    level = np.zeros(n, dtype=np.int64)
+    for threshold, confidence in reversed(GI_CONFIDENCE_Z):
+        level[np.abs(z) >= threshold] = confidence
+    level *= np.sign(np.nan_to_num(z)).astype(np.int64)
+    
+    rows = valid[index['rows']]
+    result.loc[rows, 'z'] = z
+    result.loc[rows, 'vecinos'] = (weight_sum - 1).astype(np.int64)
+    result.loc[rows, 'nivel'] = level
+    return result
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.15 RECONCILIACIÓN ENTRE INVENTARIOS (ÍNDICE DE NOMBRES)
+# ═══════════════════════════════════════════════════════════════
+
+MATCH_MIN_SCORE = 0.6        # Similitud Dice mínima (trigramas) para aceptar un emparejamiento
+MATCH_MAX_BLOCK = 200        # Trigramas más frecuentes que esto no generan candidatos (p. ej. "clu")
+def _name_blocking_keys(keys):
+    """
+    Trigramas (con relleno de bordes) y firma numérica de nombres canónicos
+    Retorna conjuntos de trigramas, firma numérica e índice invertido (posición, clave de bloqueo)
+    """
+    keys = pd.Series(keys).reset_index(drop=True)
+    grams = keys.map(lambda s: {f"  {s} "[k:k + 3] for k in range(len(s) + 1)})
+    numbers = keys.str.findall(r'\d+').map(lambda found: ' '.join(sorted(found)))
+    exploded = grams.explode().dropna()
+    inverted = pd.concat([
+        pd.DataFrame({'pos': exploded.index.to_numpy(), 'block': exploded.to_numpy()}),
+        pd.DataFrame({'pos': keys.index.to_numpy(), 'block': '#' + numbers.to_numpy()})[numbers.to_numpy() != '']
+    ], ignore_index=True)
+    return grams, numbers, inverted
+
+@st.cache_data(show_spinner=False)
+def match_facility_names(names_a, names_b, min_score=MATCH_MIN_SCORE, max_block=MATCH_MAX_BLOCK):
+    """
+    Emparejamiento uno a uno de instalaciones entre dos inventarios (cacheado)
+    1. Clave normalizada idéntica → similitud 1
+    2. Resto: bloqueo por trigramas poco frecuentes y firma numérica (índice invertido);
+       los candidatos deben tener los mismos números (Pozo 3 ≠ Pozo 4) y se puntúan con
+       Dice sobre trigramas, con asignación voraz por similitud descendente
+    Nunca se comparan todos los pares: solo nombres que comparten alguna clave de bloqueo
+    Retorna DataFrame con nombre_a, nombre_b, similitud y método
+    """
+    keys_a = pd.Series(pd.unique(normalize_facility_name(names_a).dropna()))
+    keys_b = pd.Series(pd.unique(normalize_facility_name(names_b).dropna()))
+    originals_a = pd.Series(names_a).groupby(normalize_facility_name(names_a).to_numpy()).first()
+    originals_b = pd.Series(names_b).groupby(normalize_facility_name(names_b).to_numpy()).first()
+    
+    exact = keys_a[keys_a.isin(set(keys_b))]
+    matches = [pd.DataFrame({'key_a': exact.to_numpy(), 'key_b': exact.to_numpy(), 'similitud': 1.0, 'método': 'Exacto'})]
+    
+    rest_a = keys_a[~keys_a.isin(set(exact))].reset_index(drop=True)
+    rest_b = keys_b[~keys_b.isin(set(exact))].reset_index(drop=True)
+    if len(rest_a) and len(rest_b):
+        grams_a, numbers_a, blocks_a = _name_blocking_keys(rest_a)
+        grams_b, numbers_b, blocks_b = _name_blocking_keys(rest_b)
+        block_size = blocks_b['block'].map(blocks_b['block'].value_counts())
+        blocks_b = blocks_b[block_size.to_numpy() <= max_block]
+        
+        shared = blocks_a.merge(blocks_b, on='block', suffixes=('_a', '_b'))[['pos_a', 'pos_b']].drop_duplicates()
+        shared = shared[numbers_a.to_numpy()[shared['pos_a']] == numbers_b.to_numpy()[shared['pos_b']]]
+        sets_a, sets_b = grams_a.to_numpy()[shared['pos_a']], grams_b.to_numpy()[shared['pos_b']]
+        common = np.fromiter((len(x & y) for x, y in zip(sets_a, sets_b)), dtype=float, count=len(shared))
+        sizes = np.fromiter((len(x) + len(y) for x, y in zip(sets_a, sets_b)), dtype=float, count=len(shared))
+        shared = shared.assign(similitud=2 * common / np.maximum(sizes, 1))
+        shared = shared[shared['similitud'] >= min_score].sort_values('similitud', ascending=False, kind='stable')
+        
+        # Asignación voraz: cada ronda fija el mejor candidato libre de cada lado
+        fuzzy = []
+        while len(shared):
+            best = shared.drop_duplicates('pos_a').drop_duplicates('pos_b')
+            fuzzy.append(best)
+            shared = shared[~shared['pos_a'].isin(best['pos_a']) & ~shared['pos_b'].isin(best['pos_b'])]
+        if fuzzy:
+            fuzzy = pd.concat(fuzzy)
+            matches.append(pd.DataFrame({
+                'key_a': rest_a.to_numpy()[fuzzy['pos_a']],
+                'key_b': rest_b.to_numpy()[fuzzy['pos_b']],
+                'similitud': fuzzy['similitud'].to_numpy(),
+                'método': 'Aproximado'
+            }))
+    
+    matches = pd.concat(matches, ignore_index=True)
+    matches['nombre_a'] = matches['key_a'].map(originals_a)
+    matches['nombre_b'] = matches['key_b'].map(originals_b)
+    return matches
+
+def reconcile_inventories(matches, totals_a, totals_b):
+    """
+    Deltas por instalación emparejada y regresión B = m·A + b (vectorizado)
+    totals_a / totals_b: Series indexadas por clave normalizada (misma unidad)
+    Factor de reconciliación = A / B (multiplicador que lleva B a la escala de A)
+    """
+    a = totals_a.reindex(matches['key_a']).to_numpy(dtype=float)
+    b = totals_b.reindex(matches['key_b']).to_numpy(dtype=float)
+    table = pd.DataFrame({
+        'Instalación': matches['nombre_a'].to_numpy(),
+        'Instalación (B)': matches['nombre_b'].to_numpy(),
+        'Similitud': matches['similitud'].to_numpy(),
+        'Método': matches['método'].to_numpy(),
+        'A': a,
+        'B': b
+    })
+    table['Δ (B − A)'] = b - a
+    table['Δ %'] = np.divide((b - a) * 100, a, out=np.full(len(a), np.nan), where=a != 0)
+    table['Factor A/B'] = np.divide(a, b, out=np.full(len(a), np.nan), where=b != 0)
+    
+    valid = np.isfinite(a) & np.isfinite(b)
+    a, b = a[valid], b[valid]
+    stats = {'n': int(valid.sum()), 'pendiente': np.nan, 'intercepto': np.nan, 'r2': np.nan,
+             'factor_global': np.nan, 'factor_mediana': np.nan}
+    if len(a) >= 2 and np.ptp(a) > 0:
+        slope, intercept = np.polyfit(a, b, 1)
+        residual = b - (slope * a + intercept)
+        total = np.sum((b - b.mean()) ** 2)
+        stats.update(pendiente=slope, intercepto=intercept, r2=1 - np.sum(residual ** 2) / total if total > 0 else np.nan)
+    if np.sum(b) > 0:
+        stats['factor_global'] = np.sum(a) / np.sum(b)
+        stats['factor_mediana'] = float(np.nanmedian(table['Factor A/B'].to_numpy()[valid]))
+    return table, stats
+
+@st.cache_data(show_spinner=False)
+def load_comparison_inventory(file_bytes, file_name):
+    """
+    Carga el inventario de la segunda metodología (CSV o Excel) desde memoria, sin red
+    En Excel se usa la primera hoja cuyo encabezado contiene instalación y tasa
+    """
+    buffer = io.BytesIO(file_bytes)
+    if file_name.lower().endswith('.csv'):
+        inventory = pd.read_csv(buffer)
+    else:
+        xls = pd.ExcelFile(buffer)
+        inventory = None
+        for sheet in xls.sheet_names:
+            preview = pd.read_excel(xls, sheet_name=sheet, header=None, nrows=20)
+            for idx in range(len(preview)):
+                row_text = ' '.join(str(val).lower() for val in preview.iloc[idx])
+                if ('facility' in row_text or 'instalaci' in row_text) and ('rate' in row_text or 'tasa' in row_text or 'kg' in row_text):
+                    inventory = pd.read_excel(xls, sheet_name=sheet, header=idx)
+                    break
+            if inventory is not None:
+                break
+        if inventory is None:
+            inventory = pd.read_excel(xls, sheet_name=0)
+    inventory.columns = inventory.columns.astype(str).str.strip()
+    return inventory
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.16 INTERVALOS DE CONFIANZA BOOTSTRAP POR INSTALACIÓN
+# ═══════════════════════════════════════════════════════════════
+
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 42
+BOOTSTRAP_CHUNK_ELEMS = 4_000_000   # Remuestras × filas por bloque (u float32 + índices int64 + valores float64: pico ~100 MB)
+
+@st.cache_data(show_spinner=False)
+def bootstrap_facility_ci(df_in, facility_col, value_col, n_resamples=BOOTSTRAP_RESAMPLES,
+                          confidence=BOOTSTRAP_CONFIDENCE, seed=BOOTSTRAP_SEED):
+    """
+    IC bootstrap percentil de la media y del total por instalación (cacheado)
+    Todas las instalaciones se remuestrean a la vez: con las filas ordenadas por instalación,
+    cada fila de una remuestra toma start[g] + ⌊u·n[g]⌋ de su propio grupo y las sumas por
+    grupo salen de np.add.reduceat. Las remuestras se procesan en bloques de
+    BOOTSTRAP_CHUNK_ELEMS elementos con un generador sembrado (resultados reproducibles)
+    Retorna (tabla por instalación, IC del total del dataset como dict)
+    """
+    data = df_in[[facility_col, value_col]].dropna()
+    codes, facilities = pd.factorize(data[facility_col], sort=True)
+    order = np.argsort(codes, kind='stable')
+    values = data[value_col].to_numpy(dtype=float)[order]
+    codes = codes[order]
+    
+    size = np.bincount(codes, minlength=len(facilities))
+    start = np.cumsum(size) - size
+    row_start, row_size = start[codes], size[codes]
+    n_rows = len(values)
+    
+    rng = np.random.default_rng(seed)
+    block = max(1, BOOTSTRAP_CHUNK_ELEMS // max(n_rows, 1))
+    group_sums = np.empty((n_resamples, len(facilities)))
+    for lo in range(0, n_resamples, block):
+        hi = min(lo + block, n_resamples)
+        u = rng.random((hi - lo, n_rows), dtype=np.float32)
+        picks = (u * row_size.astype(np.float32)).astype(np.int64)
+        np.minimum(picks, row_size - 1, out=picks)
+        picks += row_start
+        group_sums[lo:hi] = np.add.reduceat(values[picks], start, axis=1)
+    
+    alpha = (1 - confidence) / 2 * 100
+    sum_lo, sum_hi = np.percentile(group_sums, [alpha, 100 - alpha], axis=0)
+    table = pd.DataFrame({
+        'Nº Mediciones': size,
+        'Promedio': np.bincount(codes, weights=values) / size,
+        'IC Inf. Promedio': sum_lo / size,
+        'IC Sup. Promedio': sum_hi / size,
+        'Total': np.bincount(codes, weights=values),
+        'IC Inf. Total': sum_lo,
+        'IC Sup. Total': sum_hi
+    }, index=pd.Index(np.asarray(facilities), name=facility_col))
+    
+    # IC del total del dataset: bootstrap estratificado (suma de los grupos en cada remuestra)
+    dataset_total = group_sums.sum(axis=1)
+    total_lo, total_hi = np.percentile(dataset_total, [alpha, 100 - alpha])
+    return table, {'total': float(values.sum()), 'lo': float(total_lo), 'hi': float(total_hi),
+                   'confidence': confidence, 'resamples': n_resamples}
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.17 HISTOGRAMAS Y BOX PLOTS PRECALCULADOS EN EL SERVIDOR
+# ═══════════════════════════════════════════════════════════════
+
+HIST_BINS = 30
+BOX_MAX_OUTLIERS = 500  # Outliers enviados al navegador por caja (muestra equiespaciada)
+
+@st.cache_data(show_spinner=False)
+def histogram_bins(values, nbins=HIST_BINS):
+    """
+    Histograma calculado con np.histogram (cacheado por filtro)
+    La figura recibe nbins barras en lugar de todas las mediciones
+    Retorna DataFrame con inicio, fin, centro y conteo de cada bin
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return pd.DataFrame(columns=['inicio', 'fin', 'centro', 'conteo'])
+    counts, edges = np.histogram(values, bins=nbins)
+    return pd.DataFrame({'inicio': edges[:-1], 'fin': edges[1:],
+                         'centro': (edges[:-1] + edges[1:]) / 2, 'conteo': counts})
+
+@st.cache_data(show_spinner=False)
+def grouped_box_statistics(df_in, group_col, value_col, max_outliers=BOX_MAX_OUTLIERS):
+    """
+    Estadísticas de box plot de todos los grupos en una sola pasada vectorizada (cacheado por filtro)
+    Con las filas ordenadas por (grupo, valor), los cuartiles lineales (como Plotly) se interpolan
+    en start + p·(n-1); los bigotes de Tukey (1.5·IQR) salen de np.minimum/maximum.reduceat sobre
+    los valores dentro de las vallas y los outliers se muestrean equiespaciados hasta max_outliers
+    Retorna (tabla por grupo con n, q1, mediana, q3, bigotes, media, desv, mín, máx y outliers,
+    DataFrame grupo/valor con la muestra de outliers)
+    """
+    data = df_in[[group_col, value_col]].dropna()
+    values = data[value_col].to_numpy(dtype=float)
+    finite = np.isfinite(values)
+    codes, groups = pd.factorize(data[group_col][finite], sort=True)
+    values = values[finite]
+    columns = ['n', 'q1', 'mediana', 'q3', 'bigote_inf', 'bigote_sup', 'media', 'desv', 'mín', 'máx', 'outliers']
+    if len(values) == 0:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=['grupo', 'valor'])
+    
+    order = np.lexsort((values, codes))
+    values, codes = values[order], codes[order]
+    size = np.bincount(codes, minlength=len(groups))
+    start = np.cumsum(size) - size
+    end = start + size - 1
+    
+    def quantile(p):
+        pos = p * (size - 1)
+        low = np.floor(pos).astype(np.int64)
+        frac = pos - low
+        return values[start + low] + frac * (values[np.minimum(start + low + 1, end)] - values[start + low])
+    
+    q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    iqr = q3 - q1
+    inside = (values >= (q1 - 1.5 * iqr)[codes]) & (values <= (q3 + 1.5 * iqr)[codes])
+    lower = np.minimum.reduceat(np.where(inside, values, np.inf), start)
+    upper = np.maximum.reduceat(np.where(inside, values, -np.inf), start)
+    
+    sums = np.bincount(codes, weights=values)
+    mean = sums / size
+    sq_dev = np.bincount(codes, weights=(values - mean[codes]) ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.where(size > 1, np.sqrt(sq_dev / (size - 1)), np.nan)
+    
+    # Muestra equiespaciada de outliers por grupo (rango r entre los outliers de su grupo)
+    out_rows = np.flatnonzero(~inside)
+    out_codes = codes[out_rows]
+    n_out = np.bincount(out_codes, minlength=len(groups))
+    rank = np.arange(len(out_rows)) - (np.cumsum(n_out) - n_out)[out_codes]
+    group_out = n_out[out_codes]
+    if max_outliers > 1:
+        step = np.maximum(group_out - 1, 1) / (max_outliers - 1)
+        keep = (group_out <= max_outliers) | (np.round(np.round(rank / step) * step) == rank)
+    else:
+        keep = (group_out <= max_outliers) | (rank == 0)
+    
+    names = np.asarray(groups)
+    stats = pd.DataFrame({
+        'n': size, 'q1': q1, 'mediana': median, 'q3': q3,
+        'bigote_inf': lower, 'bigote_sup': upper, 'media': mean, 'desv': std,
+        'mín': values[start], 'máx': values[end], 'outliers': n_out
+    }, index=pd.Index(names, name=group_col))
+    outliers = pd.DataFrame({'grupo': names[out_codes[keep]], 'valor': values[out_rows[keep]]})
+    return stats, outliers
+
+def box_statistics(values, label, max_outliers=BOX_MAX_OUTLIERS):
+    """
+    Estadísticas de box plot de una sola serie (grouped_box_statistics con un único grupo)
+    Retorna (tabla de una fila indexada por label, DataFrame grupo/valor de outliers)
+    """
+    return grouped_box_statistics(pd.DataFrame({'grupo': label, 'valor': np.asarray(values, dtype=float)}),
+                                  'grupo', 'valor', max_outliers)
+
+def precomputed_box_traces(stats, outliers, color, value_label, boxmean=True):
+    """
+    Trazas Plotly de cajas precalculadas: una go.Box con q1/median/q3/fences por grupo
+    y un scatter con la muestra de outliers (la figura no transporta los datos crudos)
+    """
+    names = stats.index.astype(str).tolist()
+    box = go.Box(
+        x=names, q1=stats['q1'], median=stats['mediana'], q3=stats['q3'],
+        lowerfence=stats['bigote_inf'], upperfence=stats['bigote_sup'],
+        mean=stats['media'], sd=stats['desv'].fillna(0) if boxmean == 'sd' else None,
+        boxmean=boxmean, boxpoints=False, marker=dict(color=color),
+        customdata=stats[['n', 'outliers']].to_numpy(),
+        hovertemplate=(f'<b>%{{x}}</b><br>Mediana: %{{median:.2f}}<br>Q1–Q3: %{{q1:.2f}} – %{{q3:.2f}}'
+                       f'<br>Bigotes: %{{lowerfence:.2f}} – %{{upperfence:.2f}}<br>Mediciones: %{{customdata[0]:,}}'
+                       f'<br>Outliers: %{{customdata[1]:,}}<extra>{value_label}</extra>')
+    )
+    points = go.Scatter(
+        x=outliers['grupo'].astype(str), y=outliers['valor'], mode='markers',
+        marker=dict(color=color, size=5, opacity=0.6, symbol='circle-open'),
+        hovertemplate=f'<b>%{{x}}</b><br>{value_label}: %{{y:.2f}}<extra>Outlier</extra>'
+    )
+    return [box, points]
+
+def histogram_bar_trace(bins, color, line_color=None, name='Frecuencia'):
+    """
+    Barra Plotly para un histograma precalculado (ancho = ancho del bin, sin huecos)
+    """
+    return go.Bar(
+        x=bins['centro'], y=bins['conteo'], width=(bins['fin'] - bins['inicio']),
+        customdata=bins[['inicio', 'fin']].to_numpy(), name=name,
+        marker=dict(color=color, line=dict(color=line_color or color, width=1)),
+        hovertemplate='%{customdata[0]:.2f} – %{customdata[1]:.2f}<br>Frecuencia: %{y:,}<extra></extra>'
+    )
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.18 TABLA PAGINADA EN EL SERVIDOR (ORDEN, FILTRO Y COLUMNAS)
+# ═══════════════════════════════════════════════════════════════
+
+TABLE_PAGE_SIZES = [25, 50, 100, 250, 500]
+TABLE_DEFAULT_PAGE_SIZE = 50
+
+@st.cache_data(show_spinner=False)
+def sort_permutation(values, ascending=True):
+    """
+    Permutación de posiciones que ordena una columna (cacheada por columna, sentido y filtro)
+    Orden estable con nulos al final; las categóricas ordenan por su diccionario alfabético.
+    Columnas object con tipos mezclados (p. ej. números y "N/A" de Excel): números primero y
+    luego el texto, comparado como cadena
+    """
+    series = values.reset_index(drop=True)
+    try:
+        ordered = series.sort_values(ascending=ascending, kind='stable', na_position='last')
+    except TypeError:
+        numeric = pd.to_numeric(series, errors='coerce')
+        keys = pd.DataFrame({
+            'nulo': series.isna(),
+            'numero': numeric,
+            'texto': series.astype(str).where(numeric.isna() & series.notna(), '')
+        })
+        ordered = keys.sort_values(['nulo', 'numero', 'texto'], ascending=[True, ascending, ascending],
+                                   kind='stable', na_position='last')
+    return ordered.index.to_numpy()
+
+@st.cache_data(show_spinner=False)
+def table_filter_mask(values, query=None, bounds=None):
+    """
+    Máscara booleana del filtro de la tabla paginada (cacheada por columna y consulta)
+    - bounds=(mín, máx): rango cerrado para columnas numéricas
+    - query: subcadena sin distinguir mayúsculas; en categóricas se evalúa sobre las categorías
+    """
+    if bounds is not None:
+        numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+        return (numeric >= bounds[0]) & (numeric <= bounds[1])
+    if not query:
+        return np.ones(len(values), dtype=bool)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        hits = np.asarray(values.cat.categories.astype(str).str.contains(query, case=False, regex=False))
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, hits[codes], False)
+    return values.astype(str).str.contains(query, case=False, regex=False).to_numpy()
 
-if selected_campo != "Todos los Campos":
-    st.info(f"🏭 Visualizando datos de: **{selected_campo}** ({len(df):,} puntos)")
+def paginate_table(df_in, columns, sort_col=None, ascending=True, mask=None, page=1, page_size=TABLE_DEFAULT_PAGE_SIZE):
+    """
+    Página visible de la tabla: aplica la máscara sobre la permutación cacheada de sort_col
+    y solo materializa las filas de la página (el navegador nunca recibe el dataset completo)
+    Retorna (DataFrame de la página, total de filas filtradas, página efectiva, número de páginas)
+    """
+    rows = sort_permutation(df_in[sort_col], ascending) if sort_col else np.arange(len(df_in))
+    if mask is not None:
+        rows = rows[mask[rows]]
+    n_pages = max(1, -(-len(rows) // page_size))
+    page = min(max(1, int(page)), n_pages)
+    visible = rows[(page - 1) * page_size:page * page_size]
+    return df_in.iloc[visible][columns], len(rows), page, n_pages
+
+# ═══════════════════════════════════════════════════════════════
+# 4.8.19 EXPORTACIÓN BAJO DEMANDA (CSV.GZ, PARQUET, GEOJSON)
+# ═══════════════════════════════════════════════════════════════
+
+EXPORT_CHUNK_ROWS = 100_000  # Filas serializadas por bloque (acota el texto intermedio en memoria)
+EXPORT_CACHE_ENTRIES = 4     # Archivos de exportación retenidos en caché (filtro × formato)
+EXPORT_CACHE_TTL = 3600      # Vida máxima de un archivo cacheado (segundos)
+EXPORT_FORMATS = {
+    'CSV comprimido (.csv.gz)': ('csv.gz', 'application/gzip'),
+    'Parquet (.parquet)': ('parquet', 'application/vnd.apache.parquet'),
+    'GeoJSON (.geojson)': ('geojson', 'application/geo+json'),
+    'CSV (.csv)': ('csv', 'text/csv')
+}
+
+def _export_chunks(df_in):
+    """Bloques consecutivos de EXPORT_CHUNK_ROWS filas (al menos uno, para escribir la cabecera)"""
+    for start in range(0, max(len(df_in), 1), EXPORT_CHUNK_ROWS):
+        yield start, df_in.iloc[start:start + EXPORT_CHUNK_ROWS]
+
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES, ttl=EXPORT_CACHE_TTL)
+def build_export(_df_in, cache_key, fmt, lat_col, lon_col):
+    """
+    Genera el archivo de exportación en el formato pedido (cacheado por filtro y formato)
+    _df_in no se hashea: cache_key = (dataset, columnas limpias, filtro, radio, banda, columnas)
+    - csv / csv.gz: bloques de filas escritos en secuencia (gzip con mtime fijo, reproducible)
+    - parquet: columnar vía pyarrow, un row group por bloque; columnas de texto como string
+    - geojson: FeatureCollection de puntos (lon, lat), propiedades serializadas por bloque
+    Retorna los bytes del archivo
+    """
+    buffer = io.BytesIO()
+    if fmt in ('csv', 'csv.gz'):
+        target = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6, mtime=0) if fmt == 'csv.gz' else buffer
+        for start, chunk in _export_chunks(_df_in):
+            target.write(chunk.to_csv(index=False, header=start == 0).encode('utf-8'))
+        if target is not buffer:
+            target.close()
+    elif fmt == 'parquet':
+        text_cols = _df_in.select_dtypes(include='object').columns
+        _df_in.astype({col: 'string' for col in text_cols}).to_parquet(
+            buffer, index=False, row_group_size=EXPORT_CHUNK_ROWS)
+    elif fmt == 'geojson':
+        buffer.write(b'{"type":"FeatureCollection","features":[')
+        first = True
+        for _, chunk in _export_chunks(_df_in.dropna(subset=[lat_col, lon_col])):
+            if len(chunk) == 0:
+                continue
+            properties = chunk.drop(columns=[lat_col, lon_col]).to_json(
+                orient='records', lines=True, date_format='iso', force_ascii=False).splitlines()
+            features = ','.join(
+                f'{{"type":"Feature","geometry":{{"type":"Point","coordinates":[{lon!r},{lat!r}]}},"properties":{props}}}'
+                for lon, lat, props in zip(chunk[lon_col].astype(float).tolist(), chunk[lat_col].astype(float).tolist(), properties)
+            )
+            buffer.write((features if first else ',' + features).encode('utf-8'))
+            first = False
+        buffer.write(b']}')
+    else:
+        raise ValueError(f"Formato de exportación no soportado: {fmt}")
+    return buffer.getvalue()
+
+# Consolidar detecciones repetidas en fuentes persistentes (una sola vez por radio)
+# Se agrupa el dataset sin filtrar: los ids 'Fuente' no cambian al cambiar el filtro de campo
+# Clave de los agregados por fuente: dataset + columnas + radio + filtro (evita hashear df en cada rerun)
+source_cache_key = (file_key, clean_key, float(source_radius_m), selected_campo)
+if len(df) > 0:
+    source_ids = cluster_emission_sources(df_all[lat_col].to_numpy(), df_all[lon_col].to_numpy(), float(source_radius_m))
+    df['Fuente'] = pd.Series(source_ids, index=df_all.index).loc[df.index].to_numpy()
+
+# Puntos calientes/fríos Getis-Ord Gi* sobre el emission rate (cacheado por filtro de campo y banda)
+if emission_rate_col and emission_rate_col in df.columns and len(df) > 0:
+    hotspots = getis_ord_gi_star(
+        df[lat_col].to_numpy(), df[lon_col].to_numpy(),
+        pd.to_numeric(df[emission_rate_col], errors='coerce').to_numpy(), float(hotspot_band_m)
+    )
+    df['Gi* z'] = hotspots['z'].to_numpy()
+    df['Gi* Nivel'] = hotspots['nivel'].to_numpy()
 
 # ══════════════════════════════════════════════════════════════════════
 # 5. SECCIÓN DE KPIs PRINCIPALES
@@ -656,9 +3248,8 @@ if selected_campo != "Todos los Campos":
 # ═══════════════════════════════════════════════════════════════
 
 if emission_rate_col and emission_rate_col in df.columns and facility_col and facility_col in df.columns:
-    # Calcular KPIs de Emission Rate
-    df_emission_kpi = df[[facility_col, emission_rate_col]].copy()
-    df_emission_kpi = df_emission_kpi.dropna()
+    # Calcular KPIs de Emission Rate sobre fuentes persistentes (detecciones repetidas consolidadas)
+    df_emission_kpi = deduplicate_by_source(df, source_cache_key, facility_col, emission_rate_col)
     
     if len(df_emission_kpi) > 0:
         st.markdown("---")
@@ -668,9 +3259,11 @@ if emission_rate_col and emission_rate_col in df.columns and facility_col and fa
         total_emission_rate = df_emission_kpi[emission_rate_col].sum()
         avg_emission_rate = df_emission_kpi[emission_rate_col].mean()
         num_measurements = len(df_emission_kpi)
+        num_detections = int(df_emission_kpi['Detecciones'].sum())
+        total_detection_rate = df[emission_rate_col].sum()
         
         # Agrupar por instalación
-        emission_by_facility = df_emission_kpi.groupby(facility_col)[emission_rate_col].sum()
+        emission_by_facility = df_emission_kpi.groupby(facility_col, observed=True)[emission_rate_col].sum()
         max_facility_name = emission_by_facility.idxmax()
         max_facility_value = emission_by_facility.max()
         min_facility_name = emission_by_facility.idxmin()
@@ -679,8 +3272,8 @@ if emission_rate_col and emission_rate_col in df.columns and facility_col and fa
         num_facilities = len(emission_by_facility)
         
         # Limpiar nombres
-        max_facility_clean = str(max_facility_name).replace('_', ' ')
-        min_facility_clean = str(min_facility_name).replace('_', ' ')
+        max_facility_clean = str(max_facility_name)
+        min_facility_clean = str(min_facility_name)
         
         # Mostrar KPIs en tarjetas con tamaño uniforme
         kpi1, kpi2, kpi3, kpi4, kpi5 = st.columns(5)
@@ -690,11 +3283,11 @@ if emission_rate_col and emission_rate_col in df.columns and facility_col and fa
             <div style='background: linear-gradient(135deg, {ENERGY_COLORS['primary']} 0%, {ENERGY_COLORS['secondary']} 100%); 
                         padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.15); height: 200px;
                         display: flex; flex-direction: column; justify-content: space-between;'>
-                <div style='color: white; font-size: 0.9rem; font-weight: 700; opacity: 0.95; min-height: 36px; display: flex; align-items: center;'>📊 EMISIÓN TOTAL</div>
+                <div style='color: white; font-size: 0.9rem; font-weight: 700; opacity: 0.95; min-height: 36px; display: flex; align-items: center;'>📊 EMISIÓN TOTAL (FUENTES)</div>
                 <div style='color: white; font-size: 2.5rem; font-weight: 700; line-height: 1;'>{total_emission_rate:.2f}</div>
                 <div style='color: rgba(255,255,255,0.9); font-size: 0.95rem; font-weight: 500;'>
                     {emission_rate_units}<br>
-                    <span style='font-size: 0.8rem; opacity: 0.85;'>Dataset completo</span>
+                    <span style='font-size: 0.8rem; opacity: 0.85;'>Σ tasa media por fuente · detecciones: {total_detection_rate:.2f}</span>
                 </div>
             </div>
             """, unsafe_allow_html=True)
@@ -746,11 +3339,11 @@ if emission_rate_col and emission_rate_col in df.columns and facility_col and fa
             <div style='background: linear-gradient(135deg, #9B59B6 0%, #8E44AD 100%); 
                         padding: 1.5rem; border-radius: 12px; box-shadow: 0 4px 12px rgba(0,0,0,0.15); height: 200px;
                         display: flex; flex-direction: column; justify-content: space-between;'>
-                <div style='color: white; font-size: 0.9rem; font-weight: 700; opacity: 0.95; min-height: 36px; display: flex; align-items: center;'>✅ MEDICIONES VÁLIDAS</div>
+                <div style='color: white; font-size: 0.9rem; font-weight: 700; opacity: 0.95; min-height: 36px; display: flex; align-items: center;'>🎯 FUENTES MEDIDAS</div>
                 <div style='color: white; font-size: 2.5rem; font-weight: 700; line-height: 1;'>{num_measurements:,}</div>
                 <div style='color: rgba(255,255,255,0.9); font-size: 0.95rem; font-weight: 500;'>
-                    Puntos<br>
-                    <span style='font-size: 0.8rem; opacity: 0.85;'>Dataset activo</span>
+                    Fuentes persistentes<br>
+                    <span style='font-size: 0.8rem; opacity: 0.85;'>✅ {num_detections:,} mediciones válidas</span>
                 </div>
             </div>
             """, unsafe_allow_html=True)
@@ -763,6 +3356,8 @@ if emission_rate_col and emission_rate_col in df.columns and facility_col and fa
 
 st.markdown("### 🔬 Métricas de Concentración de Metano (CH₄)")
 
+ch4_p95 = sketch_quantiles(active_sketches[ch4_col], [0.95]).iat[0, 0]
+ch4_p95_label = f"{ch4_p95:.2f} {ch4_units}" if pd.notna(ch4_p95) else "N/D"
 col1, col2, col3, col4 = st.columns(4)
 with col1:
     st.markdown(f"""
@@ -773,14 +3368,14 @@ with col1:
         <div style='color: white; font-size: 2.8rem; font-weight: 700; line-height: 1;'>{len(df):,}</div>
         <div style='color: rgba(255,255,255,0.9); font-size: 0.95rem; font-weight: 500;'>
             Mediciones<br>
-            <span style='font-size: 0.8rem; opacity: 0.85;'>Dataset completo</span>
+            <span style='font-size: 0.8rem; opacity: 0.85;'>P95: {ch4_p95_label}</span>
         </div>
     </div>
     """, unsafe_allow_html=True)
     
 with col2:
     # Botón para pico máximo
-    max_facility = str(max_row[facility_col]).replace('_', ' ') if facility_col and facility_col in max_row.index and not pd.isna(max_row[facility_col]) else "N/A"
+    max_facility = str(max_row[facility_col]) if facility_col and facility_col in max_row.index and not pd.isna(max_row[facility_col]) else "N/A"
     max_lat_val = float(max_row[lat_col])
     max_lon_val = float(max_row[lon_col])
     
@@ -820,7 +3415,7 @@ with col3:
     
 with col4:
     # Botón para mínimo
-    min_facility = str(min_row[facility_col]).replace('_', ' ') if facility_col and facility_col in min_row.index and not pd.isna(min_row[facility_col]) else "N/A"
+    min_facility = str(min_row[facility_col]) if facility_col and facility_col in min_row.index and not pd.isna(min_row[facility_col]) else "N/A"
     min_lat_val = float(min_row[lat_col])
     min_lon_val = float(min_row[lon_col])
     
@@ -910,7 +3505,7 @@ with tab1:
     
     # Mostrar mensajes cuando se hace clic en los botones
     if 'goto_max' in st.session_state and st.session_state['goto_max']:
-        max_facility = str(max_row[facility_col]).replace('_', ' ') if facility_col and facility_col in max_row.index and not pd.isna(max_row[facility_col]) else "N/A"
+        max_facility = str(max_row[facility_col]) if facility_col and facility_col in max_row.index and not pd.isna(max_row[facility_col]) else "N/A"
         st.info(f"📍 Mostrando ubicación del **Pico Máximo**: {max_ch4:.2f} {ch4_units} en {max_facility}")
         center_lat = float(max_row[lat_col])
         center_lon = float(max_row[lon_col])
@@ -918,7 +3513,7 @@ with tab1:
         open_max_popup = True
         st.session_state['goto_max'] = False
     elif 'goto_min' in st.session_state and st.session_state['goto_min']:
-        min_facility = str(min_row[facility_col]).replace('_', ' ') if facility_col and facility_col in min_row.index and not pd.isna(min_row[facility_col]) else "N/A"
+        min_facility = str(min_row[facility_col]) if facility_col and facility_col in min_row.index and not pd.isna(min_row[facility_col]) else "N/A"
         st.success(f"📍 Mostrando ubicación del **Mínimo**: {min_ch4:.2f} {ch4_units} en {min_facility}")
         center_lat = float(min_row[lat_col])
         center_lon = float(min_row[lon_col])
@@ -935,6 +3530,14 @@ with tab1:
     
     m = folium.Map(location=center, zoom_start=zoom_level, tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', attr='Esri')
     
+    show_hotspots = False
+    if 'Gi* Nivel' in df.columns:
+        show_hotspots = st.checkbox(
+            "🔥 Superponer puntos calientes/fríos Gi* (Emission Rate)",
+            value=True,
+            help=f"Anillos rojos: agrupaciones significativas de tasas altas; azules: de tasas bajas (banda {hotspot_band_m} m)"
+        )
+    
     vmin = float(df[ch4_col].min())
     vmax = float(df[ch4_col].max())
     colormap = cm.LinearColormap([ENERGY_COLORS['success'], ENERGY_COLORS['warning'], ENERGY_COLORS['danger']], 
@@ -961,7 +3564,7 @@ with tab1:
             """
             
             if facility_col and facility_col in row.index and not pd.isna(row[facility_col]):
-                facility_name = str(row[facility_col]).replace('_', ' ')
+                facility_name = str(row[facility_col])
                 popup_html += f"<b>🏭 Instalación:</b> {facility_name}<br>"
             
             if presidencia_col and presidencia_col in row.index and not pd.isna(row[presidencia_col]):
@@ -998,6 +3601,25 @@ with tab1:
             # Silenciosamente saltar filas con errores
             continue
     
+    # Capa de puntos calientes/fríos: solo detecciones significativas (anillo por nivel de confianza)
+    if show_hotspots:
+        df_hot = df[df['Gi* Nivel'] != 0]
+        hotspot_layer = folium.FeatureGroup(name="🔥 Puntos calientes/fríos Gi*")
+        for lat, lon, z, level in zip(df_hot[lat_col], df_hot[lon_col], df_hot['Gi* z'], df_hot['Gi* Nivel']):
+            ring_color = ENERGY_COLORS['danger'] if level > 0 else '#3498DB'
+            folium.CircleMarker(
+                location=[float(lat), float(lon)],
+                radius=7 + 2 * abs(int(level)),
+                color=ring_color,
+                weight=3,
+                fill=False,
+                tooltip=f"{GI_BIN_LABELS[int(level)]} (z = {z:.2f})"
+            ).add_to(hotspot_layer)
+        hotspot_layer.add_to(m)
+        folium.LayerControl(collapsed=True).add_to(m)
+        st.caption(f"🔥 {int((df_hot['Gi* Nivel'] > 0).sum()):,} puntos calientes y "
+                   f"{int((df_hot['Gi* Nivel'] < 0).sum()):,} puntos fríos significativos (≥ 90% de confianza)")
+    
     # Highlight max point
     try:
         max_lat = float(max_row[lat_col])
@@ -1012,7 +3634,7 @@ with tab1:
         """
         
         if facility_col and facility_col in max_row.index and not pd.isna(max_row[facility_col]):
-            facility_name = str(max_row[facility_col]).replace('_', ' ')
+            facility_name = str(max_row[facility_col])
             max_popup_html += f"<b>🏭 Instalación:</b> {facility_name}<br>"
         
         if presidencia_col and presidencia_col in max_row.index and not pd.isna(max_row[presidencia_col]):
@@ -1072,7 +3694,7 @@ with tab1:
         """
         
         if facility_col and facility_col in min_row.index and not pd.isna(min_row[facility_col]):
-            facility_name = str(min_row[facility_col]).replace('_', ' ')
+            facility_name = str(min_row[facility_col])
             min_popup_html += f"<b>🏭 Instalación:</b> {facility_name}<br>"
         
         if presidencia_col and presidencia_col in min_row.index and not pd.isna(min_row[presidencia_col]):
@@ -1118,7 +3740,75 @@ with tab1:
     except Exception:
         pass
     
-    st_folium(m, width="100%", height=700)
+    map_state = st_folium(m, width="100%", height=700)
+    
+    # ═══════════════════════════════════════════════════════════════
+    # PUNTOS CERCANOS AL PUNTO SELECCIONADO (ÍNDICE ESPACIAL)
+    # ═══════════════════════════════════════════════════════════════
+    
+    st.markdown("### 📍 Puntos Cercanos al Punto Seleccionado")
+    spatial_index = build_spatial_index(df[lat_col].to_numpy(), df[lon_col].to_numpy())
+    map_state = map_state or {}
+    
+    reference_points = {}
+    clicked_point = map_state.get('last_object_clicked') or map_state.get('last_clicked')
+    if clicked_point:
+        reference_points['🖱️ Último clic en el mapa'] = (float(clicked_point['lat']), float(clicked_point['lng']))
+    reference_points['🔴 Pico máximo'] = (float(max_row[lat_col]), float(max_row[lon_col]))
+    reference_points['🟢 Mínimo'] = (float(min_row[lat_col]), float(min_row[lon_col]))
+    
+    col_near1, col_near2, col_near3 = st.columns(3)
+    
+    with col_near1:
+        reference_label = st.selectbox(
+            "Punto de referencia:",
+            options=list(reference_points.keys()),
+            index=0,
+            help="Haga clic en un marcador del mapa para usarlo como referencia"
+        )
+    
+    with col_near2:
+        near_mode = st.radio(
+            "Tipo de consulta:",
+            options=['Radio', 'K más cercanos'],
+            horizontal=True
+        )
+    
+    with col_near3:
+        if near_mode == 'Radio':
+            near_radius = st.slider("Radio de búsqueda (m):", min_value=50, max_value=5000, value=500, step=50)
+        else:
+            if len(df) > 1:
+                near_k = st.slider("Número de vecinos (k):", min_value=1, max_value=min(50, len(df)), value=min(10, len(df)))
+            else:
+                near_k = 1
+                st.caption("Número de vecinos (k): 1 (el filtro tiene una sola detección)")
+    
+    reference_lat, reference_lon = reference_points[reference_label]
+    if near_mode == 'Radio':
+        near_rows, near_distance = spatial_radius_query(spatial_index, reference_lat, reference_lon, near_radius)
+    else:
+        near_rows, near_distance = spatial_knn_query(spatial_index, reference_lat, reference_lon, near_k)
+    
+    near_cols = list(dict.fromkeys(
+        c for c in [facility_col, ch4_col, emission_rate_col, wspd_col, wdir_col, 'datetime', lat_col, lon_col]
+        if c and c in df.columns
+    ))
+    near_df = df.iloc[near_rows][near_cols].copy()
+    near_df.insert(0, 'Distancia (m)', near_distance.round(1))
+    
+    st.caption(f"🔎 {len(near_df):,} puntos encontrados alrededor de ({reference_lat:.6f}, {reference_lon:.6f})")
+    st.dataframe(near_df, use_container_width=True, hide_index=True)
+    
+    # Conteo de puntos en la vista actual del mapa (consulta por rectángulo)
+    map_bounds = map_state.get('bounds') or {}
+    if map_bounds.get('_southWest') and map_bounds.get('_northEast'):
+        south_west, north_east = map_bounds['_southWest'], map_bounds['_northEast']
+        if south_west.get('lat') is not None and north_east.get('lat') is not None:
+            in_view_rows = spatial_bbox_query(
+                spatial_index, south_west['lat'], north_east['lat'], south_west['lng'], north_east['lng']
+            )
+            st.caption(f"🗺️ {len(in_view_rows):,} de {len(df):,} puntos dentro de la vista actual del mapa")
 
 # ══════════════════════════════════════════════════════════════════════
 # 6.2 TAB 2: ANÁLISIS INTEGRAL DE EMISIONES
@@ -1139,16 +3829,16 @@ with tab2:
         **Indicador crítico para:** Inventario GEI | Reconciliación de datos | Comparación entre tecnologías | OGMP Nivel 5 | Priorización de mitigación
         """)
         
-        # Preparar datos de emission rate
-        df_emission = df[[facility_col, emission_rate_col]].copy()
-        df_emission = df_emission.dropna()
-        
-        # Reemplazar guiones bajos por espacios
-        df_emission[facility_col] = df_emission[facility_col].astype(str).str.replace('_', ' ')
+        # Preparar datos de emission rate: una fila por fuente persistente (tasa media de sus detecciones)
+        df_emission = deduplicate_by_source(df, source_cache_key, facility_col, emission_rate_col)
         
-        # Calcular estadísticas por instalación
-        emission_stats = df_emission.groupby(facility_col)[emission_rate_col].agg(['sum', 'mean', 'max', 'count']).round(2)
-        emission_stats.columns = ['Total', 'Promedio', 'Máximo', 'Nº Mediciones']
+        # Calcular estadísticas por instalación: por fuente ('Nº Fuentes') y detecciones originales ('Nº Mediciones')
+        emission_stats = df_emission.groupby(facility_col, observed=True).agg(
+            Total=(emission_rate_col, 'sum'), Promedio=(emission_rate_col, 'mean'), Máximo=(emission_rate_col, 'max'),
+            **{'Nº Fuentes': (emission_rate_col, 'size'), 'Nº Mediciones': ('Detecciones', 'sum')}
+        ).round(2)
+        st.caption("📐 Total, Promedio y Máximo se calculan por fuente persistente (tasa media de sus detecciones "
+                   "repetidas); 'Nº Mediciones' cuenta las detecciones originales. El IC bootstrap remuestrea fuentes.")
         
         # Ordenar por Total (suma acumulada) de mayor a menor
         emission_stats = emission_stats.sort_values('Total', ascending=True)  # True para que el mayor quede arriba en barras horizontales
@@ -1175,6 +3865,27 @@ with tab2:
         # Filtrar top N
         emission_stats_top = emission_stats.tail(top_n_emission)  # tail porque ascending=True
         
+        # Intervalos de confianza bootstrap (media y total), cacheados por filtro
+        emission_ci, emission_total_ci = bootstrap_facility_ci(df_emission, facility_col, emission_rate_col)
+        show_ci = False
+        if metric_emission in ('Total', 'Promedio'):
+            show_ci = st.checkbox(
+                f"📏 Mostrar IC {BOOTSTRAP_CONFIDENCE:.0%} bootstrap",
+                value=False,
+                help=f"Intervalo percentil con {BOOTSTRAP_RESAMPLES:,} remuestras de fuentes persistentes por instalación"
+            )
+        error_x = None
+        if show_ci:
+            ci_top = emission_ci.reindex(emission_stats_top.index)
+            ci_point = ci_top[metric_emission]
+            error_x = dict(
+                type='data',
+                array=(ci_top[f'IC Sup. {metric_emission}'] - ci_point).to_numpy(),
+                arrayminus=(ci_point - ci_top[f'IC Inf. {metric_emission}']).to_numpy(),
+                color=ENERGY_COLORS['dark'],
+                visible=True
+            )
+        
         # Crear gráfico de barras horizontales
         fig_emission = go.Figure()
         
@@ -1184,6 +3895,7 @@ with tab2:
         fig_emission.add_trace(go.Bar(
             y=emission_stats_top.index,
             x=emission_stats_top[metric_emission],
+            error_x=error_x,
             orientation='h',
             marker=dict(
                 color=colors_emission,
@@ -1223,9 +3935,32 @@ with tab2:
         # Tabla de estadísticas detalladas
         st.markdown("#### 📋 Estadísticas Detalladas por Instalación")
         emission_stats_display = emission_stats.sort_values('Total', ascending=False).copy()
-        emission_stats_display.columns = [f'{col} ({emission_rate_units})' if col != 'Nº Mediciones' else col for col in emission_stats_display.columns]
+        emission_stats_display.columns = [f'{col} ({emission_rate_units})' if not col.startswith('Nº') else col for col in emission_stats_display.columns]
         st.dataframe(emission_stats_display, use_container_width=True, height=400)
         
+        with st.expander(f"📏 Intervalos de Confianza Bootstrap {BOOTSTRAP_CONFIDENCE:.0%} (Reporte OGMP)", expanded=False):
+            st.caption(f"""
+            Bootstrap percentil con **{emission_total_ci['resamples']:,} remuestras** (semilla fija, reproducible).
+            El IC del total del dataset remuestrea cada instalación por separado (estratificado).
+            Instalaciones con una sola medición tienen intervalo degenerado.
+            """)
+            st.metric(
+                f"📊 Emisión Total (IC {BOOTSTRAP_CONFIDENCE:.0%})",
+                f"{emission_total_ci['total']:.2f} {emission_rate_units}",
+                help=f"[{emission_total_ci['lo']:.2f} – {emission_total_ci['hi']:.2f}] {emission_rate_units}",
+                delta=f"± {(emission_total_ci['hi'] - emission_total_ci['lo']) / 2:.2f} {emission_rate_units}",
+                delta_color="off"
+            )
+            ci_display = emission_ci.sort_values('Total', ascending=False).round(2)
+            ci_display.index.name = 'Instalación'
+            st.dataframe(ci_display, use_container_width=True, height=400)
+            st.download_button(
+                label="💾 Descargar IC bootstrap (CSV)",
+                data=ci_display.to_csv().encode('utf-8'),
+                file_name='ic_bootstrap_emission_rate.csv',
+                mime='text/csv',
+            )
+        
         # Métricas clave
         st.markdown("---")
         col_m1, col_m2, col_m3, col_m4 = st.columns(4)
@@ -1254,7 +3989,6 @@ with tab2:
         if ch4_col and ch4_col in df.columns:
             df_correlation = df[[facility_col, emission_rate_col, ch4_col]].copy()
             df_correlation = df_correlation.dropna()
-            df_correlation[facility_col] = df_correlation[facility_col].astype(str).str.replace('_', ' ')
             
             if len(df_correlation) > 0:
                 
@@ -1266,16 +4000,22 @@ with tab2:
                 
                 col_threshold1, col_threshold2, col_threshold3 = st.columns([2, 2, 1])
                 
+                # Valores sugeridos desde los sketches del filtro activo (tiempo constante, ±1%)
+                ch4_suggested = sketch_quantiles(active_sketches[ch4_col], [0.5, 0.75]).iloc[0]
+                emission_suggested = sketch_quantiles(active_sketches[emission_rate_col], [0.5, 0.75]).iloc[0]
+                ch4_summary = active_sketches[ch4_col]['summary'].iloc[0]
+                emission_summary = active_sketches[emission_rate_col]['summary'].iloc[0]
+                
                 with col_threshold1:
                     # Calcular valores sugeridos
-                    median_ch4 = df_correlation[ch4_col].median()
-                    mean_ch4 = df_correlation[ch4_col].mean()
-                    percentile_75_ch4 = df_correlation[ch4_col].quantile(0.75)
+                    median_ch4 = ch4_suggested[0.5]
+                    mean_ch4 = ch4_summary['suma'] / ch4_summary['n']
+                    percentile_75_ch4 = ch4_suggested[0.75]
                     
                     threshold_ch4 = st.number_input(
                         f"Umbral CH₄ ({ch4_units})",
-                        min_value=float(df_correlation[ch4_col].min()),
-                        max_value=float(df_correlation[ch4_col].max()),
+                        min_value=float(ch4_summary['min']),
+                        max_value=float(ch4_summary['max']),
                         value=float(median_ch4),
                         step=0.01,
                         help=f"Valores por encima se consideran 'Alto CH₄'. Sugeridos: Mediana={median_ch4:.2f}, Media={mean_ch4:.2f}, P75={percentile_75_ch4:.2f}"
@@ -1283,14 +4023,14 @@ with tab2:
                 
                 with col_threshold2:
                     # Calcular valores sugeridos
-                    median_emission = df_correlation[emission_rate_col].median()
-                    mean_emission = df_correlation[emission_rate_col].mean()
-                    percentile_75_emission = df_correlation[emission_rate_col].quantile(0.75)
+                    median_emission = emission_suggested[0.5]
+                    mean_emission = emission_summary['suma'] / emission_summary['n']
+                    percentile_75_emission = emission_suggested[0.75]
                     
                     threshold_emission = st.number_input(
                         f"Umbral Emission Rate ({emission_rate_units})",
-                        min_value=float(df_correlation[emission_rate_col].min()),
-                        max_value=float(df_correlation[emission_rate_col].max()),
+                        min_value=float(emission_summary['min']),
+                        max_value=float(emission_summary['max']),
                         value=float(median_emission),
                         step=0.01,
                         help=f"Valores por encima se consideran 'Alto Rate'. Sugeridos: Mediana={median_emission:.2f}, Media={mean_emission:.2f}, P75={percentile_75_emission:.2f}"
@@ -1309,8 +4049,29 @@ with tab2:
                 
                 st.markdown("#### 📈 Scatter Plot: Concentración CH₄ vs Emission Rate")
                 
+                # Clasificar por cuadrantes usando umbrales configurables (un solo np.select)
+                corr_ch4_values = df_correlation[ch4_col].to_numpy(dtype=float)
+                corr_rate_values = df_correlation[emission_rate_col].to_numpy(dtype=float)
+                quadrant_codes = classify_quadrants(corr_ch4_values, corr_rate_values, threshold_ch4, threshold_emission)
+                df_correlation['Cuadrante'] = np.asarray(QUADRANT_LABELS)[quadrant_codes]
+                
+                # Modo de datos masivos: WebGL + decimación que conserva el cuadrante crítico
+                large_scatter = len(df_correlation) > LARGE_SCATTER_THRESHOLD
+                df_scatter = df_correlation
+                
+                if large_scatter:
+                    decimate_scatter = st.checkbox(
+                        f"⚡ Reducir puntos graficados (máx. {SCATTER_POINT_BUDGET:,}, prioriza el cuadrante crítico)",
+                        value=True,
+                        help="Adelgaza solo las zonas densas del gráfico; los conteos y tablas usan siempre todos los datos"
+                    )
+                    if decimate_scatter:
+                        scatter_idx = decimate_scatter_indices(corr_ch4_values, corr_rate_values, quadrant_codes == 0)
+                        df_scatter = df_correlation.iloc[scatter_idx]
+                    st.caption(f"⚡ Modo datos masivos (WebGL): graficando {len(df_scatter):,} de {len(df_correlation):,} puntos")
+                
                 fig_correlation = px.scatter(
-                    df_correlation,
+                    df_scatter,
                     x=ch4_col,
                     y=emission_rate_col,
                     color=facility_col,
@@ -1324,7 +4085,8 @@ with tab2:
                         emission_rate_col: f'Emission Rate ({emission_rate_units})',
                         facility_col: 'Instalación'
                     },
-                    title='Relación entre Concentración CH₄ y Tasa de Emisión por Instalación'
+                    title='Relación entre Concentración CH₄ y Tasa de Emisión por Instalación',
+                    render_mode='webgl' if large_scatter else 'auto'
                 )
                 
                 fig_correlation.update_traces(
@@ -1401,34 +4163,14 @@ with tab2:
                 
                 st.markdown("#### 📊 Análisis por Cuadrantes")
                 
-                # Clasificar por cuadrantes usando umbrales configurables
-                df_correlation['Cuadrante'] = 'N/A'
-                
-                df_correlation.loc[
-                    (df_correlation[ch4_col] >= threshold_ch4) & (df_correlation[emission_rate_col] >= threshold_emission),
-                    'Cuadrante'
-                ] = '🔴 Alto-Alto (Crítico)'
-                
-                df_correlation.loc[
-                    (df_correlation[ch4_col] < threshold_ch4) & (df_correlation[emission_rate_col] >= threshold_emission),
-                    'Cuadrante'
-                ] = '🟠 Bajo CH₄ - Alto Rate (Anomalía)'
-                
-                df_correlation.loc[
-                    (df_correlation[ch4_col] >= threshold_ch4) & (df_correlation[emission_rate_col] < threshold_emission),
-                    'Cuadrante'
-                ] = '🟡 Alto CH₄ - Bajo Rate (Revisar)'
-                
-                df_correlation.loc[
-                    (df_correlation[ch4_col] < threshold_ch4) & (df_correlation[emission_rate_col] < threshold_emission),
-                    'Cuadrante'
-                ] = '🟢 Bajo-Bajo (Óptimo)'
+                # Índice acumulado 2D (cacheado) para conteos y barrido de umbrales
+                quadrant_index = build_quadrant_index(corr_ch4_values, corr_rate_values)
                 
                 # ═══════════════════════════════════════════════════════════════
                 # TARJETAS DE CUADRANTES CON CONTEO DE PUNTOS
                 # ═══════════════════════════════════════════════════════════════
                 
-                cuadrante_counts = df_correlation['Cuadrante'].value_counts()
+                cuadrante_counts = dict(zip(QUADRANT_LABELS, query_quadrant_counts(quadrant_index, threshold_ch4, threshold_emission)))
                 total_points = len(df_correlation)
                 
                 col_q1, col_q2, col_q3, col_q4 = st.columns(4)
@@ -1508,16 +4250,19 @@ with tab2:
                 st.markdown("---")
                 st.markdown("#### 🎯 Instalaciones que Requieren Atención")
                 
+                # Agrupación por instalación sobre códigos enteros (sin groupby de strings)
+                corr_facility_codes, corr_facility_names = pd.factorize(df_correlation[facility_col])
+                
                 col_alert1, col_alert2 = st.columns(2)
                 
                 with col_alert1:
                     st.markdown("**🔴 Instalaciones Críticas (Alto CH₄ - Alto Rate)**")
-                    criticas = df_correlation[df_correlation['Cuadrante'] == '🔴 Alto-Alto (Crítico)']
-                    if len(criticas) > 0:
-                        criticas_grouped = criticas.groupby(facility_col).agg({
-                            emission_rate_col: 'mean',
-                            ch4_col: 'mean'
-                        }).round(2).reset_index()
+                    criticas_grouped = quadrant_facility_summary(
+                        quadrant_codes, corr_facility_codes, corr_facility_names,
+                        corr_ch4_values, corr_rate_values, QUADRANT_LABELS.index('🔴 Alto-Alto (Crítico)')
+                    )
+                    if len(criticas_grouped) > 0:
+                        criticas_grouped = criticas_grouped[['facility', 'mean_y', 'mean_x']].round(2)
                         criticas_grouped.columns = ['Facility Name', f'Rate Promedio ({emission_rate_units})', f'CH₄ Promedio ({ch4_units})']
                         criticas_grouped = criticas_grouped.sort_values(f'Rate Promedio ({emission_rate_units})', ascending=False)
                         st.dataframe(criticas_grouped, use_container_width=True, hide_index=True)
@@ -1526,17 +4271,169 @@ with tab2:
                 
                 with col_alert2:
                     st.markdown("**🟠 Anomalías (Bajo CH₄ - Alto Rate)**")
-                    anomalias = df_correlation[df_correlation['Cuadrante'] == '🟠 Bajo CH₄ - Alto Rate (Anomalía)']
-                    if len(anomalias) > 0:
-                        anomalias_grouped = anomalias.groupby(facility_col).agg({
-                            emission_rate_col: 'mean',
-                            ch4_col: 'mean'
-                        }).round(2).reset_index()
+                    anomalias_grouped = quadrant_facility_summary(
+                        quadrant_codes, corr_facility_codes, corr_facility_names,
+                        corr_ch4_values, corr_rate_values, QUADRANT_LABELS.index('🟠 Bajo CH₄ - Alto Rate (Anomalía)')
+                    )
+                    if len(anomalias_grouped) > 0:
+                        anomalias_grouped = anomalias_grouped[['facility', 'mean_y', 'mean_x']].round(2)
                         anomalias_grouped.columns = ['Facility Name', f'Rate Promedio ({emission_rate_units})', f'CH₄ Promedio ({ch4_units})']
                         anomalias_grouped = anomalias_grouped.sort_values(f'Rate Promedio ({emission_rate_units})', ascending=False)
                         st.dataframe(anomalias_grouped, use_container_width=True, hide_index=True)
                     else:
                         st.info("✅ No hay instalaciones en esta categoría")
+                
+                # ═══════════════════════════════════════════════════════════════
+                # BARRIDO DE UMBRALES (SENSIBILIDAD DE CUADRANTES)
+                # ═══════════════════════════════════════════════════════════════
+                
+                with st.expander("🧭 Barrido de Umbrales - Sensibilidad de Cuadrantes", expanded=False):
+                    st.caption("Porcentaje de puntos en cada cuadrante para una grilla de umbrales (cuantiles de CH₄ y Emission Rate). Se calcula desde la matriz acumulada, sin re-escanear los datos.")
+                    
+                    sweep_quadrant = st.selectbox(
+                        "Cuadrante a visualizar:",
+                        options=QUADRANT_LABELS,
+                        index=0,
+                        key="sweep_quadrant"
+                    )
+                    
+                    sweep_x, sweep_y, sweep_counts = quadrant_sweep(quadrant_index)
+                    sweep_pct = sweep_counts[QUADRANT_LABELS.index(sweep_quadrant)] / max(total_points, 1) * 100
+                    
+                    fig_sweep = go.Figure()
+                    fig_sweep.add_trace(go.Heatmap(
+                        x=sweep_x,
+                        y=sweep_y,
+                        z=sweep_pct.T,
+                        colorscale=[[0, ENERGY_COLORS['success']], [0.5, ENERGY_COLORS['warning']], [1, ENERGY_COLORS['danger']]],
+                        colorbar=dict(title="% puntos"),
+                        hovertemplate=f'Umbral CH₄: %{{x:.2f}} {ch4_units}<br>Umbral Rate: %{{y:.2f}} {emission_rate_units}<br>%{{z:.1f}}% de puntos<extra></extra>'
+                    ))
+                    
+                    # Marcar umbrales actuales
+                    fig_sweep.add_trace(go.Scatter(
+                        x=[threshold_ch4],
+                        y=[threshold_emission],
+                        mode='markers',
+                        marker=dict(size=14, symbol='x', color=ENERGY_COLORS['dark']),
+                        name='Umbrales actuales',
+                        hovertemplate='Umbrales actuales<extra></extra>'
+                    ))
+                    
+                    fig_sweep.update_layout(
+                        title=f"Sensibilidad: {sweep_quadrant}",
+                        xaxis_title=f"Umbral CH₄ ({ch4_units})",
+                        yaxis_title=f"Umbral Emission Rate ({emission_rate_units})",
+                        height=550,
+                        template='plotly_white',
+                        showlegend=False
+                    )
+                    
+                    st.plotly_chart(fig_sweep, use_container_width=True)
+                
+                # ═══════════════════════════════════════════════════════════════
+                # RECONCILIACIÓN FÍSICA: INVERSIÓN DE PLUMA GAUSSIANA
+                # ═══════════════════════════════════════════════════════════════
+                
+                with st.expander("🌬️ Inversión de Pluma Gaussiana - Tasa Corregida por Viento", expanded=False):
+                    plume_ready = (
+                        wspd_col in df.columns and wdir_col in df.columns and ch4_point_ppm
+                        and df[[wspd_col, wdir_col]].notna().all(axis=1).any()
+                    )
+                    if plume_ready:
+                        col_plume1, col_plume2, col_plume3 = st.columns(3)
+                        
+                        with col_plume1:
+                            plume_stability = st.selectbox(
+                                "Clase de estabilidad (Pasquill):",
+                                options=['auto'] + STABILITY_CLASSES,
+                                format_func=lambda c: 'Automática (por velocidad)' if c == 'auto' else c,
+                                index=0,
+                                help="A = muy inestable ... F = estable. Automática: día con insolación moderada según la velocidad del viento"
+                            )
+                        
+                        with col_plume2:
+                            plume_background = st.number_input(
+                                "Fondo de CH₄ (ppm):",
+                                min_value=0.0,
+                                value=PLUME_BACKGROUND_PPM,
+                                step=0.1,
+                                help="Concentración de fondo que se resta antes de invertir la pluma"
+                            )
+                        
+                        with col_plume3:
+                            plume_factor = st.slider(
+                                "Factor de discrepancia:",
+                                min_value=1.5,
+                                max_value=10.0,
+                                value=PLUME_DISAGREEMENT_FACTOR,
+                                step=0.5,
+                                help="Se marca la detección si la tasa reportada es mayor o menor que la estimada por más de este factor"
+                            )
+                        
+                        df_plume = df[[facility_col, lat_col, lon_col, ch4_col, emission_rate_col, wspd_col, wdir_col]].copy()
+                        plume_results = estimate_plume_rates(
+                            df_plume, facility_col, lat_col, lon_col, ch4_col, emission_rate_col, wspd_col, wdir_col,
+                            emission_rate_units, plume_stability, plume_background, PLUME_SOURCE_HEIGHT_M, plume_factor
+                        )
+                        plume_results.insert(0, 'Instalación', df_plume[facility_col])
+                        plume_valid = plume_results[plume_results['Receptor Válido'] & plume_results['Tasa Estimada (kg/h)'].notna()]
+                        plume_too_close = int((~plume_results['Receptor Válido']).sum())
+                        
+                        st.info(
+                            f"📐 Supuesto geométrico: la fuente es el centroide de las detecciones de cada instalación y "
+                            f"las propias detecciones son los receptores. En detecciones aéreas puntuales la mayoría queda "
+                            f"sobre la fuente o viento arriba: {plume_too_close:,} de {len(plume_results):,} están a menos de "
+                            f"{PLUME_MIN_DISTANCE_M:.0f} m viento abajo y se excluyen (no cuentan como discrepancia). "
+                            f"La comparación refleja la geometría del muestreo tanto como la física de la pluma."
+                        )
+                        
+                        col_plume_kpi1, col_plume_kpi2, col_plume_kpi3 = st.columns(3)
+                        with col_plume_kpi1:
+                            st.metric("🎯 Detecciones Invertibles", f"{len(plume_valid):,} de {len(plume_results):,}")
+                        with col_plume_kpi2:
+                            st.metric("⚠️ Discrepancias", f"{int(plume_valid['Discrepancia'].sum()):,}")
+                        with col_plume_kpi3:
+                            median_ratio = plume_valid['Razón Reportada/Estimada'].median() if len(plume_valid) > 0 else np.nan
+                            st.metric("⚖️ Mediana Reportada/Estimada", f"{median_ratio:.2f}" if pd.notna(median_ratio) else "N/A")
+                        
+                        if len(plume_valid) > 0:
+                            fig_plume = px.scatter(
+                                plume_valid,
+                                x='Tasa Estimada (kg/h)',
+                                y='Tasa Reportada (kg/h)',
+                                color='Discrepancia',
+                                color_discrete_map={True: ENERGY_COLORS['danger'], False: ENERGY_COLORS['success']},
+                                hover_data=['Instalación', 'Clase Estabilidad', 'Distancia Viento Abajo (m)'],
+                                log_x=True,
+                                log_y=True,
+                                title="Tasa Reportada vs Estimada por Pluma Gaussiana"
+                            )
+                            
+                            # Línea 1:1 y banda de tolerancia
+                            line_range = np.array([
+                                plume_valid[['Tasa Estimada (kg/h)', 'Tasa Reportada (kg/h)']].min().min(),
+                                plume_valid[['Tasa Estimada (kg/h)', 'Tasa Reportada (kg/h)']].max().max()
+                            ])
+                            for scale, dash in [(1, 'solid'), (plume_factor, 'dash'), (1 / plume_factor, 'dash')]:
+                                fig_plume.add_trace(go.Scatter(
+                                    x=line_range, y=line_range * scale, mode='lines',
+                                    line=dict(color=ENERGY_COLORS['dark'], width=1, dash=dash),
+                                    showlegend=False, hoverinfo='skip'
+                                ))
+                            
+                            fig_plume.update_layout(height=550, template='plotly_white', legend=dict(title=dict(text='Discrepancia')))
+                            st.plotly_chart(fig_plume, use_container_width=True)
+                            
+                            plume_flagged = plume_valid[plume_valid['Discrepancia']].sort_values('Razón Reportada/Estimada', ascending=False)
+                            if len(plume_flagged) > 0:
+                                st.markdown("#### ⚠️ Detecciones con Discrepancia Reportada vs Estimada")
+                                st.dataframe(plume_flagged.drop(columns=['Discrepancia', 'Receptor Válido']).round(2), use_container_width=True, hide_index=True)
+                        
+                        st.caption(f"🌬️ Fuente = centroide de cada instalación; receptores viento abajo (≥ {PLUME_MIN_DISTANCE_M:.0f} m) dentro de ±{PLUME_MAX_CROSSWIND_SIGMA:.0f}σy del eje; altura de fuente {PLUME_SOURCE_HEIGHT_M:.0f} m; σ de Briggs (rural).")
+                    else:
+                        st.info("ℹ️ La inversión requiere velocidad y dirección de viento por detección y una columna de CH₄ "
+                                "cuyo nombre indique concentración puntual en ppm (no ppm·m integrada en trayecto)")
             else:
                 st.warning("⚠️ No hay suficientes datos para el análisis de correlación")
         else:
@@ -1555,6 +4452,7 @@ with tab2:
         
         # Verificar si hay datos temporales
         time_col_available = None
+        temporal_cube = None
         if 'scan_datetime_parsed' in df.columns and df['scan_datetime_parsed'].notna().any():
             time_col_available = 'scan_datetime_parsed'
             time_label = "Scan Date Time (UTC)"
@@ -1565,15 +4463,17 @@ with tab2:
         if time_col_available:
             df_timeseries = df[[facility_col, emission_rate_col, time_col_available]].copy()
             df_timeseries = df_timeseries.dropna()
-            df_timeseries[facility_col] = df_timeseries[facility_col].astype(str).str.replace('_', ' ')
             
             if len(df_timeseries) > 0:
+                # Cubo temporal (hora/día/semana/mes) compartido por la serie temporal y el inventario mensual
+                temporal_cube = build_temporal_cube(df_timeseries, facility_col, time_col_available, emission_rate_col)
+                
                 st.markdown("#### ⚙️ Configuración de Visualización")
                 col_ts1, col_ts2 = st.columns(2)
                 
                 with col_ts1:
                     # Obtener lista de instalaciones ordenadas por emisión total
-                    facilities_emission = df_timeseries.groupby(facility_col)[emission_rate_col].sum().sort_values(ascending=False)
+                    facilities_emission = df_timeseries.groupby(facility_col, observed=True)[emission_rate_col].sum().sort_values(ascending=False)
                     all_facilities = facilities_emission.index.tolist()
                     
                     selected_facilities = st.multiselect(
@@ -1587,7 +4487,7 @@ with tab2:
                     # Opción de agregación temporal
                     time_aggregation = st.selectbox(
                         "Agregación temporal:",
-                        options=['Sin agregación', 'Por día', 'Por mes'],
+                        options=['Sin agregación'] + list(CUBE_AGGREGATION_MAP.keys()),
                         index=0,
                         help="Agrupar datos por período para reducir ruido y ver tendencias"
                     )
@@ -1596,20 +4496,34 @@ with tab2:
                     # Filtrar por instalaciones seleccionadas
                     df_ts_filtered = df_timeseries[df_timeseries[facility_col].isin(selected_facilities)].copy()
                     
-                    # Aplicar agregación si se selecciona
+                    # Aplicar agregación si se selecciona (lectura directa del cubo, sin reagrupar)
                     if time_aggregation != 'Sin agregación':
-                        freq_map = {
-                            'Por día': 'D',
-                            'Por mes': 'M'
-                        }
-                        freq = freq_map[time_aggregation]
-                        
-                        df_ts_filtered = df_ts_filtered.set_index(time_col_available)
-                        df_ts_filtered = df_ts_filtered.groupby([facility_col, pd.Grouper(freq=freq)])[emission_rate_col].mean().reset_index()
+                        df_ts_filtered = slice_temporal_cube(
+                            temporal_cube, CUBE_AGGREGATION_MAP[time_aggregation], selected_facilities
+                        )[['facility', 'period_start', 'value']]
+                        df_ts_filtered.columns = [facility_col, time_col_available, emission_rate_col]
+                    
+                    # Reducción de puntos por instalación (solo para el gráfico; los patrones usan todos los datos)
+                    df_ts_plot = df_ts_filtered
+                    max_points_facility = df_ts_filtered[facility_col].value_counts().max()
+                    
+                    if max_points_facility > TIMESERIES_POINTS_PER_FACILITY:
+                        downsample_method = st.selectbox(
+                            "Reducción de puntos por instalación:",
+                            options=['LTTB', 'Envolvente mín/máx', 'Sin reducción'],
+                            index=0,
+                            help=f"Limita cada instalación a ~{TIMESERIES_POINTS_PER_FACILITY:,} puntos conservando la forma de la serie y los picos máximos"
+                        )
+                        if downsample_method != 'Sin reducción':
+                            df_ts_plot = downsample_timeseries(
+                                df_ts_filtered, facility_col, time_col_available, emission_rate_col,
+                                time_aggregation, TIMESERIES_POINTS_PER_FACILITY, downsample_method
+                            )
+                            st.caption(f"⚡ Graficando {len(df_ts_plot):,} de {len(df_ts_filtered):,} puntos ({downsample_method})")
                     
                     # Crear gráfico de serie temporal
                     fig_timeseries = px.line(
-                        df_ts_filtered,
+                        df_ts_plot,
                         x=time_col_available,
                         y=emission_rate_col,
                         color=facility_col,
@@ -1656,11 +4570,60 @@ with tab2:
                         hovermode='x unified'
                     )
                     
+                    # Detección de anomalías (EWMA + z robusto) con estado incremental por agregación
+                    df_anomalies = detect_anomalies_incremental(
+                        df_ts_filtered, facility_col, time_col_available, emission_rate_col,
+                        session_key=f"ewma_state_{time_aggregation}"
+                    )
+                    anomaly_events = df_anomalies[df_anomalies['anomalia']]
+                    
+                    if len(anomaly_events) > 0:
+                        fig_timeseries.add_trace(go.Scatter(
+                            x=anomaly_events[time_col_available],
+                            y=anomaly_events[emission_rate_col],
+                            mode='markers',
+                            name='⚠️ Anomalía',
+                            marker=dict(size=14, symbol='x-thin', color=ENERGY_COLORS['danger'], line=dict(width=3, color=ENERGY_COLORS['danger'])),
+                            text=anomaly_events[facility_col],
+                            hovertemplate='<b>⚠️ Anomalía</b><br>%{text}<br>%{y:.2f} ' + emission_rate_units + '<extra></extra>'
+                        ))
+                    
+                    # Cambios de régimen (PELT) sombreados sobre la serie
+                    changepoint_segments = detect_changepoints(df_ts_filtered, facility_col, time_col_available, emission_rate_col)
+                    changed_facilities = changepoint_segments.loc[changepoint_segments['Cambio'].notna(), 'Instalación'].unique().tolist()
+                    
+                    if changed_facilities:
+                        changepoint_facility = st.selectbox(
+                            "Sombrear cambios de régimen de:",
+                            options=['Ninguna'] + changed_facilities,
+                            index=1,
+                            help="Segmentos detectados con PELT: rojo = nivel mayor que el segmento previo, verde = menor"
+                        )
+                        if changepoint_facility != 'Ninguna':
+                            facility_segments = changepoint_segments[changepoint_segments['Instalación'] == changepoint_facility]
+                            # Cada régimen se sombrea hasta el inicio del siguiente (el último, hasta su fin)
+                            segment_ends = facility_segments['Inicio'].shift(-1).fillna(facility_segments['Fin'])
+                            for (_, segment), segment_end in zip(facility_segments.iterrows(), segment_ends):
+                                if pd.isna(segment['Cambio']):
+                                    continue
+                                fig_timeseries.add_vrect(
+                                    x0=segment['Inicio'],
+                                    x1=segment_end,
+                                    fillcolor=ENERGY_COLORS['danger'] if segment['Cambio'] > 0 else ENERGY_COLORS['success'],
+                                    opacity=0.12,
+                                    line_width=0,
+                                    annotation_text=f"{segment['Cambio']:+.1f}",
+                                    annotation_position='top left'
+                                )
+                    
                     st.plotly_chart(fig_timeseries, use_container_width=True)
                     
                     # Análisis de patrones
                     st.markdown("#### 🔍 Análisis de Patrones Detectados")
                     
+                    # Motor de tendencias (cacheado) compartido por el panel de patrones y la exportación
+                    facility_trends = compute_facility_trends(df_ts_filtered, facility_col, time_col_available, emission_rate_col)
+                    
                     col_pattern1, col_pattern2, col_pattern3 = st.columns(3)
                     
                     with col_pattern1:
@@ -1668,7 +4631,7 @@ with tab2:
                         st.caption("Instalaciones con alta variabilidad")
                         
                         # Calcular coeficiente de variación por instalación
-                        cv_by_facility = df_ts_filtered.groupby(facility_col)[emission_rate_col].agg(['std', 'mean'])
+                        cv_by_facility = df_ts_filtered.groupby(facility_col, observed=True)[emission_rate_col].agg(['std', 'mean'])
                         cv_by_facility['CV'] = (cv_by_facility['std'] / cv_by_facility['mean'] * 100).round(1)
                         cv_by_facility = cv_by_facility.sort_values('CV', ascending=False).head(5)
                         
@@ -1682,24 +4645,14 @@ with tab2:
                         st.markdown("**📈 Tendencias Crecientes**")
                         st.caption("Instalaciones con incremento sostenido")
                         
-                        # Detectar tendencias (comparar primera mitad vs segunda mitad)
-                        trends = []
-                        for facility in selected_facilities:
-                            fac_data = df_ts_filtered[df_ts_filtered[facility_col] == facility][emission_rate_col]
-                            if len(fac_data) >= 4:
-                                mid = len(fac_data) // 2
-                                first_half = fac_data.iloc[:mid].mean()
-                                second_half = fac_data.iloc[mid:].mean()
-                                if first_half > 0:
-                                    change_pct = ((second_half - first_half) / first_half * 100)
-                                    trends.append((facility, change_pct))
+                        # Tendencias significativas (Mann-Kendall) con magnitud de Theil-Sen
+                        trends = facility_trends[
+                            (facility_trends['Tendencia'] == 'Creciente') & (facility_trends['Cambio %'] > 0)
+                        ].sort_values('Cambio %', ascending=False).head(5)
                         
-                        trends = sorted(trends, key=lambda x: x[1], reverse=True)[:5]
-                        
-                        if trends:
-                            for facility, change in trends:
-                                if change > 0:
-                                    st.caption(f"• {facility[:25]}: +{change:.1f}%")
+                        if len(trends) > 0:
+                            for facility, row in trends.iterrows():
+                                st.caption(f"• {facility[:25]}: +{row['Cambio %']:.1f}% (p={row['MK p-valor']:.3f})")
                         else:
                             st.info("No se detectaron tendencias")
                     
@@ -1716,6 +4669,88 @@ with tab2:
                                 st.caption(f"• {row[facility_col][:20]}: {row[emission_rate_col]:.2f} ({date_str})")
                         else:
                             st.info("No hay datos suficientes")
+                    
+                    # Tabla de eventos anómalos
+                    st.markdown("#### 🚨 Anomalías Temporales Detectadas")
+                    st.caption(f"Evento anómalo si z EWMA ≥ {EWMA_Z_THRESHOLD} (α={EWMA_ALPHA}, tras {EWMA_MIN_PERIODS} mediciones) o z robusto (mediana/MAD) ≥ {ROBUST_Z_THRESHOLD}")
+                    
+                    if len(anomaly_events) > 0:
+                        anomaly_table = anomaly_events[[facility_col, time_col_available, emission_rate_col, 'ewma_mean', 'z_ewma', 'z_robust']].copy()
+                        anomaly_table.columns = ['Instalación', time_label, f'Emission Rate ({emission_rate_units})', f'Media EWMA ({emission_rate_units})', 'z EWMA', 'z Robusto']
+                        anomaly_table = anomaly_table.sort_values(time_label, ascending=False).round(2)
+                        st.dataframe(anomaly_table, use_container_width=True, hide_index=True, height=300)
+                    else:
+                        st.success("✅ No se detectaron anomalías en las instalaciones seleccionadas")
+                    
+                    # Tabla completa de tendencias y exportación
+                    with st.expander("📐 Estadísticas de Tendencia por Instalación (OLS, Theil-Sen, Mann-Kendall)", expanded=False):
+                        st.caption(f"Pendientes en {emission_rate_units}/día. Tendencia significativa si p < {TREND_ALPHA}. 'Cambio %' = pendiente Theil-Sen × duración / promedio.")
+                        if len(facility_trends) > 0:
+                            st.dataframe(facility_trends.round(4), use_container_width=True)
+                            st.download_button(
+                                label="💾 Descargar tendencias (CSV)",
+                                data=facility_trends.to_csv().encode('utf-8'),
+                                file_name='tendencias_emission_rate.csv',
+                                mime='text/csv',
+                            )
+                        else:
+                            st.info(f"Se requieren al menos {TREND_MIN_POINTS} mediciones por instalación")
+                    
+                    # Perfil diurno/semanal en hora local (ciclos operativos, p. ej. cargue de tanques)
+                    with st.expander("🕐 Perfil Diurno y Semanal (hora local)", expanded=False):
+                        profile_cols = [emission_rate_col] + ([ch4_col] if ch4_col != emission_rate_col else [])
+                        df_profile = df[[facility_col, time_col_available] + profile_cols].copy()
+                        df_profile = df_profile[df_profile[facility_col].isin(selected_facilities)]
+                        diurnal_profile = build_diurnal_profile(df_profile, facility_col, time_col_available, profile_cols)
+                        
+                        profile_variable = st.radio(
+                            "Variable del perfil:",
+                            options=profile_cols,
+                            format_func=lambda c: f"Emission Rate ({emission_rate_units})" if c == emission_rate_col else f"CH₄ ({ch4_units})",
+                            horizontal=True
+                        )
+                        
+                        col_profile1, col_profile2 = st.columns(2)
+                        
+                        with col_profile1:
+                            facility_hour = diurnal_profile_means(diurnal_profile, profile_variable, ['facility', 'Hora']).unstack('Hora')
+                            fig_facility_hour = go.Figure(go.Heatmap(
+                                x=facility_hour.columns,
+                                y=facility_hour.index,
+                                z=facility_hour.values,
+                                colorscale=[[0, ENERGY_COLORS['success']], [0.5, ENERGY_COLORS['warning']], [1, ENERGY_COLORS['danger']]],
+                                hovertemplate='%{y}<br>Hora %{x}:00<br>Media: %{z:.2f}<extra></extra>'
+                            ))
+                            fig_facility_hour.update_layout(
+                                title="Media por Instalación y Hora del Día",
+                                xaxis_title="Hora local",
+                                height=max(400, len(facility_hour) * 30),
+                                template='plotly_white',
+                                xaxis=dict(dtick=2)
+                            )
+                            st.plotly_chart(fig_facility_hour, use_container_width=True)
+                        
+                        with col_profile2:
+                            day_hour = diurnal_profile_means(diurnal_profile, profile_variable, ['Día', 'Hora']).unstack('Hora')
+                            fig_day_hour = go.Figure(go.Heatmap(
+                                x=day_hour.columns,
+                                y=[DAY_NAMES[d] for d in day_hour.index],
+                                z=day_hour.values,
+                                colorscale=[[0, ENERGY_COLORS['success']], [0.5, ENERGY_COLORS['warning']], [1, ENERGY_COLORS['danger']]],
+                                hovertemplate='%{y} %{x}:00<br>Media: %{z:.2f}<extra></extra>'
+                            ))
+                            fig_day_hour.update_layout(
+                                title="Media por Día de Semana y Hora (instalaciones seleccionadas)",
+                                xaxis_title="Hora local",
+                                height=400,
+                                template='plotly_white',
+                                xaxis=dict(dtick=2),
+                                yaxis=dict(autorange='reversed')
+                            )
+                            st.plotly_chart(fig_day_hour, use_container_width=True)
+                        
+                        time_note = f"convertidas de UTC a {LOCAL_TIMEZONE}" if df_profile[time_col_available].dt.tz is not None else "tomadas como hora local"
+                        st.caption(f"🕐 Horas {time_note}. Celdas vacías: sin mediciones en esa franja.")
                 else:
                     st.warning("⚠️ Por favor seleccione al menos una instalación")
             else:
@@ -1737,7 +4772,6 @@ with tab2:
         # Preparar datos de emisiones acumuladas
         df_accumulated = df[[facility_col, emission_rate_col]].copy()
         df_accumulated = df_accumulated.dropna()
-        df_accumulated[facility_col] = df_accumulated[facility_col].astype(str).str.replace('_', ' ')
         
         if len(df_accumulated) > 0:
             # Configuración de visualización
@@ -1747,7 +4781,7 @@ with tab2:
             with col_view1:
                 view_mode = st.radio(
                     "Tipo de acumulación:",
-                    options=['Total del Dataset', 'Acumulado Mensual'],
+                    options=['Total del Dataset', 'Acumulado Mensual', 'Masa Integrada (kg / tCO₂e)'],
                     index=0,
                     help="Seleccione cómo visualizar las emisiones acumuladas"
                 )
@@ -1761,14 +4795,146 @@ with tab2:
                     help="Limitar visualización a principales emisores"
                 )
             
-            if view_mode == 'Total del Dataset':
-                # Calcular acumulado total
-                accumulated_total = df_accumulated.groupby(facility_col)[emission_rate_col].agg(['sum', 'mean', 'count']).round(2)
-                accumulated_total.columns = ['Total Acumulado', 'Promedio', 'Nº Mediciones']
+            if view_mode == 'Masa Integrada (kg / tCO₂e)':
+                # Inventario de masa: una tasa por fuente y pasada, integrada entre pasadas consecutivas
+                if temporal_cube is not None:
+                    col_mass1, col_mass2, col_mass3 = st.columns(3)
+                    
+                    with col_mass1:
+                        persistence_label = st.selectbox(
+                            "Supuesto de persistencia:",
+                            options=list(PERSISTENCE_MODES.keys()),
+                            index=0,
+                            help="Punto medio: cada detección representa la mitad del intervalo con sus vecinas. Siguiente medición: la tasa se mantiene hasta el próximo levantamiento"
+                        )
+                    
+                    with col_mass2:
+                        max_persistence = st.number_input(
+                            "Persistencia máxima (horas):",
+                            min_value=1.0,
+                            max_value=8760.0,
+                            value=INVENTORY_MAX_PERSISTENCE_H,
+                            step=24.0,
+                            help="Límite de horas atribuibles a una detección; aplica también a la primera y última medición de cada fuente"
+                        )
+                    
+                    with col_mass3:
+                        gwp_ch4 = st.number_input(
+                            "GWP CH₄ (100 años):",
+                            min_value=1.0,
+                            value=GWP_CH4,
+                            step=0.1,
+                            help="Potencial de calentamiento global para convertir kg CH₄ a tCO₂e (IPCC AR6: 29.8)"
+                        )
+                    
+                    mass_source_col = 'Fuente' if 'Fuente' in df.columns else None
+                    mass_inventory = integrate_emission_inventory(
+                        df[[facility_col, time_col_available, emission_rate_col] + ([mass_source_col] if mass_source_col else [])],
+                        facility_col, time_col_available, emission_rate_col,
+                        emission_rate_units, PERSISTENCE_MODES[persistence_label], max_persistence, gwp_ch4,
+                        source_col=mass_source_col
+                    )
+                    facility_mass = mass_inventory['facility'].sort_values('tCO2e', ascending=False)
+                    
+                    col_mass_kpi1, col_mass_kpi2, col_mass_kpi3, col_mass_kpi4 = st.columns(4)
+                    with col_mass_kpi1:
+                        st.metric("⚖️ Masa Total CH₄", f"{facility_mass['kg'].sum() / 1000:,.2f} t")
+                    with col_mass_kpi2:
+                        st.metric("🌍 Total tCO₂e", f"{facility_mass['tCO2e'].sum():,.1f}")
+                    with col_mass_kpi3:
+                        st.metric("🏭 Instalaciones", f"{len(facility_mass):,}")
+                    with col_mass_kpi4:
+                        st.metric("⏱️ Horas Representadas", f"{facility_mass['Horas'].sum():,.0f}")
+                    
+                    # Gráfico de barras horizontales por instalación
+                    facility_mass_top = facility_mass.head(top_n_accum)
+                    
+                    fig_mass = go.Figure()
+                    fig_mass.add_trace(go.Bar(
+                        y=facility_mass_top.index[::-1],
+                        x=facility_mass_top['tCO2e'][::-1],
+                        orientation='h',
+                        marker=dict(
+                            color=facility_mass_top['tCO2e'][::-1],
+                            colorscale=[[0, ENERGY_COLORS['success']], [0.5, ENERGY_COLORS['warning']], [1, ENERGY_COLORS['danger']]],
+                            showscale=False
+                        ),
+                        text=facility_mass_top['tCO2e'][::-1].apply(lambda x: f'{x:,.1f}'),
+                        textposition='outside',
+                        customdata=facility_mass_top['kg'][::-1],
+                        hovertemplate='<b>%{y}</b><br>%{x:,.2f} tCO₂e<br>%{customdata:,.0f} kg CH₄<extra></extra>'
+                    ))
+                    fig_mass.update_layout(
+                        title=f"🌍 Top {top_n_accum} Instalaciones - Masa Integrada (tCO₂e)",
+                        xaxis_title="tCO₂e",
+                        yaxis_title="Instalación",
+                        height=max(500, top_n_accum * 35),
+                        template='plotly_white',
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        showlegend=False,
+                        margin=dict(l=250, r=150, t=80, b=80)
+                    )
+                    st.plotly_chart(fig_mass, use_container_width=True)
+                    
+                    # Totales mensuales y anuales
+                    monthly_mass = mass_inventory['monthly']
+                    monthly_mass = monthly_mass[monthly_mass['facility'].isin(facility_mass_top.index)]
+                    monthly_mass_display = pd.DataFrame({
+                        'Instalación': monthly_mass['facility'].to_numpy(),
+                        'Mes': cube_period_start(monthly_mass['period'].to_numpy(), 'month').strftime('%Y-%m'),
+                        'tCO₂e': monthly_mass['tCO2e'].to_numpy()
+                    })
+                    
+                    fig_mass_monthly = px.bar(
+                        monthly_mass_display,
+                        x='Mes',
+                        y='tCO₂e',
+                        color='Instalación',
+                        barmode='stack',
+                        title=f'Masa Integrada Mensual - Top {top_n_accum} Instalaciones'
+                    )
+                    fig_mass_monthly.update_layout(
+                        height=500,
+                        template='plotly_white',
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        xaxis=dict(tickangle=-45)
+                    )
+                    st.plotly_chart(fig_mass_monthly, use_container_width=True)
+                    
+                    st.markdown("#### 📅 Totales Anuales por Instalación (tCO₂e)")
+                    annual_pivot = mass_inventory['annual'].pivot(index='facility', columns='Año', values='tCO2e').fillna(0).round(2)
+                    annual_pivot['TOTAL'] = annual_pivot.sum(axis=1)
+                    annual_pivot = annual_pivot.sort_values('TOTAL', ascending=False)
+                    annual_pivot.index.name = 'Instalación'
+                    st.dataframe(annual_pivot, use_container_width=True, height=400)
+                    
+                    monthly_export = mass_inventory['monthly'].assign(
+                        Mes=cube_period_start(mass_inventory['monthly']['period'].to_numpy(), 'month').strftime('%Y-%m')
+                    )[['facility', 'Mes', 'Año', 'kg', 'tCO2e']].rename(columns={'facility': 'Instalación'})
+                    st.download_button(
+                        label="💾 Descargar inventario mensual (CSV)",
+                        data=monthly_export.to_csv(index=False).encode('utf-8'),
+                        file_name='inventario_masa_mensual.csv',
+                        mime='text/csv',
+                    )
+                    st.caption(f"⚖️ Masa = tasa × horas representadas por cada detección ({persistence_label.lower()}, máx. {max_persistence:,.0f} h); GWP CH₄ = {gwp_ch4}")
+                else:
+                    st.warning("⚠️ No se encontraron datos temporales para integrar la masa emitida")
+                    st.info("💡 Cambie a 'Total del Dataset' para ver la suma de tasas por instalación")
+            
+            elif view_mode == 'Total del Dataset':
+                # Calcular acumulado total por fuente persistente (detecciones repetidas consolidadas)
+                df_accumulated_sources = deduplicate_by_source(df, source_cache_key, facility_col, emission_rate_col)
+                accumulated_total = df_accumulated_sources.groupby(facility_col, observed=True).agg(
+                    **{'Total Acumulado': (emission_rate_col, 'sum'), 'Promedio': (emission_rate_col, 'mean'),
+                       'Nº Fuentes': (emission_rate_col, 'size'), 'Nº Mediciones': ('Detecciones', 'sum')}
+                ).round(2)
                 accumulated_total = accumulated_total.sort_values('Total Acumulado', ascending=False).head(top_n_accum)
                 
                 # Calcular porcentaje del total global
-                total_emissions = df_accumulated[emission_rate_col].sum()
+                total_emissions = df_accumulated_sources[emission_rate_col].sum()
                 accumulated_total['% del Total'] = (accumulated_total['Total Acumulado'] / total_emissions * 100).round(1)
                 
                 # Gráfico de barras horizontales
@@ -1821,7 +4987,8 @@ with tab2:
                 accumulated_display = accumulated_total.copy()
                 accumulated_display.columns = [
                     f'Total Acumulado ({emission_rate_units})',
-                    f'Promedio ({emission_rate_units})',
+                    f'Promedio por fuente ({emission_rate_units})',
+                    'Nº Fuentes',
                     'Nº Mediciones',
                     '% del Total'
                 ]
@@ -1842,7 +5009,7 @@ with tab2:
                         <div style='color: white; font-size: 2.8rem; font-weight: 700; line-height: 1;'>{total_emissions:.2f}</div>
                         <div style='color: rgba(255,255,255,0.9); font-size: 0.95rem; font-weight: 500;'>
                             {emission_rate_units}<br>
-                            <span style='font-size: 0.8rem; opacity: 0.85;'>Dataset completo</span>
+                            <span style='font-size: 0.8rem; opacity: 0.85;'>Σ tasa media por fuente persistente</span>
                         </div>
                     </div>
                     """, unsafe_allow_html=True)
@@ -1898,28 +5065,20 @@ with tab2:
                     """, unsafe_allow_html=True)
                 
             else:  # Acumulado Mensual
-                # Verificar si hay datos temporales
-                time_col_monthly = None
-                if 'scan_datetime_parsed' in df.columns and df['scan_datetime_parsed'].notna().any():
-                    time_col_monthly = 'scan_datetime_parsed'
-                elif 'datetime' in df.columns and df['datetime'].notna().any():
-                    time_col_monthly = 'datetime'
-                
-                if time_col_monthly:
-                    df_monthly = df[[facility_col, emission_rate_col, time_col_monthly]].copy()
-                    df_monthly = df_monthly.dropna()
-                    df_monthly[facility_col] = df_monthly[facility_col].astype(str).str.replace('_', ' ')
-                    
-                    # Extraer año-mes
-                    df_monthly['Año-Mes'] = df_monthly[time_col_monthly].dt.to_period('M').astype(str)
-                    
-                    # Agrupar por instalación y mes
-                    monthly_accum = df_monthly.groupby([facility_col, 'Año-Mes'])[emission_rate_col].sum().reset_index()
-                    monthly_accum.columns = ['Instalación', 'Mes', 'Emisión Mensual']
+                # Reutiliza el cubo temporal de la serie temporal (granularidad mensual)
+                if temporal_cube is not None:
+                    monthly_cube = temporal_cube['month']
                     
                     # Filtrar top N instalaciones por emisión total
-                    top_facilities = df_monthly.groupby(facility_col)[emission_rate_col].sum().nlargest(top_n_accum).index
-                    monthly_accum_filtered = monthly_accum[monthly_accum['Instalación'].isin(top_facilities)]
+                    top_facilities = monthly_cube.groupby('facility', observed=True)['sum'].sum().nlargest(top_n_accum).index
+                    monthly_cube = monthly_cube[monthly_cube['facility'].isin(top_facilities)]
+                    
+                    # Clave entera de mes -> etiqueta Año-Mes solo para visualización
+                    monthly_accum_filtered = pd.DataFrame({
+                        'Instalación': monthly_cube['facility'].to_numpy(),
+                        'Mes': cube_period_start(monthly_cube['period'].to_numpy(), 'month').strftime('%Y-%m'),
+                        'Emisión Mensual': monthly_cube['sum'].to_numpy()
+                    })
                     
                     # Crear gráfico de barras agrupadas por mes
                     fig_monthly = px.bar(
@@ -2002,6 +5161,99 @@ with tab2:
             st.warning("⚠️ No se encontró la columna 'Emission Rate' en los datos")
             st.info("💡 Esta sección requiere datos de tasa de emisión para el análisis")
     
+    # ═══════════════════════════════════════════════════════════════
+    # FUENTES PERSISTENTES (DETECCIONES CONSOLIDADAS)
+    # ═══════════════════════════════════════════════════════════════
+    
+    if 'Fuente' in df.columns and len(df) > 0:
+        st.markdown("---")
+        st.markdown("### 🎯 Fuentes Persistentes")
+        st.caption(f"""
+        Detecciones a menos de **{source_radius_m} m** (encadenadas) se consolidan como una misma fuente física.
+        **Persistencia** = días con detección / días de levantamiento del dataset.
+        """)
+        
+        source_time_col = 'scan_datetime_parsed' if 'scan_datetime_parsed' in df.columns and df['scan_datetime_parsed'].notna().any() else ('datetime' if 'datetime' in df.columns else None)
+        source_rate_col = emission_rate_col if emission_rate_col and emission_rate_col in df.columns else None
+        sources_table = summarize_emission_sources(
+            df, source_cache_key, 'Fuente', facility_col if facility_col and facility_col in df.columns else 'Campo',
+            lat_col, lon_col, ch4_col, source_rate_col, source_time_col
+        )
+        
+        col_src1, col_src2, col_src3 = st.columns(3)
+        with col_src1:
+            st.metric("🎯 Fuentes Persistentes", f"{len(sources_table):,}")
+        with col_src2:
+            st.metric("🔁 Detecciones por Fuente", f"{sources_table['Detecciones'].mean():.1f}")
+        with col_src3:
+            st.metric("📍 Fuentes Recurrentes", f"{(sources_table['Detecciones'] > 1).sum():,}",
+                      help="Fuentes con más de una detección")
+        
+        with st.expander("📋 Tabla de Fuentes Persistentes", expanded=False):
+            sort_col = 'Persistencia %' if 'Persistencia %' in sources_table.columns else 'Detecciones'
+            sources_display = sources_table.sort_values([sort_col, 'Detecciones'], ascending=False).reset_index()
+            st.dataframe(
+                sources_display.round({'Latitud': 6, 'Longitud': 6, 'CH₄ Máximo': 2, 'Rate Promedio': 2, 'Rate Máximo': 2, 'Persistencia %': 1}),
+                use_container_width=True,
+                hide_index=True
+            )
+            st.caption("💡 Las fuentes con alta persistencia y tasa elevada son prioritarias para mitigación")
+    
+    # ═══════════════════════════════════════════════════════════════
+    # PUNTOS CALIENTES GETIS-ORD Gi* (EMISSION RATE)
+    # ═══════════════════════════════════════════════════════════════
+    
+    if 'Gi* Nivel' in df.columns and df['Gi* z'].notna().any():
+        st.markdown("---")
+        st.markdown("### 🔥 Puntos Calientes de Emisión (Getis-Ord Gi*)")
+        st.caption(f"""
+        **Gi\\*** compara la tasa de emisión de cada detección y sus vecinas (a menos de **{hotspot_band_m} m**) con la media global.
+        z ≥ 1.65 / 1.96 / 2.58 → punto caliente con 90% / 95% / 99% de confianza (z negativo → punto frío).
+        """)
+        
+        df_gi = df[df['Gi* z'].notna()]
+        col_gi1, col_gi2, col_gi3 = st.columns(3)
+        with col_gi1:
+            st.metric("🔴 Puntos Calientes", f"{int((df_gi['Gi* Nivel'] > 0).sum()):,}")
+        with col_gi2:
+            st.metric("🔵 Puntos Fríos", f"{int((df_gi['Gi* Nivel'] < 0).sum()):,}")
+        with col_gi3:
+            st.metric("👥 Vecinos Promedio", f"{hotspots['vecinos'][df['Gi* z'].notna().to_numpy()].mean():.1f}")
+        
+        gi_group_col = facility_col if facility_col and facility_col in df.columns else 'Campo'
+        gi_table = df_gi.assign(
+            _caliente=df_gi['Gi* Nivel'] > 0,
+            _frio=df_gi['Gi* Nivel'] < 0
+        ).groupby(gi_group_col, observed=True).agg(**{
+            'Detecciones': ('Gi* z', 'size'),
+            'Puntos Calientes': ('_caliente', 'sum'),
+            'Puntos Fríos': ('_frio', 'sum'),
+            'z Máximo': ('Gi* z', 'max'),
+            'z Promedio': ('Gi* z', 'mean')
+        })
+        gi_table['% Caliente'] = gi_table['Puntos Calientes'] / gi_table['Detecciones'] * 100
+        gi_table = gi_table[(gi_table['Puntos Calientes'] > 0) | (gi_table['Puntos Fríos'] > 0)]
+        gi_table = gi_table.sort_values(['Puntos Calientes', 'z Máximo'], ascending=False).reset_index()
+        
+        if len(gi_table) > 0:
+            st.dataframe(
+                gi_table.round({'z Máximo': 2, 'z Promedio': 2, '% Caliente': 1}),
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.info("ℹ️ No hay agrupaciones espaciales significativas con la banda seleccionada")
+        
+        with st.expander("📋 Detecciones Significativas (Gi*)", expanded=False):
+            detail_cols = [c for c in [facility_col, lat_col, lon_col, emission_rate_col, 'Gi* z'] if c and c in df_gi.columns]
+            df_gi_detail = df_gi[df_gi['Gi* Nivel'] != 0][detail_cols].copy()
+            df_gi_detail.insert(len(detail_cols), 'Clasificación', df_gi['Gi* Nivel'][df_gi['Gi* Nivel'] != 0].map(GI_BIN_LABELS))
+            st.dataframe(
+                df_gi_detail.sort_values('Gi* z', ascending=False).round({'Gi* z': 2}),
+                use_container_width=True,
+                hide_index=True
+            )
+    
     # ═══════════════════════════════════════════════════════════════
     # SECCIÓN DE CONCENTRACIÓN (MANTENIDA COMO APOYO)
     # ═══════════════════════════════════════════════════════════════
@@ -2014,11 +5266,9 @@ with tab2:
         df_plot = df[[facility_col, ch4_col]].copy()
         df_plot = df_plot.dropna()
         
-        # Reemplazar guiones bajos por espacios en Facility Name
-        df_plot[facility_col] = df_plot[facility_col].astype(str).str.replace('_', ' ')
-        
-        # Calcular estadísticas por instalación para ordenar
-        facility_stats = df_plot.groupby(facility_col)[ch4_col].agg(['mean', 'max', 'min', 'count', 'std']).round(2)
+        # Estadísticas de caja por instalación en una pasada (cacheadas): Top N y orden solo re-seleccionan filas
+        facility_box, facility_outliers = grouped_box_statistics(df_plot, facility_col, ch4_col)
+        facility_stats = facility_box[['media', 'máx', 'mín', 'n', 'desv']].round(2)
         facility_stats.columns = ['Promedio', 'Máximo', 'Mínimo', 'Nº Mediciones', 'Desv.Std']
         facility_stats = facility_stats.sort_values('Promedio', ascending=False)
         
@@ -2078,18 +5328,12 @@ with tab2:
             st.markdown("#### Distribución por Instalación (Boxplot)")
             st.caption("Muestra mediana, cuartiles y dispersión de datos sin ruido visual")
             
-            fig_box = go.Figure()
-            
-            for facility in facility_order:
-                facility_data = df_plot_filtered[df_plot_filtered[facility_col] == facility][ch4_col]
-                
-                fig_box.add_trace(go.Box(
-                    y=facility_data,
-                    name=facility,
-                    marker=dict(color=ENERGY_COLORS['primary']),
-                    boxmean='sd',
-                    hovertemplate=f'<b>{facility}</b><br>CH₄: %{{y:.2f}} {ch4_units}<extra></extra>'
-                ))
+            fig_box = go.Figure(precomputed_box_traces(
+                facility_box.loc[facility_order],
+                facility_outliers[facility_outliers['grupo'].isin(facility_order)],
+                ENERGY_COLORS['primary'], f"CH₄ ({ch4_units})",
+                boxmean='sd'
+            ))
             
             fig_box.update_layout(
                 title=f"Distribución de Concentración por Instalación (ordenado por {sort_by})",
@@ -2100,7 +5344,9 @@ with tab2:
                 showlegend=False,
                 xaxis=dict(
                     tickangle=-45,
-                    tickfont=dict(size=10)
+                    tickfont=dict(size=10),
+                    categoryorder='array',
+                    categoryarray=[str(facility) for facility in facility_order]
                 ),
                 margin=dict(b=150)
             )
@@ -2158,25 +5404,44 @@ with tab2:
         
         with viz_tab3:
             st.markdown("#### Barras con Error Bars")
-            st.caption("Comparación de promedios con desviación estándar")
+            error_type = st.radio(
+                "Barra de error:",
+                options=['± Desv. Estándar', f'IC {BOOTSTRAP_CONFIDENCE:.0%} bootstrap de la media'],
+                horizontal=True,
+                key="ch4_error_type"
+            )
+            
+            if error_type == '± Desv. Estándar':
+                st.caption("Comparación de promedios con desviación estándar")
+                error_y = dict(type='data', array=facility_stats_filtered['Desv.Std'], visible=True)
+                error_custom = facility_stats_filtered[['Desv.Std']].to_numpy()
+                error_label = 'Desv.Std: %{customdata[0]:.2f}'
+            else:
+                st.caption(f"Comparación de promedios con IC {BOOTSTRAP_CONFIDENCE:.0%} bootstrap ({BOOTSTRAP_RESAMPLES:,} remuestras)")
+                ch4_ci = bootstrap_facility_ci(df_plot, facility_col, ch4_col)[0].reindex(facility_order)
+                error_y = dict(
+                    type='data',
+                    array=(ch4_ci['IC Sup. Promedio'] - ch4_ci['Promedio']).to_numpy(),
+                    arrayminus=(ch4_ci['Promedio'] - ch4_ci['IC Inf. Promedio']).to_numpy(),
+                    visible=True
+                )
+                error_custom = ch4_ci[['IC Inf. Promedio', 'IC Sup. Promedio']].to_numpy()
+                error_label = 'IC: [%{customdata[0]:.2f} – %{customdata[1]:.2f}]'
             
             fig_bar = go.Figure()
             
             fig_bar.add_trace(go.Bar(
                 x=facility_order,
                 y=facility_stats_filtered['Promedio'],
-                error_y=dict(
-                    type='data',
-                    array=facility_stats_filtered['Desv.Std'],
-                    visible=True
-                ),
+                error_y=error_y,
+                customdata=error_custom,
                 marker=dict(
                     color=facility_stats_filtered['Promedio'],
                     colorscale=[[0, ENERGY_COLORS['success']], [0.5, ENERGY_COLORS['warning']], [1, ENERGY_COLORS['danger']]],
                     showscale=True,
                     colorbar=dict(title=f"CH₄<br>Promedio<br>({ch4_units})")
                 ),
-                hovertemplate='<b>%{x}</b><br>Promedio: %{y:.2f} ' + ch4_units + '<br>Desv.Std: %{error_y.array:.2f}<extra></extra>'
+                hovertemplate='<b>%{x}</b><br>Promedio: %{y:.2f} ' + ch4_units + '<br>' + error_label + '<extra></extra>'
             ))
             
             fig_bar.update_layout(
@@ -2246,15 +5511,12 @@ with tab3:
             
             with col1:
                 # Histograma de distribución de velocidad
+                wind_values = wind_df[wind_wspd].to_numpy(dtype=float)
                 fig_hist = go.Figure()
-                fig_hist.add_trace(go.Histogram(
-                    x=wind_df[wind_wspd],
-                    nbinsx=30,
-                    marker=dict(
-                        color=ENERGY_COLORS['primary'],
-                        line=dict(color=ENERGY_COLORS['secondary'], width=1)
-                    ),
-                    name='Frecuencia'
+                fig_hist.add_trace(histogram_bar_trace(
+                    histogram_bins(wind_values),
+                    ENERGY_COLORS['primary'],
+                    line_color=ENERGY_COLORS['secondary']
                 ))
                 
                 fig_hist.update_layout(
@@ -2270,11 +5532,10 @@ with tab3:
             
             with col2:
                 # Box plot de velocidad
-                fig_box = go.Figure()
-                fig_box.add_trace(go.Box(
-                    y=wind_df[wind_wspd],
-                    name='Velocidad',
-                    marker=dict(color=ENERGY_COLORS['accent']),
+                wind_box_stats, wind_box_outliers = box_statistics(wind_values, 'Velocidad')
+                fig_box = go.Figure(precomputed_box_traces(
+                    wind_box_stats, wind_box_outliers,
+                    ENERGY_COLORS['accent'], 'Velocidad (m/s)',
                     boxmean='sd'
                 ))
                 
@@ -2317,6 +5578,53 @@ with tab3:
                         
                         st.plotly_chart(fig_time, use_container_width=True)
             
+            # Rosa de vientos (dirección × velocidad)
+            wind_wdir = None
+            if wind_source_df is wind_data:
+                wind_wdir = (wind_cols_extended or auto_detect_columns(wind_data))['wdir']
+            elif wdir_col and wdir_col in wind_source_df.columns:
+                wind_wdir = wdir_col
+            
+            if wind_wdir and wind_wdir in wind_source_df.columns:
+                st.markdown("### 🧭 Rosa de Vientos")
+                col_rose1, col_rose2 = st.columns(2)
+                
+                with col_rose1:
+                    wind_rose = build_wind_rose(
+                        pd.to_numeric(wind_source_df[wind_wspd], errors='coerce').to_numpy(),
+                        pd.to_numeric(wind_source_df[wind_wdir], errors='coerce').to_numpy()
+                    )
+                    st.plotly_chart(wind_rose_figure(wind_rose, "Rosa de Vientos - Todas las Observaciones"), use_container_width=True)
+                
+                with col_rose2:
+                    # Rosa por instalación a partir de las detecciones (viento propio o unido desde Extended)
+                    if facility_col and facility_col in df.columns and wspd_col in df.columns and wdir_col in df.columns:
+                        facility_rose = build_wind_rose(
+                            df[wspd_col].to_numpy(dtype=float),
+                            df[wdir_col].to_numpy(dtype=float),
+                            df[facility_col].astype(str).to_numpy()
+                        )
+                        rose_facilities = facility_rose.groupby('grupo')['conteo'].sum()
+                        rose_facilities = rose_facilities[rose_facilities > 0].sort_values(ascending=False).index.tolist()
+                        
+                        if rose_facilities:
+                            rose_facility = st.selectbox(
+                                "Rosa por instalación:",
+                                options=rose_facilities,
+                                index=0,
+                                help="Viento registrado en las detecciones de la instalación, útil para atribuir la fuente"
+                            )
+                            st.plotly_chart(
+                                wind_rose_figure(facility_rose[facility_rose['grupo'] == rose_facility], f"Rosa de Vientos - {rose_facility}"),
+                                use_container_width=True
+                            )
+                        else:
+                            st.info("ℹ️ Las detecciones no tienen dirección de viento asociada")
+                    else:
+                        st.info("ℹ️ Se requiere Facility Name y viento en las detecciones para la rosa por instalación")
+                
+                st.caption("🧭 Dirección de procedencia del viento en 16 sectores de 22.5°; frecuencia en % de observaciones.")
+            
             # Métricas estadísticas
             st.markdown("### 📊 Estadísticas de Velocidad de Viento")
             col1, col2, col3, col4 = st.columns(4)
@@ -2347,77 +5655,328 @@ with tab4:
     
     with col1:
         st.markdown("### 📈 Distribución de Concentración CH₄")
-        fig_hist = px.histogram(df, x=ch4_col, nbins=30, 
-                               color_discrete_sequence=[ENERGY_COLORS['primary']],
-                               labels={ch4_col: f"Concentración CH₄ ({ch4_units})"})
-        fig_hist.update_layout(height=400, showlegend=False, template='plotly_white')
+        ch4_values = df[ch4_col].to_numpy(dtype=float)
+        fig_hist = go.Figure(histogram_bar_trace(histogram_bins(ch4_values), ENERGY_COLORS['primary']))
+        fig_hist.update_layout(height=400, showlegend=False, template='plotly_white',
+                               xaxis_title=f"Concentración CH₄ ({ch4_units})", yaxis_title="Frecuencia")
         st.plotly_chart(fig_hist, use_container_width=True)
     
     with col2:
         st.markdown("### 📊 Box Plot - Distribución")
-        fig_box = px.box(df, y=ch4_col, color_discrete_sequence=[ENERGY_COLORS['secondary']],
-                        labels={ch4_col: f"Concentración CH₄ ({ch4_units})"})
-        fig_box.update_layout(height=400, showlegend=False, template='plotly_white')
+        ch4_box_stats, ch4_box_outliers = box_statistics(ch4_values, ch4_col)
+        fig_box = go.Figure(precomputed_box_traces(ch4_box_stats, ch4_box_outliers,
+                                                   ENERGY_COLORS['secondary'], f"CH₄ ({ch4_units})"))
+        fig_box.update_layout(height=400, showlegend=False, template='plotly_white',
+                              yaxis_title=f"Concentración CH₄ ({ch4_units})")
         st.plotly_chart(fig_box, use_container_width=True)
     
+    # Diccionario canónico de instalaciones: variantes fusionadas por la normalización
+    if facility_index is not None:
+        merged_aliases = facility_index['aliases'][facility_index['aliases'].duplicated('Instalación', keep=False)]
+        with st.expander(f"🏷️ Normalización de Instalaciones ({len(facility_index['names']):,} canónicas, "
+                         f"{len(facility_index['aliases']):,} variantes)", expanded=False):
+            if len(merged_aliases) > 0:
+                st.dataframe(merged_aliases.sort_values(['Instalación', 'Registros'], ascending=[True, False]),
+                             use_container_width=True, hide_index=True)
+            else:
+                st.info("ℹ️ Todas las variantes de nombre ya eran únicas; no se fusionaron instalaciones")
+    
+    # Percentiles por campo desde los sketches (fusión de instalaciones) y fusión entre reportes
+    if sketch_cols:
+        with st.expander("🧮 Percentiles por Campo (sketches de cuantiles fusionables)", expanded=False):
+            st.caption(f"Cuantiles con error relativo ≤ {SKETCH_RELATIVE_ACCURACY:.0%}, obtenidos fusionando los sketches por instalación; "
+                       "exporte los sketches para combinarlos con los de otros reportes sin volver a leer sus filas.")
+            campo_of_group = pd.Series(campo_by_code, index=np.append(facility_index['names'], SKETCH_UNKNOWN_GROUP)) if facility_index is not None else None
+            sketch_campos = sorted(set(campo_of_group)) if campo_of_group is not None else ['Todos']
+            percentile_rows = []
+            for col in sketch_cols:
+                for campo in sketch_campos:
+                    groups = campo_of_group.index[campo_of_group == campo].tolist() if campo_of_group is not None else None
+                    merged = merge_quantile_sketches([quantile_sketches[col]], groups, label=campo)
+                    if merged['summary']['n'].iat[0] == 0:
+                        continue
+                    q = sketch_quantiles(merged, [0.5, 0.75, 0.95, 0.99]).iloc[0]
+                    percentile_rows.append({'Variable': col, 'Campo': campo, 'N': int(merged['summary']['n'].iat[0]),
+                                            'P50': q[0.5], 'P75': q[0.75], 'P95': q[0.95], 'P99': q[0.99]})
+            st.dataframe(pd.DataFrame(percentile_rows).round(2), use_container_width=True, hide_index=True)
+            
+            previous_sketches = st.file_uploader("Fusionar con sketches de otros reportes (CSV):", type=["csv"],
+                                                 accept_multiple_files=True, key="sketch_merge_files")
+            if previous_sketches:
+                loaded = [sketches_from_frame(pd.read_csv(f)) for f in previous_sketches]
+                merged_rows = []
+                for col in sketch_cols:
+                    parts = [quantile_sketches[col]] + [sk[col] for sk in loaded if col in sk]
+                    merged = merge_quantile_sketches(parts, label='Combinado')
+                    q = sketch_quantiles(merged, [0.5, 0.75, 0.95, 0.99]).iloc[0]
+                    merged_rows.append({'Variable': col, 'Reportes': len(parts), 'N': int(merged['summary']['n'].iat[0]),
+                                        'P50': q[0.5], 'P75': q[0.75], 'P95': q[0.95], 'P99': q[0.99]})
+                st.dataframe(pd.DataFrame(merged_rows).round(2), use_container_width=True, hide_index=True)
+            
+            st.download_button(
+                label="💾 Exportar sketches de cuantiles (CSV)",
+                data=sketches_to_frame(quantile_sketches).to_csv(index=False).encode('utf-8'),
+                file_name='sketches_cuantiles.csv',
+                mime='text/csv',
+            )
+    
     st.markdown("### 📋 Tabla de Datos Completos")
-    st.dataframe(df, use_container_width=True, height=400)
+    st.caption("Orden, filtro y paginación se resuelven en el servidor: solo se envía al navegador la página visible.")
     
-    # Botón de descarga
-    csv = df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="💾 Descargar datos procesados (CSV)",
-        data=csv,
-        file_name='datos_procesados_emisiones.csv',
-        mime='text/csv',
+    table_columns = df.columns.tolist()
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    with col1:
+        shown_columns = st.multiselect("Columnas visibles:", options=table_columns, default=table_columns,
+                                       key="table_columns")
+    with col2:
+        table_sort_col = st.selectbox("Ordenar por:", options=["(orden original)"] + table_columns,
+                                      key="table_sort_col")
+    with col3:
+        table_ascending = st.radio("Sentido:", options=["↑ Asc.", "↓ Desc."], horizontal=True,
+                                   key="table_sort_dir") == "↑ Asc."
+    with col4:
+        table_page_size = st.selectbox("Filas por página:", options=TABLE_PAGE_SIZES,
+                                       index=TABLE_PAGE_SIZES.index(TABLE_DEFAULT_PAGE_SIZE), key="table_page_size")
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        table_filter_col = st.selectbox("Filtrar columna:", options=["(sin filtro)"] + table_columns,
+                                        key="table_filter_col")
+    table_mask = None
+    with col2:
+        if table_filter_col != "(sin filtro)":
+            filter_values = df[table_filter_col]
+            if pd.api.types.is_numeric_dtype(filter_values) and not pd.api.types.is_bool_dtype(filter_values):
+                col_lo, col_hi = (float(filter_values.min()), float(filter_values.max())) if filter_values.notna().any() else (0.0, 0.0)
+                sub1, sub2 = st.columns(2)
+                with sub1:
+                    filter_lo = st.number_input("Desde:", value=col_lo, key=f"table_filter_lo_{table_filter_col}")
+                with sub2:
+                    filter_hi = st.number_input("Hasta:", value=col_hi, key=f"table_filter_hi_{table_filter_col}")
+                table_mask = table_filter_mask(filter_values, bounds=(filter_lo, filter_hi))
+            else:
+                filter_query = st.text_input("Contiene:", key=f"table_filter_query_{table_filter_col}").strip()
+                if filter_query:
+                    table_mask = table_filter_mask(filter_values, query=filter_query)
+    
+    # Páginas del filtro activo: el selector nunca muestra una página inexistente
+    filtered_rows = int(table_mask.sum()) if table_mask is not None else len(df)
+    filtered_pages = max(1, -(-filtered_rows // table_page_size))
+    if st.session_state.get('table_page', 1) > filtered_pages:
+        st.session_state['table_page'] = filtered_pages
+    table_page = st.number_input("Página:", min_value=1, max_value=filtered_pages, step=1, key="table_page")
+    page_df, table_rows, table_page, table_pages = paginate_table(
+        df, shown_columns or table_columns,
+        sort_col=None if table_sort_col == "(orden original)" else table_sort_col,
+        ascending=table_ascending, mask=table_mask, page=table_page, page_size=table_page_size
     )
+    st.dataframe(page_df, use_container_width=True, height=400)
+    first_row = (table_page - 1) * table_page_size + 1 if table_rows else 0
+    st.caption(f"📄 Página {table_page:,} de {table_pages:,} · filas {first_row:,}–"
+               f"{min(table_page * table_page_size, table_rows):,} de {table_rows:,} filtradas "
+               f"({len(df):,} en el dataset)")
+    
+    # Exportación bajo demanda: el archivo solo se genera al pedirlo; los bytes quedan en la sesión
+    # (los reruns no vuelven a hashear df ni a leer la caché) y la caché compartida usa una clave barata
+    st.markdown("### 💾 Exportar Datos Procesados")
+    export_label = st.selectbox("Formato de exportación:", options=list(EXPORT_FORMATS), key="export_format")
+    export_ext, export_mime = EXPORT_FORMATS[export_label]
+    export_state = (file_key, clean_key, selected_campo, float(source_radius_m), float(hotspot_band_m),
+                    tuple(df.columns), export_ext)
+    if st.button("⚙️ Generar archivo", key="export_prepare"):
+        with st.spinner(f"Generando {export_label} ({len(df):,} filas)..."):
+            st.session_state['export_file'] = {
+                'state': export_state, 'data': build_export(df, export_state, export_ext, lat_col, lon_col)
+            }
+    
+    export_file = st.session_state.get('export_file')
+    if export_file is not None and export_file['state'] == export_state:
+        st.download_button(
+            label=f"💾 Descargar datos procesados ({export_label}, {len(export_file['data']) / 1e6:,.1f} MB)",
+            data=export_file['data'],
+            file_name=f'datos_procesados_emisiones.{export_ext}',
+            mime=export_mime,
+        )
+    else:
+        st.caption("El archivo se genera al pulsar **Generar archivo** y se reutiliza mientras no cambien los filtros ni el formato.")
 
 # ══════════════════════════════════════════════════════════════════════
-# FUNCIÓN PLACEHOLDER: COMPARACIÓN ECOPETROL VS CARLETON
+# 6.5 COMPARACIÓN METODOLÓGICA: ECOPETROL VS CARLETON
 # ══════════════════════════════════════════════════════════════════════
 
-def layout_comparacion_ecopetrol_carleton():
+def layout_comparacion_ecopetrol_carleton(df_reference, facility_col, rate_col, rate_units):
     """
     Módulo de comparación entre metodologías Ecopetrol y Carleton
-    
-    PENDIENTE: Implementar análisis comparativo de:
-    - Diferencias metodológicas en cuantificación
-    - Comparación de resultados por instalación
-    - Análisis de desviaciones y factores de reconciliación
-    - Gráficas de correlación entre ambas metodologías
+    - Carga local (sin red) del inventario Carleton en CSV o Excel
+    - Emparejamiento de instalaciones por nombre normalizado + bloqueo por trigramas
+    - Deltas por instalación, regresión con R² y factores de reconciliación
     """
     st.markdown("---")
     st.markdown("### 🔬 Comparación Metodológica: Ecopetrol vs Carleton")
+    st.caption("""
+    **Ecopetrol:** dataset activo (tasa de emisión por instalación) | **Carleton University:** inventario cargado por el usuario.
+    Las instalaciones se emparejan por nombre normalizado (tildes, mayúsculas, separadores) y similitud de trigramas.
+    """)
     
-    st.info("""
-    **📋 Módulo en preparación**
+    if not facility_col or facility_col not in df_reference.columns or not rate_col or rate_col not in df_reference.columns:
+        st.info("ℹ️ La comparación requiere columnas Facility Name y Emission Rate en el dataset activo")
+        return
     
-    Esta sección incluirá análisis comparativo entre las metodologías:
-    - **Ecopetrol:** Mediciones y cuantificación corporativa
-    - **Carleton University:** Metodología académica internacional
+    carleton_file = st.file_uploader(
+        "Inventario Carleton (CSV o Excel):",
+        type=["csv", "xlsx"],
+        key="carleton_inventory",
+        help="Archivo con una fila por instalación (o por medición) con nombre de instalación y tasa de emisión"
+    )
+    if carleton_file is None:
+        st.info("⬆️ Cargue el inventario Carleton para calcular deltas, regresión y factores de reconciliación")
+        return
     
-    **Análisis planificados:**
-    - ✅ Comparación de tasas de emisión por instalación
-    - ✅ Identificación de desviaciones sistemáticas
-    - ✅ Factores de ajuste y reconciliación
-    - ✅ Validación cruzada de resultados
-    - ✅ Análisis estadístico de correlación
+    carleton = load_comparison_inventory(carleton_file.getvalue(), carleton_file.name)
+    detected = auto_detect_columns(carleton)
+    carleton_columns = carleton.columns.tolist()
     
-    *Estado: En desarrollo | Disponible próximamente*
-    """)
+    col_cfg1, col_cfg2, col_cfg3, col_cfg4 = st.columns(4)
+    with col_cfg1:
+        carleton_facility = st.selectbox(
+            "Columna de instalación:", carleton_columns,
+            index=carleton_columns.index(detected['facility']) if detected['facility'] in carleton_columns else 0,
+            key="carleton_facility_col"
+        )
+    with col_cfg2:
+        carleton_rate = st.selectbox(
+            "Columna de tasa:", carleton_columns,
+            index=carleton_columns.index(detected['emission_rate']) if detected['emission_rate'] in carleton_columns else 0,
+            key="carleton_rate_col"
+        )
+    with col_cfg3:
+        rate_name = str(carleton_rate).lower()
+        detected_units = 'g/s' if 'g/s' in rate_name else ('t/h' if 't/h' in rate_name or 'ton/h' in rate_name else 'kg/h')
+        carleton_units = st.selectbox(
+            "Unidades Carleton:", list(RATE_TO_KG_PER_HOUR.keys()),
+            index=list(RATE_TO_KG_PER_HOUR.keys()).index(detected_units),
+            key="carleton_rate_units"
+        )
+    with col_cfg4:
+        comparison_stat = st.selectbox(
+            "Agregación por instalación:", ['Promedio', 'Total'],
+            key="carleton_stat",
+            help="Promedio: tasa típica por instalación | Total: suma de todas las mediciones"
+        )
     
-    # Placeholder para gráficas futuras
-    col1, col2 = st.columns(2)
+    min_similarity = st.slider(
+        "Similitud mínima para emparejamiento aproximado:",
+        min_value=0.4, max_value=1.0, value=MATCH_MIN_SCORE, step=0.05,
+        key="carleton_min_similarity"
+    )
     
-    with col1:
-        st.markdown("#### 📊 Comparación de Tasas de Emisión")
-        st.caption("*Gráfico comparativo Ecopetrol vs Carleton por instalación*")
-        st.image("https://via.placeholder.com/400x300/1ABC9C/FFFFFF?text=Gr%C3%A1fico+en+Desarrollo", use_container_width=True)
+    # Agregación por clave normalizada en kg/h
+    stat = 'mean' if comparison_stat == 'Promedio' else 'sum'
+    ecopetrol = df_reference[[facility_col, rate_col]].dropna()
+    carleton = carleton[[carleton_facility, carleton_rate]].assign(
+        **{carleton_rate: pd.to_numeric(carleton[carleton_rate], errors='coerce')}
+    ).dropna()
+    totals_ecopetrol = (
+        ecopetrol[rate_col].groupby(normalize_facility_name(ecopetrol[facility_col]).to_numpy()).agg(stat)
+        * RATE_TO_KG_PER_HOUR.get(rate_units, 1.0)
+    )
+    totals_carleton = (
+        carleton[carleton_rate].groupby(normalize_facility_name(carleton[carleton_facility]).to_numpy()).agg(stat)
+        * RATE_TO_KG_PER_HOUR[carleton_units]
+    )
     
-    with col2:
+    matches = match_facility_names(
+        ecopetrol[facility_col].astype(str).unique(),
+        carleton[carleton_facility].astype(str).unique(),
+        min_similarity
+    )
+    if len(matches) == 0:
+        st.warning("⚠️ No se encontraron instalaciones comunes entre ambos inventarios")
+        return
+    
+    reconciliation, stats = reconcile_inventories(matches, totals_ecopetrol, totals_carleton)
+    reconciliation = reconciliation.rename(columns={
+        'A': 'Ecopetrol (kg/h)', 'B': 'Carleton (kg/h)', 'Instalación (B)': 'Instalación Carleton',
+        'Δ (B − A)': 'Δ Carleton − Ecopetrol (kg/h)', 'Factor A/B': 'Factor Ecopetrol/Carleton'
+    })
+    
+    col_rec1, col_rec2, col_rec3, col_rec4 = st.columns(4)
+    with col_rec1:
+        st.metric("🔗 Instalaciones Emparejadas", f"{len(matches):,} / {len(totals_ecopetrol):,}",
+                  help=f"{int((matches['método'] == 'Aproximado').sum())} por similitud aproximada")
+    with col_rec2:
+        st.metric("📈 R²", f"{stats['r2']:.3f}" if np.isfinite(stats['r2']) else "N/A")
+    with col_rec3:
+        st.metric("📐 Pendiente (Carleton/Ecopetrol)", f"{stats['pendiente']:.3f}" if np.isfinite(stats['pendiente']) else "N/A")
+    with col_rec4:
+        st.metric("⚖️ Factor de Reconciliación", f"{stats['factor_global']:.3f}" if np.isfinite(stats['factor_global']) else "N/A",
+                  help=f"Σ Ecopetrol / Σ Carleton. Mediana por instalación: {stats['factor_mediana']:.3f}")
+    
+    col_plot1, col_plot2 = st.columns(2)
+    with col_plot1:
         st.markdown("#### 📈 Análisis de Correlación")
-        st.caption("*Scatter plot con línea de tendencia y R²*")
-        st.image("https://via.placeholder.com/400x300/3498DB/FFFFFF?text=An%C3%A1lisis+Pendiente", use_container_width=True)
+        fig_rec = go.Figure()
+        fig_rec.add_trace(go.Scatter(
+            x=reconciliation['Ecopetrol (kg/h)'], y=reconciliation['Carleton (kg/h)'],
+            mode='markers', text=reconciliation['Instalación'].astype(str),
+            marker=dict(size=9, color=reconciliation['Similitud'],
+                        colorscale=[[0, ENERGY_COLORS['warning']], [1, ENERGY_COLORS['primary']]],
+                        colorbar=dict(title="Similitud")),
+            hovertemplate='<b>%{text}</b><br>Ecopetrol: %{x:.2f} kg/h<br>Carleton: %{y:.2f} kg/h<extra></extra>',
+            name='Instalaciones'
+        ))
+        axis_max = float(np.nanmax(reconciliation[['Ecopetrol (kg/h)', 'Carleton (kg/h)']].to_numpy()))
+        fig_rec.add_trace(go.Scatter(x=[0, axis_max], y=[0, axis_max], mode='lines',
+                                     line=dict(color=ENERGY_COLORS['dark'], dash='dash'), name='1:1'))
+        if np.isfinite(stats['pendiente']):
+            fig_rec.add_trace(go.Scatter(
+                x=[0, axis_max], y=[stats['intercepto'], stats['intercepto'] + stats['pendiente'] * axis_max],
+                mode='lines', line=dict(color=ENERGY_COLORS['danger']),
+                name=f"Regresión (R² = {stats['r2']:.3f})"
+            ))
+        fig_rec.update_layout(height=450, template='plotly_white',
+                              xaxis_title="Ecopetrol (kg/h)", yaxis_title="Carleton (kg/h)")
+        st.plotly_chart(fig_rec, use_container_width=True)
+    
+    with col_plot2:
+        st.markdown("#### 📊 Mayores Diferencias por Instalación")
+        top_delta = reconciliation.reindex(reconciliation['Δ Carleton − Ecopetrol (kg/h)'].abs().sort_values(ascending=False).index).head(15)
+        fig_delta = go.Figure(go.Bar(
+            x=top_delta['Δ Carleton − Ecopetrol (kg/h)'], y=top_delta['Instalación'].astype(str),
+            orientation='h',
+            marker_color=np.where(top_delta['Δ Carleton − Ecopetrol (kg/h)'] > 0, ENERGY_COLORS['danger'], ENERGY_COLORS['success']),
+            hovertemplate='<b>%{y}</b><br>Δ: %{x:.2f} kg/h<extra></extra>'
+        ))
+        fig_delta.update_layout(height=450, template='plotly_white', xaxis_title="Carleton − Ecopetrol (kg/h)",
+                                yaxis=dict(autorange='reversed'))
+        st.plotly_chart(fig_delta, use_container_width=True)
+    
+    st.dataframe(
+        reconciliation.round({'Similitud': 2, 'Ecopetrol (kg/h)': 2, 'Carleton (kg/h)': 2, 'Δ Carleton − Ecopetrol (kg/h)': 2, 'Δ %': 1, 'Factor Ecopetrol/Carleton': 3}),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    with st.expander("🔍 Instalaciones sin Emparejar", expanded=False):
+        col_un1, col_un2 = st.columns(2)
+        with col_un1:
+            st.markdown("**Solo en Ecopetrol**")
+            st.dataframe(pd.DataFrame({'Instalación': sorted(set(totals_ecopetrol.index) - set(matches['key_a']))}),
+                         use_container_width=True, hide_index=True)
+        with col_un2:
+            st.markdown("**Solo en Carleton**")
+            st.dataframe(pd.DataFrame({'Instalación': sorted(set(totals_carleton.index) - set(matches['key_b']))}),
+                         use_container_width=True, hide_index=True)
+    
+    st.download_button(
+        label="💾 Descargar reconciliación (CSV)",
+        data=reconciliation.to_csv(index=False).encode('utf-8'),
+        file_name='reconciliacion_ecopetrol_carleton.csv',
+        mime='text/csv',
+    )
+
+with tab2:
+    layout_comparacion_ecopetrol_carleton(df, facility_col, emission_rate_col, emission_rate_units)
 
 # ══════════════════════════════════════════════════════════════════════
 # FIN DEL DASHBOARD